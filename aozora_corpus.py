@@ -0,0 +1,262 @@
+"""
+作家ごとの整形済みコーパス（1作家1ファイル）の読み書き
+
+作品名などのメタデータは作品ごとに1回だけ持ち、本文は行の開始位置の配列と
+UTF-8のテキストに分けて保存する。ファイルは mmap で開くので、1作品や
+行の範囲を読むときはファイル全体を解析せずにその部分だけを読み込む。
+
+ファイル形式（リトルエンディアン）:
+    magic b'AOZC' | version (uint32) | header_size (uint64)
+    header  : UTF-8 の JSON（author_id, author_name, n_lines, works）
+              works の各要素は {'title', 'file', 'start', 'count'}
+    （8バイト境界まで0埋め）
+    offsets : uint64 × (n_lines + 1)  各行の text 内での開始位置
+    text    : UTF-8 の本文（各行の末尾に改行）
+
+本文から削除したルビ・入力者注は、コーパスの横（corpus.markup.npz）に
+作品ごとの文字位置の配列として保存する（MarkupIndex で読む）。
+"""
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b'AOZC'
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct('<4sIQ')
+
+# ルビ・入力者注の種類
+RUBY = 0
+ANNOTATION = 1
+MARKUP_KINDS = {RUBY: 'ruby', ANNOTATION: 'annotation'}
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+def write_corpus(path, author_id, author_name, works):
+    """
+    works: (title, file, lines) のイテレータ（lines は整形後の行のイテレータ）
+    本文は一時ファイルに書き出しながら行の開始位置を記録し、最後に1ファイルにまとめる
+    """
+    path = Path(path)
+    meta = []
+    offsets = [0]
+    with tempfile.TemporaryFile(dir=path.parent) as text_tmp:
+        pos = 0
+        for title, file_name, lines in works:
+            start = len(offsets) - 1
+            for line in lines:
+                data = line.encode('utf-8') + b'\n'
+                text_tmp.write(data)
+                pos += len(data)
+                offsets.append(pos)
+            meta.append({'title': title, 'file': file_name,
+                         'start': start, 'count': len(offsets) - 1 - start})
+
+        header = json.dumps({
+            'author_id': author_id,
+            'author_name': author_name,
+            'n_lines': len(offsets) - 1,
+            'works': meta,
+        }, ensure_ascii=False).encode('utf-8')
+        header_end = _align8(PREAMBLE.size + len(header))
+
+        # 途中で止まっても壊れないように一時ファイルから置き換える
+        tmp_path = Path(str(path) + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+            f.write(header)
+            f.write(b'\0' * (header_end - PREAMBLE.size - len(header)))
+            f.write(np.asarray(offsets, dtype='<u8').tobytes())
+            text_tmp.seek(0)
+            shutil.copyfileobj(text_tmp, f)
+        os.replace(tmp_path, path)
+    return len(meta)
+
+
+def markup_index_file(corpus_path):
+    """コーパスに対応するルビ・入力者注の索引ファイル"""
+    return Path(corpus_path).with_suffix('.markup.npz')
+
+
+def write_markup_index(path, works):
+    """
+    works: コーパスの作品順に並んだ、作品ごとの [(start, end, kind, value), ...]
+    （start / end は作品の本文での文字位置）
+    種類ごとに、作品の区切り（ptr）、開始位置順の start / end、値（UTF-8をつないだもの）の
+    配列にして保存する
+    """
+    arrays = {}
+    for kind, name in MARKUP_KINDS.items():
+        ptr = [0]
+        starts, ends, values = [], [], []
+        for entries in works:
+            for start, end, _, value in sorted(e for e in entries if e[2] == kind):
+                starts.append(start)
+                ends.append(end)
+                values.append(value.encode('utf-8'))
+            ptr.append(len(starts))
+        arrays[f'{name}_ptr'] = np.asarray(ptr, dtype=np.int64)
+        arrays[f'{name}_start'] = np.asarray(starts, dtype=np.int64)
+        arrays[f'{name}_end'] = np.asarray(ends, dtype=np.int64)
+        arrays[f'{name}_value_offsets'] = np.cumsum([0] + [len(v) for v in values], dtype=np.int64)
+        arrays[f'{name}_values'] = np.frombuffer(b''.join(values), dtype=np.uint8)
+    # 途中で止まっても壊れないように一時ファイルから置き換える
+    tmp_path = Path(str(path) + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+class MarkupIndex:
+    """
+    write_markup_index で作った索引を読む
+    作品番号（コーパスの作品順）と本文での文字位置から二分探索で引く
+    """
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self._arrays = {key: data[key] for key in data.files}
+
+    def _get(self, name, i):
+        offsets = self._arrays[f'{name}_value_offsets']
+        values = self._arrays[f'{name}_values']
+        return (int(self._arrays[f'{name}_start'][i]), int(self._arrays[f'{name}_end'][i]),
+                values[offsets[i]:offsets[i + 1]].tobytes().decode('utf-8'))
+
+    def _work_range(self, name, work):
+        ptr = self._arrays[f'{name}_ptr']
+        return int(ptr[work]), int(ptr[work + 1])
+
+    def count(self, work, kind=RUBY):
+        lo, hi = self._work_range(MARKUP_KINDS[kind], work)
+        return hi - lo
+
+    def reading_at(self, work, offset):
+        """本文の offset 文字目に付いたルビを (start, end, reading) で返す（無ければNone）"""
+        lo, hi = self._work_range('ruby', work)
+        starts = self._arrays['ruby_start']
+        i = lo + int(np.searchsorted(starts[lo:hi], offset, side='right')) - 1
+        if i >= lo and offset < self._arrays['ruby_end'][i]:
+            return self._get('ruby', i)
+        return None
+
+    def annotations_between(self, work, start, stop):
+        """開始位置が start 以上 stop 未満の入力者注を (start, end, note) のリストで返す"""
+        lo, hi = self._work_range('annotation', work)
+        starts = self._arrays['annotation_start'][lo:hi]
+        first = lo + int(np.searchsorted(starts, start, side='left'))
+        last = lo + int(np.searchsorted(starts, stop, side='left'))
+        return [self._get('annotation', i) for i in range(first, last)]
+
+    def entries(self, work, kind=RUBY):
+        """作品のルビ（または入力者注）を開始位置順にすべて返す"""
+        name = MARKUP_KINDS[kind]
+        lo, hi = self._work_range(name, work)
+        return [self._get(name, i) for i in range(lo, hi)]
+
+
+class CorpusReader:
+    """write_corpus で作ったコーパスを mmap で読む"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_size = PREAMBLE.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mm.close()
+            raise ValueError(f'{self.path} はコーパスファイルではありません（version {version}）')
+        header = json.loads(self._mm[PREAMBLE.size:PREAMBLE.size + header_size].decode('utf-8'))
+        self.author_id = header['author_id']
+        self.author_name = header['author_name']
+        self.works = header['works']
+        self.n_lines = header['n_lines']
+        offsets_pos = _align8(PREAMBLE.size + header_size)
+        self._offsets = np.frombuffer(self._mm, dtype='<u8', count=self.n_lines + 1,
+                                      offset=offsets_pos)
+        self._text_pos = offsets_pos + self._offsets.nbytes
+        self._by_title = {}
+        for i, work in enumerate(self.works):
+            self._by_title.setdefault(work['title'], i)
+        self._markup = None
+
+    def close(self):
+        # np.frombuffer の参照が残っていると mmap を閉じられない
+        self._offsets = None
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.works)
+
+    def __contains__(self, title):
+        return title in self._by_title
+
+    def titles(self):
+        """作品名のリスト（登録順）"""
+        return [work['title'] for work in self.works]
+
+    def work(self, title):
+        """作品名からメタデータ（title, file, start, count）を返す"""
+        return self.works[self._by_title[title]]
+
+    def work_number(self, title):
+        """作品名から作品番号（登録順、MarkupIndex で使う）を返す"""
+        return self._by_title[title]
+
+    @property
+    def markup(self):
+        """ルビ・入力者注の索引（索引ファイルが無ければNone）"""
+        if self._markup is None and markup_index_file(self.path).exists():
+            self._markup = MarkupIndex(markup_index_file(self.path))
+        return self._markup
+
+    def reading_at(self, title, offset):
+        """作品の本文（text() の文字列）の offset 文字目に付いたルビを (start, end, reading) で返す"""
+        if self.markup is None:
+            return None
+        return self.markup.reading_at(self.work_number(title), offset)
+
+    def _read(self, first, last):
+        """コーパス全体での行番号 first から last の直前までを、改行を含めたまま返す"""
+        begin = self._text_pos + int(self._offsets[first])
+        end = self._text_pos + int(self._offsets[last])
+        return self._mm[begin:end].decode('utf-8')
+
+    def lines(self, title, start=0, stop=None):
+        """作品の start 行目から stop 行目の直前までの行のリスト"""
+        work = self.work(title)
+        start, stop, _ = slice(start, stop).indices(work['count'])
+        if start >= stop:
+            return []
+        return self._read(work['start'] + start, work['start'] + stop).split('\n')[:-1]
+
+    def _work_text(self, work, sep='\n'):
+        """作品のメタデータの行の範囲の本文"""
+        text = self._read(work['start'], work['start'] + work['count'])[:-1]
+        return text if sep == '\n' else text.replace('\n', sep)
+
+    def text(self, title, sep='\n'):
+        """作品全体の本文（行を sep でつないだ文字列、同じ作品名が複数あれば最初の作品）"""
+        return self._work_text(self.work(title), sep)
+
+    def iter_works(self):
+        """
+        (title, text) を登録順に返す
+        （本文は作品ごとの行の範囲から読むので、同じ作品名の別の作品もそれぞれの本文になる）
+        """
+        for work in self.works:
+            yield work['title'], self._work_text(work)
@@ -1,124 +1,737 @@
 import pandas as pd
 from pathlib import Path
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
 import zipfile
 
+from aozora_corpus import ANNOTATION, RUBY, markup_index_file, write_corpus, write_markup_index
+
 author_id = '000879'  # 青空文庫の作家番号
 author_name = '芥川龍之介'  # 青空文庫の表記での作家名
 
 write_title = True  # 2カラム目に作品名を入れるか
 write_header = True  # 1行目をカラム名にするか（カラム名「text」「title」）
 save_utf8_org = True  # 元データをUTF-8にしたテキストファイルを保存するか
+save_markup = True  # 削除したルビ・入力者注を位置付きで保存するか
+resolve_gaiji = True  # 外字注記（※［＃「…」、第3水準1-85-xx］）を対応するUnicodeの文字に置き換えるか
+max_workers = None  # 並列処理のプロセス数（Noneならos.cpu_count()、1なら並列化しない）
+
+catalog_file = Path('./authors.tsv')  # 一括処理する作家の一覧（作家番号 → 作家名）
+gaiji_table_file = Path(__file__).with_name('gaiji_table.tsv')  # 外字の対応表（make_gaiji_table.pyで作成）
+
+
+def author_out_dir(author_id):
+    """作家ごとのファイル出力先"""
+    return Path(f'./out_{author_id}/')
+
+
+def author_files_dir(author_id):
+    """作家ごとのzipファイルのディレクトリ"""
+    return Path(author_id) / 'files'
+
 
-out_dir = Path(f'./out_{author_id}/')  # ファイル出力先
+def author_corpus_file(author_id):
+    """作家ごとの整形済みコーパス（aozora_corpus の形式）"""
+    return author_out_dir(author_id) / 'corpus.aozc'
+
+
+out_dir = author_out_dir(author_id)  # ファイル出力先
 tx_org_dir = Path(out_dir / './org/')  # 元テキストのUTF-8変換ファイルの保存先
 tx_edit_dir = Path(out_dir / './edit/')  # テキスト整形後のファイル保存先
+report_file = Path(out_dir / 'ingest_report.tsv')  # ファイルごとの処理結果（エラー）の一覧
+manifest_file = Path(out_dir / 'manifest.json')  # 処理済みZIPファイルのハッシュと出力先の記録
 
+# 整形処理のバージョン（整形規則や出力形式を変えたら上げると、全作品が作り直される）
+CLEANSER_VERSION = '6'
 
-def text_cleanse_df(df):
-      # 本文の先頭を探す（'---…'区切りの直後から本文が始まる前提）
-    head_tx = list(df[df['text'].str.contains(
-        '-------------------------------------------------------')].index)
-    # 本文の末尾を探す（'底本：'の直前に本文が終わる前提）
-    atx = list(df[df['text'].str.contains('底本：')].index)
-    if head_tx == []:
-        # もし'---…'区切りが無い場合は、作家名の直後に本文が始まる前提
-          head_tx = list(df[df['text'].str.contains(author_name)].index)
-          head_tx_num = head_tx[0] - 1
-          df_e = df[head_tx_num:atx[0]]
-    else:
-        # 2個目の'---…'区切り直後から本文が始まる
-          additional_intro = df[max(0,head_tx[0]) -1:head_tx[0]]
-          main_text = df[head_tx[1] + 1:atx[0]]
-          df_e = pd.concat([additional_intro, main_text])
-    
-
-    # 青空文庫の書式削除
-    df_e = df_e.replace({'text': {'《.*?》': ''}}, regex=True)
-    df_e = df_e.replace({'text': {'［.*?］': ''}}, regex=True)
-    df_e = df_e.replace({'text': {'｜': ''}}, regex=True)
-
-    # 字下げ（行頭の全角スペース）を削除
-    df_e = df_e.replace({'text': {'　': ''}}, regex=True)
-
-    # 節区切りを削除
-    df_e = df_e.replace({'text': {'^.$': ''}}, regex=True)
-    df_e = df_e.replace({'text': {'^―――.*$': ''}}, regex=True)
-    df_e = df_e.replace({'text': {'^＊＊＊.*$': ''}}, regex=True)
-    df_e = df_e.replace({'text': {'^×××.*$': ''}}, regex=True)
+
+def cleanser_options():
+    """出力に影響する設定（マニフェストに記録し、変えたら作り直す）"""
+    return {
+        'resolve_gaiji': resolve_gaiji,
+        'save_markup': save_markup,
+        'save_utf8_org': save_utf8_org,
+        'write_title': write_title,
+        'write_header': write_header,
+    }
+
+
+# 本文の区切り（'---…'の区切り線と'底本：'）
+HEADER_SEPARATOR = '-------------------------------------------------------'
+FOOTER_MARKER = '底本：'
+
+# 青空文庫の書式（ルビ・入力者注）は一度だけコンパイルしておく
+RUBY_RE = re.compile('《.*?》')
+ANNOTATION_RE = re.compile('［.*?］')
+# ルビの開始記号と字下げ（全角スペース）は1文字ずつ削除するだけなので変換表で消す
+MARKUP_TABLE = str.maketrans('', '', '｜　')
+# 節区切り（行頭が'―――'、'＊＊＊'、'×××'の行）
+SECTION_DIVIDERS = ('―――', '＊＊＊', '×××')
+# 記号の削除用変換表
+SYMBOL_TABLE = str.maketrans('', '', '―…※')
+# ルビの親文字の字種（｜が無い場合は、ルビの直前の同じ字種の連続が親文字になる）
+KANJI_RE = re.compile('[々〆ヶ\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0003ffff]')
+HIRAGANA_RE = re.compile('[\u3041-\u309f]')
+KATAKANA_RE = re.compile('[\u30a1-\u30faー]')
+FULLWIDTH_ALNUM_RE = re.compile('[０-９Ａ-Ｚａ-ｚ]')
+# 外字注記（※［＃「字形の説明」、第3水準1-85-xx］ や ※［＃「…」、U+XXXX、…］）
+GAIJI_RE = re.compile('※［＃([^］]*)］')
+GAIJI_CODE_RE = re.compile(r'([12]-\d{1,2}-\d{1,2})|U\+([0-9A-Fa-f]{4,6})')
+
+
+def load_gaiji_table(path=gaiji_table_file):
+    """外字の対応表（面区点番号 '1-14-76' → 文字）を読み込む"""
+    table = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            code, chars = line.rstrip('\n').split('\t')
+            table[code] = ''.join(chr(int(u[2:], 16)) for u in chars.split())
+    return table
+
+
+GAIJI_TABLE = load_gaiji_table()
+
+
+def _gaiji_char(m):
+    # 字形の説明（「…」の中）に面区点番号に見える文字列があっても拾わないようにする
+    codes = m.group(1).rpartition('」')[2]
+    for code in GAIJI_CODE_RE.finditer(codes):
+        if code.group(1):
+            char = GAIJI_TABLE.get(code.group(1))
+            if char is not None:
+                return char
+        else:
+            return chr(int(code.group(2), 16))
+    return m.group(0)  # 対応する文字が無い場合は注記のまま残す（整形で削除される）
+
+
+def resolve_gaiji_line(text):
+    """行の中の外字注記を対応表から引いた文字に置き換える"""
+    return GAIJI_RE.sub(_gaiji_char, text)
+
+
+def cleanse_line(text):
+    """
+    1行分の青空文庫の書式を削除し、残す行なら整形後の文字列を、
+    削除する行ならNoneを返す（text_cleanse_dfの置換を1行ずつ順に適用したものと同じ結果になる）
+    resolve_gaiji が True の場合は、書式の削除の前に外字注記を文字に置き換える
+    """
+    if resolve_gaiji and '※［' in text:
+        text = resolve_gaiji_line(text)
+    # 青空文庫の書式削除（ルビ → 入力者注の順で置換する）
+    if '《' in text:
+        text = RUBY_RE.sub('', text)
+    if '［' in text:
+        text = ANNOTATION_RE.sub('', text)
+    # '｜'と字下げ（全角スペース）を削除
+    text = text.translate(MARKUP_TABLE)
+
+    # 節区切りを削除（一文字だけの行は最後の文字数チェックで落ちる）
+    if text.startswith(SECTION_DIVIDERS):
+        return None
 
     # 記号、および記号削除によって残ったカッコを削除
-    df_e = df_e.replace({'text': {'―': ''}}, regex=True)
-    df_e = df_e.replace({'text': {'…': ''}}, regex=True)
-    df_e = df_e.replace({'text': {'※': ''}}, regex=True)
-    df_e = df_e.replace({'text': {'「」': ''}}, regex=True)
+    text = text.translate(SYMBOL_TABLE)
+    if '「」' in text:
+        text = text.replace('「」', '')
+
+    # 一文字以下で構成されている行（空白行を含む）を削除
+    if len(text) <= 1:
+        return None
+    return text
+
 
-    # 一文字以下で構成されている行を削除
-    df_e['length'] = df_e['text'].map(lambda x: len(x))
-    df_e = df_e[df_e['length'] > 1]
+def _char_class(ch):
+    for char_re in (KANJI_RE, HIRAGANA_RE, KATAKANA_RE, FULLWIDTH_ALNUM_RE):
+        if char_re.match(ch):
+            return char_re
+    return None
 
-    # インデックスがずれるので振りなおす
-    df_e = df_e.reset_index().drop(['index'], axis=1)
 
-    # 空白行を削除する（念のため）
-    df_e = df_e[~(df_e['text'] == '')]
+def _ruby_base_start(text, end, floor):
+    """ルビの親文字の開始位置（｜があればその直後、無ければ直前の同じ字種の連続の先頭）"""
+    bar = text.rfind('｜', floor, end)
+    if bar >= 0:
+        return bar + 1
+    if end <= floor:
+        return end
+    char_class = _char_class(text[end - 1])
+    if char_class is None:
+        return end - 1
+    start = end - 1
+    while start > floor and char_class.match(text[start - 1]):
+        start -= 1
+    return start
 
-    # インデックスがずれるので振り直し、文字の長さの列を削除する
-    df_e = df_e.reset_index().drop(['index', 'length'], axis=1)
-    return df_e
 
+def _delete_spans(text, pos, spans):
+    """text から spans の範囲を削除し、残った文字の元の位置 pos も合わせて返す"""
+    keep = []
+    last = 0
+    for start, end in spans:
+        keep.extend(range(last, start))
+        last = end
+    keep.extend(range(last, len(text)))
+    return ''.join(text[i] for i in keep), [pos[i] for i in keep]
 
-def save_cleanse_text(target_file, zip_extract_dir):
+
+def _delete_chars(text, pos, chars):
+    keep = [i for i, ch in enumerate(text) if ch not in chars]
+    return ''.join(text[i] for i in keep), [pos[i] for i in keep]
+
+
+def cleanse_line_with_markup(text):
+    """
+    cleanse_line と同じ整形をしながら、削除したルビと入力者注を記録する
+    (整形後の文字列またはNone, [(start, end, kind, value), ...]) を返す
+    start / end は整形後の文字列での位置で、ルビは親文字の範囲、入力者注は
+    ［＃「…」に傍点］のように対象の文字列が直前にあればその範囲（無ければ長さ0）
+    """
+    if resolve_gaiji and '※［' in text:
+        text = resolve_gaiji_line(text)
+    if '《' not in text and '［' not in text:
+        return cleanse_line(text), []
+
+    marks = []  # (start, end, kind, value) 元の行での位置
+    pos = list(range(len(text)))  # 各文字の元の行での位置
+    # ルビ → 入力者注の順で削除する（cleanse_line と同じ順番）
+    if '《' in text:
+        spans = []
+        floor = 0
+        for m in RUBY_RE.finditer(text):
+            base_start = _ruby_base_start(text, m.start(), floor)
+            marks.append((base_start, m.start(), RUBY, m.group()[1:-1]))
+            spans.append(m.span())
+            floor = m.end()
+        text, pos = _delete_spans(text, pos, spans)
+    if '［' in text:
+        spans = []
+        for m in ANNOTATION_RE.finditer(text):
+            note = m.group()[1:-1].lstrip('＃')
+            start = m.start()
+            if note.startswith('「') and '」' in note:
+                target = note[1:note.index('」')]
+                if target and text.endswith(target, 0, m.start()):
+                    start = m.start() - len(target)
+            end = pos[m.start()]
+            marks.append((pos[start] if start < m.start() else end, end, ANNOTATION, note))
+            spans.append(m.span())
+        text, pos = _delete_spans(text, pos, spans)
+    text, pos = _delete_chars(text, pos, '｜　')
+
+    if text.startswith(SECTION_DIVIDERS):
+        return None, []
+    text, pos = _delete_chars(text, pos, '―…※')
+    if '「」' in text:
+        spans = []
+        i = text.find('「」')
+        while i >= 0:
+            spans.append((i, i + 2))
+            i = text.find('「」', i + 2)
+        text, pos = _delete_spans(text, pos, spans)
+    if len(text) <= 1:
+        return None, []
+
+    # 元の行での位置を整形後の位置に直す（pos は昇順）
+    entries = []
+    for start, end, kind, value in marks:
+        start, end = bisect_left(pos, start), bisect_left(pos, end)
+        if kind == RUBY and start == end:
+            continue  # 親文字ごと削除された
+        entries.append((start, end, kind, value))
+    return text, entries
+
+
+def iter_text_lines(text_stream, encoding='cp932'):
+    """
+    バイナリストリームを読みながらデコードし、1行ずつ返す（ジェネレーター）
+    空行は読み飛ばす（以前の pd.read_csv と同じ）
+    """
+    reader = io.TextIOWrapper(text_stream, encoding=encoding, newline=None)
     try:
-        # ファイルの読み込み
-        print(target_file)
-        # Pandas DataFrameとして読み込む（cp932で読み込まないと異体字が読めない）
-        df_tmp = pd.read_csv(target_file, encoding='cp932', names=['text'])
+        for line in reader:
+            line = line.rstrip('\n')
+            if line:
+                yield line
+    finally:
+        # 元のストリームは呼び出し側で閉じる
+        reader.detach()
+
+
+def iter_body_lines(lines, author_name=author_name):
+    """
+    行のイテレータを先頭から1回だけ読み、本文の行を順に返す（ジェネレーター）
+    '---…'区切りの直前の行と、2個目の'---…'区切りの直後から'底本：'の直前までを本文とする
+    """
+    lines = iter(lines)
+    head = []  # 1個目の'---…'区切りまでの行
+    for line in lines:
+        if HEADER_SEPARATOR in line:
+            break
+        if FOOTER_MARKER in line:
+            # もし'---…'区切りが無い場合は、作家名の直後に本文が始まる前提
+            start = next((i for i, text in enumerate(head) if author_name in text), None)
+            if start is None:
+                raise ValueError(f'本文の開始位置（{author_name}）が見つかりません')
+            yield from head[max(0, start - 1):]
+            return
+        head.append(line)
+    else:
+        raise ValueError(f"'{FOOTER_MARKER}' が見つかりません")
+
+    if head:
+        yield head[-1]
+    del head
+    # 2個目の'---…'区切りまでは記号の説明なので読み飛ばす
+    for line in lines:
+        if HEADER_SEPARATOR in line:
+            break
+    else:
+        raise ValueError(f"'{HEADER_SEPARATOR}' の区切りが閉じていません")
+    for line in lines:
+        if FOOTER_MARKER in line:
+            return
+        yield line
+    raise ValueError(f"'{FOOTER_MARKER}' が見つかりません")
+
+
+def iter_cleansed_lines(lines, author_name=author_name):
+    """本文を切り出しながら整形し、残す行を順に返す（ジェネレーター）"""
+    for text in iter_body_lines(lines, author_name):
+        text = cleanse_line(text)
+        if text is not None:
+            yield text
+
+
+def iter_cleansed_markup(lines, author_name=author_name):
+    """
+    本文を切り出しながら整形し、残す行と削除したルビ・入力者注を
+    (text, [(start, end, kind, value), ...]) として順に返す（ジェネレーター）
+    """
+    for text in iter_body_lines(lines, author_name):
+        text, entries = cleanse_line_with_markup(text)
+        if text is not None:
+            yield text, entries
+
+
+def text_cleanse_lines(lines, author_name=author_name):
+    """行のリストから本文を切り出し、整形後の行のリストを返す"""
+    return list(iter_cleansed_lines(lines, author_name))
+
+
+def text_cleanse_df(df, author_name=author_name):
+    return pd.DataFrame(text_cleanse_lines(df['text'].tolist(), author_name), columns=['text'])
+
+
+def output_paths(target_file, out_dir=out_dir):
+    """テキストファイルから作られる出力ファイルのパスのリスト"""
+    stem = Path(target_file).stem
+    paths = []
+    if save_utf8_org:
+        paths.append(str(Path(out_dir) / 'org' / f'{stem}_org_utf-8.tsv'))
+    if write_title:
+        paths.append(str(Path(out_dir) / 'edit' / f'{stem}_clns_utf-8.txt'))
+        if save_markup:
+            paths.append(str(Path(out_dir) / 'edit' / f'{stem}_markup_utf-8.tsv'))
+    return paths
+
+
+def tee_lines(lines, writer):
+    """行をそのまま返しながら、writer にも1行ずつ書き出す（ジェネレーター）"""
+    for line in lines:
+        writer.writerow([line])
+        yield line
+
+
+def cleanse_and_save_text(target_file, text_stream=None, out_dir=out_dir, author_name=author_name):
+    """
+    テキストを1行ずつ読みながら整形して out_dir の org / edit に保存し、
+    整形後の行数を返す（エラーはそのまま送出する）
+    作品全体をメモリに読み込まないので、長い作品でも使用メモリは変わらない
+    target_file: テキストファイルのパス（ZIP内のメンバー名でもよい）
+    text_stream: 読み込み元のバイナリストリーム（省略時は target_file を開く）
+    """
+    target_file = Path(target_file)
+    # ファイルの読み込み
+    print(target_file)
+    with ExitStack() as stack:
+        if text_stream is None:
+            text_stream = stack.enter_context(open(target_file, 'rb'))
+        # cp932で読み込まないと異体字が読めない
+        lines = iter_text_lines(text_stream)
         # 元データをUTF-8に変換してテキストファイルを保存
         if save_utf8_org:
             out_org_file_nm = Path(target_file.stem + '_org_utf-8.tsv')
-            df_tmp.to_csv(Path(zip_extract_dir / out_org_file_nm), sep='\t',
-                          encoding='utf-8', index=None)
-        # テキスト整形
-        df_tmp_e = text_cleanse_df(df_tmp)
+            org_file = stack.enter_context(open(Path(out_dir) / 'org' / out_org_file_nm, 'w',
+                                                encoding='utf-8', newline=''))
+            org_writer = csv.writer(org_file, delimiter='\t', lineterminator='\n')
+            org_writer.writerow(['text'])
+            lines = tee_lines(lines, org_writer)
+
+        # 1行目が作品名
+        title = next(lines, None)
+        if title is None:
+            raise ValueError('空のファイルです')
+        lines = itertools.chain([title], lines)
+
+        n_lines = None
         if write_title:
-            # タイトル列を作る
-            df_tmp_e['title'] = df_tmp['text'][0]
+            # テキスト整形（タイトル列を付けて1行ずつ書き出す）
             out_edit_file_nm = Path(target_file.stem + '_clns_utf-8.txt')
-            df_tmp_e.to_csv(Path(zip_extract_dir / out_edit_file_nm), sep='\t',
-                            encoding='utf-8', index=None, header=write_header)
-            return df_tmp_e  # 整形後のデータフレームを返す
-    
-    except Exception as e:
-        print(f'ERROR: {target_file} - {e}')
-        return None  # エラー時はNoneを返す
-
-def process_text_files(zip_extract_dir):
-    text_files = list(zip_extract_dir.glob('**/*.txt'))  # サブフォルダも含む
-    for text_file in text_files:
-        save_cleanse_text(text_file, zip_extract_dir)  # zip_extract_dirを渡す
-
-
-def main():
-    tx_dir = Path(author_id + './files/')  # zipファイルのディレクトリ
-    # zipファイルのリストを作成
-    zip_list = list(tx_dir.glob('*.zip'))
-    
+            edit_file = stack.enter_context(open(Path(out_dir) / 'edit' / out_edit_file_nm, 'w',
+                                                 encoding='utf-8', newline=''))
+            edit_writer = csv.writer(edit_file, delimiter='\t', lineterminator='\n')
+            if write_header:
+                edit_writer.writerow(['text', 'title'])
+            n_lines = 0
+            if save_markup:
+                # 削除したルビ・入力者注は整形後の行番号と行内の位置を付けて別ファイルに保存
+                out_markup_file_nm = Path(target_file.stem + '_markup_utf-8.tsv')
+                markup_file = stack.enter_context(open(Path(out_dir) / 'edit' / out_markup_file_nm,
+                                                       'w', encoding='utf-8', newline=''))
+                markup_writer = csv.writer(markup_file, delimiter='\t', lineterminator='\n')
+                markup_writer.writerow(['line', 'start', 'end', 'kind', 'value'])
+                for text, entries in iter_cleansed_markup(lines, author_name):
+                    edit_writer.writerow([text, title])
+                    for start, end, kind, value in entries:
+                        markup_writer.writerow([n_lines, start, end, kind, value])
+                    n_lines += 1
+            else:
+                for text in iter_cleansed_lines(lines, author_name):
+                    edit_writer.writerow([text, title])
+                    n_lines += 1
+        # '底本：'以降も元データの保存のために最後まで読む
+        for _ in lines:
+            pass
+    return n_lines  # 整形後の行数を返す
+
+
+def report_row(zip_file, file_name, lines=0, error=None, outputs=()):
+    """処理結果レポートの1行分"""
+    return {
+        'zip': Path(zip_file).name,
+        'file': file_name,
+        'lines': lines,
+        'error': '' if error is None else f'{type(error).__name__}: {error}',
+        'outputs': list(outputs),
+    }
+
+
+def process_zip_file(zip_file, out_dir=out_dir, author_name=author_name):
+    """
+    ZIPファイルをディスクに展開せず、中のテキストファイルを
+    ZipFile.open で1つずつ開いてそのまま整形する
+    ファイルごとの処理結果（行数・エラー）のリストを返す
+    """
+    report = []
+    try:
+        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+            for member in zip_ref.infolist():
+                if member.is_dir() or not member.filename.endswith('.txt'):
+                    continue
+                try:
+                    with zip_ref.open(member) as text_stream:
+                        lines = cleanse_and_save_text(member.filename, text_stream, out_dir, author_name)
+                    report.append(report_row(zip_file, member.filename, lines or 0,
+                                             outputs=output_paths(member.filename, out_dir)))
+                except Exception as e:
+                    print(f'ERROR: {zip_file}:{member.filename} - {e}')
+                    report.append(report_row(zip_file, member.filename, error=e))
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f'ERROR: {zip_file} - {e}')
+        report.append(report_row(zip_file, '', error=e))
+    return report
+
+
+def _process_zip_task(task):
+    """プロセスプールのワーカー用（task は (zip_file, out_dir, author_name)）"""
+    return process_zip_file(*task)
+
+
+def process_zip_tasks(tasks, max_workers=max_workers):
+    """
+    (zip_file, out_dir, author_name) のリストをプロセスプールで並列に整形し、
+    tasks の順に並んだZIPファイルごとの処理結果のリストを返す
+    複数の作家のZIPファイルを混ぜて渡せば、1つのプロセスプールで処理される
+    max_workers=1 の場合は並列化せずに順番に処理する
+    """
+    tasks = list(tasks)
+    if not tasks:
+        return []
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(tasks)))
+    if max_workers == 1:
+        reports = [_process_zip_task(task) for task in tasks]
+    else:
+        # 小さなZIPが大量にあるのでまとめてワーカーに渡す（mapは入力順に結果を返す）
+        chunksize = max(1, len(tasks) // (max_workers * 4))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            reports = list(executor.map(_process_zip_task, tasks, chunksize=chunksize))
+    return reports
+
+
+def process_zip_list(zip_list, max_workers=max_workers, out_dir=out_dir, author_name=author_name):
+    """1人の作家のZIPファイルを並列に整形し、zip_listの順に処理結果を返す"""
+    return process_zip_tasks([(zip_file, out_dir, author_name) for zip_file in zip_list],
+                             max_workers)
+
+def file_digest(path):
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path=manifest_file):
+    """マニフェスト（ZIPファイル名 → ハッシュ・整形処理のバージョン・出力先）を読み込む"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_manifest(manifest, path=manifest_file):
+    """マニフェストを書き出す（途中で止まっても壊れないように一時ファイルから置き換える）"""
+    tmp_path = Path(str(path) + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(entry, zip_file):
+    """
+    マニフェストの記録どおりにZIPファイルが処理済みかを判定する
+    （整形処理のバージョンか出力に影響する設定（外字の置き換え・ルビの保存・作品名の列など）が違えば作り直す）
+    サイズと更新時刻が同じならハッシュの計算を省き、違う場合だけ内容のハッシュを比べる
+    """
+    if not entry or entry.get('cleanser_version') != CLEANSER_VERSION:
+        return False
+    if entry.get('options') != cleanser_options():
+        return False
+    if not all(Path(p).exists() for p in entry.get('outputs', [])):
+        return False
+    stat = zip_file.stat()
+    if entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+        return True
+    if entry.get('sha256') != file_digest(zip_file):
+        return False
+    # 内容は同じ（コピーし直しただけ）なので更新時刻だけ記録し直す
+    entry['size'], entry['mtime_ns'] = stat.st_size, stat.st_mtime_ns
+    return True
+
+
+def manifest_entry(zip_file, report):
+    """処理したZIPファイルのマニフェストの記録"""
+    stat = zip_file.stat()
+    return {
+        'sha256': file_digest(zip_file),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'cleanser_version': CLEANSER_VERSION,
+        'options': cleanser_options(),
+        'outputs': [p for row in report for p in row['outputs']],
+        'report': [{k: v for k, v in row.items() if k != 'outputs'} for row in report],
+    }
+
+
+def write_report(report, path=report_file):
+    """ファイルごとの処理結果をTSVで保存し、エラーの件数を返す"""
+    df_report = pd.DataFrame(report, columns=['zip', 'file', 'lines', 'error'])
+    df_report.to_csv(path, sep='\t', encoding='utf-8', index=None)
+    return int((df_report['error'] != '').sum())
+
+
+def load_catalog(path=catalog_file):
+    """作家の一覧（TSV：author_id, author_name）を読み込み、作家番号 → 作家名の辞書を返す"""
+    df_catalog = pd.read_csv(path, sep='\t', encoding='utf-8', dtype=str, comment='#')
+    return dict(zip(df_catalog['author_id'].str.strip(), df_catalog['author_name'].str.strip()))
+
+
+def find_author_corpus(author, path=catalog_file):
+    """作家名（表示名）から整形済みコーパスのパスを探す（無ければNone）"""
+    catalog = {author_id: author_name}
+    if Path(path).exists():
+        catalog.update(load_catalog(path))
+    for a_id, a_name in catalog.items():
+        corpus_path = author_corpus_file(a_id)
+        if a_name == author and corpus_path.exists():
+            return corpus_path
+    return None
+
+
+def read_cleansed_file(path):
+    """整形済みファイル（*_clns_utf-8.txt）から (title, lines) を読む"""
+    title = None
+    lines = []
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = csv.reader(f, delimiter='\t')
+        if write_header:
+            next(rows, None)
+        for text, title in rows:
+            lines.append(text)
+    return title, lines
+
+
+def read_markup_file(path, lines):
+    """
+    ルビ・入力者注のファイル（*_markup_utf-8.tsv）を読み、
+    作品の本文（行を改行でつないだ文字列）での位置に直したリストを返す
+    """
+    line_starts = list(itertools.accumulate((len(line) + 1 for line in lines), initial=0))
+    entries = []
+    with open(path, encoding='utf-8', newline='') as f:
+        rows = csv.reader(f, delimiter='\t')
+        next(rows, None)
+        for line, start, end, kind, value in rows:
+            offset = line_starts[int(line)]
+            entries.append((offset + int(start), offset + int(end), int(kind), value))
+    return entries
+
+
+def pack_corpus(plan, report):
+    """
+    作家の整形済みファイルを1つのコーパスファイルにまとめる
+    作品名は作品ごとに1回だけ記録し、本文は行単位で読めるように保存する
+    ルビ・入力者注は作品ごとの位置の配列にしてコーパスの横に保存する
+    """
+    edit_dir = Path(plan['out_dir']) / 'edit'
+    markup = []
+
+    def iter_works():
+        for row in report:
+            if row['error'] or not row['file']:
+                continue
+            stem = Path(row['file']).stem
+            title, lines = read_cleansed_file(edit_dir / f'{stem}_clns_utf-8.txt')
+            if title is None:
+                continue
+            if save_markup:
+                markup.append(read_markup_file(edit_dir / f'{stem}_markup_utf-8.tsv', lines))
+            yield title, row['file'], lines
+
+    corpus_path = author_corpus_file(plan['author_id'])
+    n_works = write_corpus(corpus_path, plan['author_id'], plan['author_name'], iter_works())
+    if save_markup:
+        write_markup_index(markup_index_file(corpus_path), markup)
+    print(f"{plan['author_name']}: {n_works} works packed into {corpus_path}")
+
+
+def plan_author(author_id, author_name, force=False):
+    """
+    作家のZIPファイルのうち、作り直しが必要なものを調べる
+    前回から変わっていないZIPファイルはマニフェストに記録された処理結果を使う
+    """
+    out_dir = author_out_dir(author_id)
+    zip_list = sorted(author_files_dir(author_id).glob('*.zip'))
+
     # 保存ディレクトリを作成しておく
-    tx_edit_dir.mkdir(exist_ok=True, parents=True)
-    if save_utf8_org:
-        tx_org_dir.mkdir(exist_ok=True, parents=True)
+    if zip_list:
+        (out_dir / 'edit').mkdir(exist_ok=True, parents=True)
+        if save_utf8_org:
+            (out_dir / 'org').mkdir(exist_ok=True, parents=True)
+
+    manifest = {} if force else load_manifest(out_dir / 'manifest.json')
+    reports = {}
+    stale = []
+    for zip_file in zip_list:
+        entry = manifest.get(zip_file.name)
+        if is_up_to_date(entry, zip_file):
+            reports[zip_file.name] = entry['report']
+        else:
+            stale.append(zip_file)
+    return {
+        'author_id': author_id,
+        'author_name': author_name,
+        'out_dir': out_dir,
+        'zip_list': zip_list,
+        'manifest': manifest,
+        'reports': reports,
+        'stale': stale,
+    }
+
+
+def finish_author(plan, stale_reports):
+    """作り直した結果をマニフェストと処理結果レポートに書き出す"""
+    out_dir, zip_list, manifest, reports = (
+        plan['out_dir'], plan['zip_list'], plan['manifest'], plan['reports'])
+    manifest_path = out_dir / 'manifest.json'
+    report_path = out_dir / 'ingest_report.tsv'
+
+    if not zip_list:
+        print(f"{plan['author_name']}: no zip files in {author_files_dir(plan['author_id'])}")
+        return
+    if not plan['stale'] and len(manifest) == len(zip_list):
+        # 更新時刻だけ変わったZIPファイルがあれば記録し直しておく
+        save_manifest(manifest, manifest_path)
+        print(f"{plan['author_name']}: {len(zip_list)} zip files up to date")
+        if write_title and not author_corpus_file(plan['author_id']).exists():
+            pack_corpus(plan, [row for zip_file in zip_list for row in reports[zip_file.name]])
+        return
+
+    for zip_file, report in zip(plan['stale'], stale_reports):
+        reports[zip_file.name] = report
+        if any(row['error'] for row in report):
+            # エラーのあった作品は次回もう一度処理する
+            manifest.pop(zip_file.name, None)
+        else:
+            manifest[zip_file.name] = manifest_entry(zip_file, report)
+    # 無くなったZIPファイルの記録は消す
+    manifest = {zip_file.name: manifest[zip_file.name]
+                for zip_file in zip_list if zip_file.name in manifest}
+    save_manifest(manifest, manifest_path)
+
+    report = [row for zip_file in zip_list for row in reports[zip_file.name]]
+    n_errors = write_report(report, report_path)
+    print(f"{plan['author_name']}: {len(plan['stale'])} of {len(zip_list)} zip files rebuilt, "
+          f'{n_errors} errors (see {report_path})')
+    if write_title:
+        pack_corpus(plan, report)
+
+
+def build_authors(catalog, workers=max_workers, force=False):
+    """
+    複数の作家（作家番号 → 作家名）の作品をまとめて整形する
+    全作家の作り直しが必要なZIPファイルを1つのプロセスプールに流し、
+    結果は作家ごとに out_{author_id} に書き出す
+    """
+    plans = [plan_author(a_id, a_name, force) for a_id, a_name in catalog.items()]
+    tasks = [(zip_file, plan['out_dir'], plan['author_name'])
+             for plan in plans for zip_file in plan['stale']]
+    stale_reports = iter(process_zip_tasks(tasks, workers))
+    for plan in plans:
+        finish_author(plan, [next(stale_reports) for _ in plan['stale']])
 
-    for target_file in zip_list:
-        # ZIPファイルを解凍するディレクトリ
-        zip_extract_dir = Path('unzipped_files')
-        zip_extract_dir.mkdir(exist_ok=True, parents=True)  # 解凍先ディレクトリを作成
-        # ZIPファイルを解凍
-        with zipfile.ZipFile(target_file, 'r') as zip_ref:
-            zip_ref.extractall(zip_extract_dir)
 
-        # 解凍したテキストファイルを処理
-        process_text_files(zip_extract_dir)
+def main(workers=max_workers, force=False, catalog=None):
+    """catalog を省略した場合は author_id / author_name の作家だけを整形する"""
+    if catalog is None:
+        catalog = {author_id: author_name}
+    build_authors(catalog, workers, force)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='青空文庫のZIPファイルを整形する')
+    parser.add_argument('--workers', type=int, default=max_workers,
+                        help='並列処理のプロセス数（省略時はCPUコア数、1なら並列化しない）')
+    parser.add_argument('--force', action='store_true',
+                        help='マニフェストを無視して全作品を作り直す')
+    parser.add_argument('--catalog', nargs='?', const=str(catalog_file), default=None,
+                        help=f'作家の一覧（TSV）に載っている全作家を整形する（省略時は {catalog_file}）')
+    args = parser.parse_args()
+    main(args.workers, args.force, load_catalog(args.catalog) if args.catalog else None)
@@ -2,6 +2,9 @@ import streamlit as st
 import sqlite3  # SQLite3を使用
 import hashlib
 
+import database
+import user_db
+
 # ページの基本設定
 st.set_page_config(
     page_title="文学の読書コンパニオン",
@@ -69,107 +72,64 @@ st.markdown("<div class='subtitle'>感想を語り合い、作家の息吹に触
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-# DBがなければ作成
+# DBがなければ作成（以前の形式のUSERテーブルはバックアップを作ってから変換する）
 def init_db():
-    conn = sqlite3.connect("literary_app.db")
-    cur = conn.cursor()
-
-    # USER テーブル作成
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS USER (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            password TEXT,
-            author TEXT,
-            title TEXT,
-            conversation TEXT,
-            summary TEXT,
-            Relevance INTEGER,
-            Creativity INTEGER,
-            Flexibility INTEGER,
-            Problem_Solving INTEGER,
-            Insight INTEGER
-        )
-    ''')
-
-    # BOT テーブル作成
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS BOT (
-            author TEXT,
-            title TEXT,
-            text_content TEXT
-        )
-    ''')
+    with database.connection() as conn:
+        # USER・CONVERSATION・MESSAGE・EVALUATION テーブル作成
+        user_db.init_db(conn)
+
+        # BOT テーブル作成
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS BOT (
+                author TEXT,
+                title TEXT,
+                text_content TEXT
+            )
+        ''')
 
-    conn.commit()
-    conn.close()
+        conn.commit()
 
-def store_author_and_title(username, author_value, title_value):
+def start_conversation(username, author_value, title_value):
     """
-    ログイン中のユーザー(username)のレコードを探して、
-    authorカラムとtitleカラムをUPDATEする
+    ログイン中のユーザー(username)とこの作品との会話のidを返す
+    （終了していない前回の会話があればそれを、無ければCONVERSATIONテーブルに新しく作成する）
     """
-    conn = sqlite3.connect("literary_app.db")
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE USER
-        SET author = ?, title = ?
-        WHERE username = ?
-        """,
-        (author_value, title_value, username)
-    )
-    conn.commit()
-    conn.close()
+    return user_db.open_conversation(username, author_value, title_value)
 
 def drop_user_table():
-    """USERテーブルを削除"""
-    conn = sqlite3.connect("literary_app.db")
-    cur = conn.cursor()
-    cur.execute("DROP TABLE IF EXISTS USER")
-    conn.commit()
-    conn.close()
+    """ユーザー・会話・メッセージ・評価のテーブルを削除"""
+    with database.connection() as conn:
+        user_db.drop_user_tables(conn)
 
 # username から id を取得する関数
 def get_user_id_by_username(username):
     """
     USERテーブルから、指定されたusernameに対応するidを取得
     """
-    conn = sqlite3.connect("literary_app.db")
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM USER WHERE username = ?", (username,))
-    row = cur.fetchone()
-    conn.close()
+    with database.connection() as conn:
+        row = conn.execute("SELECT id FROM USER WHERE username = ?", (username,)).fetchone()
     return row[0] if row else None
 
 # ユーザの新規登録
 def register_user(username, password):
     try:
-        conn = sqlite3.connect("literary_app.db")
-        cur = conn.cursor()
-        cur.execute("INSERT INTO USER (username, password) VALUES (?, ?)", (username, hash_password(password)))
-        conn.commit()
+        with database.connection() as conn:
+            conn.execute("INSERT INTO USER (username, password) VALUES (?, ?)", (username, hash_password(password)))
+            conn.commit()
         st.success("登録に成功しました！ログインしてください。")
     except sqlite3.IntegrityError:
         st.error("このユーザ名は既に登録されています。")
-    finally:
-        conn.close()
 
 # ユーザが存在するかどうかを確認（認証）
 def authenticate_user(username, password):
-    conn = sqlite3.connect("literary_app.db")
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM USER WHERE username = ? AND password = ?", (username, hash_password(password)))
-    user = cur.fetchone()
-    conn.close()
-    return user
+    with database.connection() as conn:
+        return conn.execute(
+            "SELECT * FROM USER WHERE username = ? AND password = ?", (username, hash_password(password))
+        ).fetchone()
 
 def fetch_titles_from_db():
-    conn = sqlite3.connect("literary_app.db")
-    cur = conn.cursor()
-    cur.execute("SELECT title FROM BOT WHERE author = ?", (selected_bot,))
-    rows = cur.fetchall()
-    conn.close()
+    with database.connection() as conn:
+        rows = conn.execute("SELECT title FROM BOT WHERE author = ?", (selected_bot,)).fetchall()
     return [row[0] for row in rows]
 
 # データベース初期化
@@ -178,7 +138,7 @@ init_db()
 # DB削除ボタン
 if st.button("DB削除"):
     drop_user_table()
-    st.success("USERテーブルを削除しました。")
+    st.success("ユーザーと会話のテーブルを削除しました。")
 
 # セッション状態管理
 if "logged_in" not in st.session_state:
@@ -231,17 +191,14 @@ if st.session_state["logged_in"]:
             selected_title = st.selectbox("対話したい作品を選んでください:", titles, key="title_selectbox")
             if st.button("会話を始める", key="start_conversation"):
                 current_user = st.session_state["username"]  
-                # USERテーブルに author=selected_bot と title=selected_title をUPDATE
-                store_author_and_title(current_user, selected_bot, selected_title)
-
-                # DBからユーザーIDを取得
-                user_id = get_user_id_by_username(current_user)
+                # このユーザーと作品の続きの会話のIDを取得（無ければ、または対話終了済みなら新しく作成）
+                conversation_id = start_conversation(current_user, selected_bot, selected_title)
                 
                 # ページ遷移: クエリパラメータに id, username, author, title を付与
                 url = (
                     "https://literaryaicompanion-prg5zuxubou7vm6rxpqujs.streamlit.app/"
                     "akutagawa_bot"
-                    f"?id={user_id}"                # ① DB上のid
+                    f"?id={conversation_id}"        # ① DB上の会話のid
                     f"&username={current_user}"     # ② ログイン中のusername
                     f"&author={selected_bot}"      # ③ ボット（著者）
                     f"&title={selected_title}"      # ④ 選択した作品タイトル
@@ -257,17 +214,14 @@ if st.session_state["logged_in"]:
             selected_title = st.selectbox("対話したい作品を選んでください:", titles, key="title_selectbox")
             if st.button("会話を始める", key="start_conversation"):
                 current_user = st.session_state["username"]  
-                # USERテーブルに author=selected_bot と title=selected_title をUPDATE
-                store_author_and_title(current_user, selected_bot, selected_title)
-
-                # DBからユーザーIDを取得
-                user_id = get_user_id_by_username(current_user)
+                # このユーザーと作品の続きの会話のIDを取得（無ければ、または対話終了済みなら新しく作成）
+                conversation_id = start_conversation(current_user, selected_bot, selected_title)
                 
                 # ページ遷移: クエリパラメータに id, username, author, title を付与
                 url = (
                     "https://literaryaicompanion-prg5zuxubou7vm6rxpqujs.streamlit.app/"
                     "akutagawa_bot"
-                    f"?id={user_id}"                # ① DB上のid
+                    f"?id={conversation_id}"        # ① DB上の会話のid
                     f"&username={current_user}"     # ② ログイン中のusername
                     f"&author={selected_bot}"      # ③ ボット（著者）
                     f"&title={selected_title}"      # ④ 選択した作品タイトル
@@ -283,17 +237,14 @@ if st.session_state["logged_in"]:
             selected_title = st.selectbox("対話したい作品を選んでください:", titles, key="title_selectbox")
             if st.button("会話を始める", key="start_conversation"):
                 current_user = st.session_state["username"]  
-                # USERテーブルに author=selected_bot と title=selected_title をUPDATE
-                store_author_and_title(current_user, selected_bot, selected_title)
-
-                # DBからユーザーIDを取得
-                user_id = get_user_id_by_username(current_user)
+                # このユーザーと作品の続きの会話のIDを取得（無ければ、または対話終了済みなら新しく作成）
+                conversation_id = start_conversation(current_user, selected_bot, selected_title)
                 
                 # ページ遷移: クエリパラメータに id, username, author, title を付与
                 url = (
                     "https://literaryaicompanion-prg5zuxubou7vm6rxpqujs.streamlit.app/"
                     "akutagawa_bot"
-                    f"?id={user_id}"                # ① DB上のid
+                    f"?id={conversation_id}"        # ① DB上の会話のid
                     f"&username={current_user}"     # ② ログイン中のusername
                     f"&author={selected_bot}"      # ③ ボット（著者）
                     f"&title={selected_title}"      # ④ 選択した作品タイトル
@@ -308,17 +259,14 @@ if st.session_state["logged_in"]:
             selected_title = st.selectbox("対話したい作品を選んでください:", titles, key="title_selectbox")
             if st.button("会話を始める", key="start_conversation"):
                 current_user = st.session_state["username"]  
-                # USERテーブルに author=selected_bot と title=selected_title をUPDATE
-                store_author_and_title(current_user, selected_bot, selected_title)
-
-                # DBからユーザーIDを取得
-                user_id = get_user_id_by_username(current_user)
+                # このユーザーと作品の続きの会話のIDを取得（無ければ、または対話終了済みなら新しく作成）
+                conversation_id = start_conversation(current_user, selected_bot, selected_title)
                 
                 # ページ遷移: クエリパラメータに id, username, author, title を付与
                 url = (
                     "https://literaryaicompanion-prg5zuxubou7vm6rxpqujs.streamlit.app/"
                     "akutagawa_bot"
-                    f"?id={user_id}"                # ① DB上のid
+                    f"?id={conversation_id}"        # ① DB上の会話のid
                     f"&username={current_user}"     # ② ログイン中のusername
                     f"&author={selected_bot}"      # ③ ボット（著者）
                     f"&title={selected_title}"      # ④ 選択した作品タイトル
@@ -333,17 +281,14 @@ if st.session_state["logged_in"]:
             selected_title = st.selectbox("対話したい作品を選んでください:", titles, key="title_selectbox")
             if st.button("会話を始める", key="start_conversation"):
                 current_user = st.session_state["username"]  
-                # USERテーブルに author=selected_bot と title=selected_title をUPDATE
-                store_author_and_title(current_user, selected_bot, selected_title)
-
-                # DBからユーザーIDを取得
-                user_id = get_user_id_by_username(current_user)
+                # このユーザーと作品の続きの会話のIDを取得（無ければ、または対話終了済みなら新しく作成）
+                conversation_id = start_conversation(current_user, selected_bot, selected_title)
                 
                 # ページ遷移: クエリパラメータに id, username, author, title を付与
                 url = (
                     "https://literaryaicompanion-prg5zuxubou7vm6rxpqujs.streamlit.app/"
                     "akutagawa_bot"
-                    f"?id={user_id}"                # ① DB上のid
+                    f"?id={conversation_id}"        # ① DB上の会話のid
                     f"&username={current_user}"     # ② ログイン中のusername
                     f"&author={selected_bot}"      # ③ ボット（著者）
                     f"&title={selected_title}"      # ④ 選択した作品タイトル
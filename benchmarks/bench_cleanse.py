@@ -0,0 +1,100 @@
+"""
+text_cleanse_df の整形処理のベンチマーク
+
+従来の pandas による置換（DataFrame.replace を繰り返す方式）と、
+コンパイル済みの規則で1行ずつ整形する方式を比較する。
+
+    python benchmarks/bench_cleanse.py [--repeat 200]
+"""
+import argparse
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import aozora_preprocess as ap  # noqa: E402
+
+
+def text_cleanse_df_pandas(df):
+    """従来の pandas による整形処理（比較用にそのまま残している）"""
+    head_tx = list(df[df['text'].str.contains(
+        '-------------------------------------------------------')].index)
+    atx = list(df[df['text'].str.contains('底本：')].index)
+    if head_tx == []:
+        head_tx = list(df[df['text'].str.contains(ap.author_name)].index)
+        head_tx_num = head_tx[0] - 1
+        df_e = df[head_tx_num:atx[0]]
+    else:
+        additional_intro = df[max(0, head_tx[0]) - 1:head_tx[0]]
+        main_text = df[head_tx[1] + 1:atx[0]]
+        df_e = pd.concat([additional_intro, main_text])
+
+    df_e = df_e.replace({'text': {'《.*?》': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'［.*?］': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'｜': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'　': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'^.$': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'^―――.*$': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'^＊＊＊.*$': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'^×××.*$': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'―': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'…': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'※': ''}}, regex=True)
+    df_e = df_e.replace({'text': {'「」': ''}}, regex=True)
+    df_e['length'] = df_e['text'].map(lambda x: len(x))
+    df_e = df_e[df_e['length'] > 1]
+    df_e = df_e.reset_index().drop(['index'], axis=1)
+    df_e = df_e[~(df_e['text'] == '')]
+    df_e = df_e.reset_index().drop(['index', 'length'], axis=1)
+    return df_e
+
+
+def load_corpus(tx_dir):
+    """zipファイル内のテキストをDataFrameとして読み込む"""
+    dfs = []
+    for zip_file in sorted(Path(tx_dir).glob('*.zip')):
+        with zipfile.ZipFile(zip_file) as zf:
+            for name in zf.namelist():
+                if name.endswith('.txt'):
+                    with zf.open(name) as f:
+                        dfs.append(pd.read_csv(f, encoding='cp932', names=['text']))
+    return dfs
+
+
+def bench(func, dfs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for df in dfs:
+            func(df)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', default=f'{ap.author_id}/files', help='zipファイルのディレクトリ')
+    parser.add_argument('--repeat', type=int, default=200, help='繰り返し回数')
+    args = parser.parse_args()
+
+    dfs = load_corpus(args.files)
+    n_lines = sum(len(df) for df in dfs)
+    # 従来の処理には外字の置き換えが無いので、同じ条件で比べる
+    ap.resolve_gaiji = False
+
+    # 出力が完全に一致することを確認
+    for df in dfs:
+        pd.testing.assert_frame_equal(text_cleanse_df_pandas(df), ap.text_cleanse_df(df))
+
+    t_pandas = bench(text_cleanse_df_pandas, dfs, args.repeat)
+    t_compiled = bench(ap.text_cleanse_df, dfs, args.repeat)
+    total = n_lines * args.repeat
+    print(f'{len(dfs)} works, {n_lines} lines x {args.repeat} repeats')
+    print(f'pandas replace : {t_pandas:8.3f} s  ({total / t_pandas:12,.0f} lines/s)')
+    print(f'compiled rules : {t_compiled:8.3f} s  ({total / t_compiled:12,.0f} lines/s)')
+    print(f'speedup        : {t_pandas / t_compiled:8.1f} x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+literary_app.db への同時アクセスのベンチマーク
+
+複数のセッションが同時に画面の再実行に相当する処理（作品本文・ユーザーの読み込みと
+会話の書き込み）を繰り返した場合の1回あたりの時間（p50 / p95）と、
+データベースがロックされていて失敗した回数を測る。
+
+    per-call : 処理ごとに sqlite3.connect で接続を開いて閉じる（従来の方法、rollback journal）
+    pooled   : database.connection() でプールした接続を使う（WAL・busy_timeout・mmap など設定済み）
+
+    python benchmarks/bench_db.py [--sessions 8] [--reruns 50] [--works 50]
+"""
+import argparse
+import contextlib
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import database  # noqa: E402
+
+
+def make_db(path, works, text_size, users):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE BOT (author TEXT, title TEXT, text_content TEXT)")
+    conn.execute("CREATE TABLE USER (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, password TEXT, "
+                 "author TEXT, title TEXT, conversation TEXT, summary TEXT)")
+    text = "吾輩は猫である。名前はまだ無い。" * (text_size // 16)
+    conn.executemany("INSERT INTO BOT VALUES (?, ?, ?)", (("作家", f"作品{i}", text) for i in range(works)))
+    conn.executemany("INSERT INTO USER (username, password) VALUES (?, ?)",
+                     ((f"user{i}", "x") for i in range(users)))
+    conn.commit()
+    conn.close()
+
+
+@contextlib.contextmanager
+def per_call_connection(path):
+    conn = sqlite3.connect(path)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def rerun(connection, session, i, works):
+    """画面の再実行1回分: 本文とユーザーを読み、会話を書き込む"""
+    with connection() as conn:
+        row = conn.execute("SELECT text_content FROM BOT WHERE title = ?", (f"作品{(session + i) % works}",)).fetchone()
+        assert row is not None
+    with connection() as conn:
+        user_id = conn.execute("SELECT id FROM USER WHERE username = ?", (f"user{session}",)).fetchone()[0]
+    with connection() as conn:
+        conn.execute("UPDATE USER SET conversation = ? WHERE id = ?", (f"会話 {i}" * 100, user_id))
+        conn.commit()
+
+
+def run_session(connection, session, reruns, works):
+    latencies = []
+    failures = 0
+    for i in range(reruns):
+        start = time.perf_counter()
+        try:
+            rerun(connection, session, i, works)
+        except sqlite3.OperationalError:
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    return latencies, failures
+
+
+def run(name, connection, sessions, reruns, works):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = list(executor.map(lambda s: run_session(connection, s, reruns, works), range(sessions)))
+    elapsed = time.perf_counter() - start
+    latencies = np.array([t for session, _ in results for t in session]) * 1000
+    failures = sum(f for _, f in results)
+    print(f'{name:8}: {len(latencies)} reruns in {elapsed:5.2f} s ({len(latencies) / elapsed:7.1f} reruns/s), '
+          f'p50 {np.percentile(latencies, 50):6.2f} ms, p95 {np.percentile(latencies, 95):7.2f} ms, '
+          f'locked {failures}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=8, help='同時に実行するセッション数')
+    parser.add_argument('--reruns', type=int, default=50, help='セッションごとの再実行の回数')
+    parser.add_argument('--works', type=int, default=50, help='BOT テーブルの作品数')
+    parser.add_argument('--text-size', type=int, default=50000, help='1作品の文字数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / 'per_call.db')
+        make_db(path, args.works, args.text_size, args.sessions)
+        run('per-call', lambda: per_call_connection(path), args.sessions, args.reruns, args.works)
+
+        path = str(Path(tmp) / 'pooled.db')
+        make_db(path, args.works, args.text_size, args.sessions)
+        run('pooled', lambda: database.connection(path), args.sessions, args.reruns, args.works)
+        print(f'pooled connections opened: {database.get_pool(path).opened}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+外字注記の置き換え（resolve_gaiji）のベンチマーク
+
+zipファイル内の全行を整形し、外字の置き換えあり／なしの処理速度と、
+外字注記の件数・置き換えできた件数を表示する。
+
+    python benchmarks/bench_gaiji.py [--repeat 50]
+"""
+import argparse
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import aozora_preprocess as ap  # noqa: E402
+
+
+def load_lines(tx_dir):
+    """zipファイル内のテキストを1行ずつ読み込む"""
+    lines = []
+    for zip_file in sorted(Path(tx_dir).glob('*.zip')):
+        with zipfile.ZipFile(zip_file) as zf:
+            for info in zf.infolist():
+                if info.filename.endswith('.txt'):
+                    with zf.open(info) as f:
+                        lines.extend(ap.iter_text_lines(f))
+    return lines
+
+
+def bench(lines, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            ap.cleanse_line(line)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', default=f'{ap.author_id}/files', help='zipファイルのディレクトリ')
+    parser.add_argument('--repeat', type=int, default=50, help='繰り返し回数')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table = ap.load_gaiji_table()
+    t_load = time.perf_counter() - start
+
+    lines = load_lines(args.files)
+    notes = [m for line in lines for m in ap.GAIJI_RE.finditer(line)]
+    resolved = sum(1 for m in notes if ap._gaiji_char(m) != m.group(0))
+    n_chars = sum(len(line) for line in lines)
+
+    ap.resolve_gaiji = False
+    t_off = bench(lines, args.repeat)
+    ap.resolve_gaiji = True
+    t_on = bench(lines, args.repeat)
+
+    # 対応表の引き方（dictなのでO(1)）
+    codes = list(table)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for code in codes:
+            table[code]
+    t_lookup = time.perf_counter() - start
+
+    total = len(lines) * args.repeat
+    print(f'gaiji table    : {len(table)} entries, loaded in {t_load * 1000:.1f} ms, '
+          f'{len(codes) * args.repeat / t_lookup:,.0f} lookups/s')
+    print(f'corpus         : {len(lines)} lines, {n_chars} chars, '
+          f'{len(notes)} gaiji notes, {resolved} resolved')
+    print(f'cleanse        : {t_off:7.3f} s  ({total / t_off:12,.0f} lines/s, '
+          f'{n_chars * args.repeat / t_off / 1e6:6.2f} M chars/s)')
+    print(f'cleanse + gaiji: {t_on:7.3f} s  ({total / t_on:12,.0f} lines/s, '
+          f'{n_chars * args.repeat / t_on / 1e6:6.2f} M chars/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+ZIPファイルの並列整形（process_zip_list）のスケーリングのベンチマーク
+
+手元のZIPファイルを複製して作品数を水増しし、プロセス数ごとの処理時間を測る。
+
+    python benchmarks/bench_ingest.py [--copies 100] [--workers 1 2 4 8]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import aozora_preprocess as ap  # noqa: E402
+
+
+def make_corpus(src_dir, dst_dir, copies):
+    """src_dir のZIPファイルを、中のファイル名を変えながら copies 回複製する"""
+    zip_list = []
+    for zip_file in sorted(Path(src_dir).glob('*.zip')):
+        with zipfile.ZipFile(zip_file) as zf:
+            members = [(info.filename, zf.read(info)) for info in zf.infolist()]
+        for i in range(copies):
+            dst = Path(dst_dir) / f'{zip_file.stem}_{i:04d}.zip'
+            with zipfile.ZipFile(dst, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for name, data in members:
+                    zf.writestr(f'{Path(name).stem}_{i:04d}.txt', data)
+            zip_list.append(dst)
+    return zip_list
+
+
+def run(zip_list, workers):
+    # ワーカーの進捗表示は捨てる（子プロセスにも引き継がれるようにfdごと差し替える）
+    stdout_fd = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        start = time.perf_counter()
+        reports = ap.process_zip_list(zip_list, workers)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.dup2(stdout_fd, 1)
+        os.close(devnull)
+        os.close(stdout_fd)
+    return elapsed, [row for report in reports for row in report]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', default=f'{ap.author_id}/files', help='zipファイルのディレクトリ')
+    parser.add_argument('--copies', type=int, default=100, help='ZIPファイル1つあたりの複製数')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}), help='試すプロセス数')
+    args = parser.parse_args()
+
+    src_dir = Path(args.files).resolve()
+    work_dir = Path(tempfile.mkdtemp(prefix='bench_ingest_'))
+    cwd = os.getcwd()
+    try:
+        # 出力先（out_{author_id}）は相対パスなので作業ディレクトリごと切り替える
+        os.chdir(work_dir)
+        zip_list = make_corpus(src_dir, work_dir, args.copies)
+        ap.tx_edit_dir.mkdir(parents=True, exist_ok=True)
+        ap.tx_org_dir.mkdir(parents=True, exist_ok=True)
+
+        print(f'{len(zip_list)} zip files')
+        baseline = None
+        for workers in args.workers:
+            elapsed, report = run(zip_list, workers)
+            errors = sum(1 for row in report if row['error'])
+            baseline = baseline or elapsed
+            print(f'workers={workers:3d}: {elapsed:7.2f} s  speedup {baseline / elapsed:5.2f} x  '
+                  f'({len(report)} files, {errors} errors)')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
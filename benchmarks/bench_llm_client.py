@@ -0,0 +1,93 @@
+"""
+LLM クライアント（llm_client）の負荷・待ち時間のベンチマーク
+
+ネットワークを使わない FakeBackend に対して、複数のセッションが同時にチャットの
+呼び出しを繰り返した場合の待ち時間（p50 / p95）と、混雑エラー（429）・再試行の回数を測る。
+キャッシュは使わない。
+
+    retry    : n 回に1回 429 を返すバックエンドに、毎回違うメッセージを送る
+    quota    : 1秒あたりの上限があるバックエンドに、上限より速く送る
+               （レートリミッターなし／あり（上限の9割）で比べる）
+    coalesce : 全セッションが同じメッセージを同時に送る（API を呼ぶ回数を数える）
+
+    python benchmarks/bench_llm_client.py [--sessions 8] [--calls 20] [--quota 40]
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import openai
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import llm_client  # noqa: E402
+
+MODEL = "gpt-3.5-turbo"
+
+
+def run_session(client, session, calls, same_messages=False):
+    """(待ち時間のリスト, 再試行しても失敗した回数)"""
+    latencies = []
+    failures = 0
+    for i in range(calls):
+        text = f"call {i}" if same_messages else f"session {session} call {i}"
+        messages = [{"role": "user", "content": text}]
+        start = time.perf_counter()
+        try:
+            response = client.create(model=MODEL, messages=messages)
+        except openai.error.RateLimitError:
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        # 同じ入力には同じ応答を返す
+        assert response == llm_client.FakeBackend().create(model=MODEL, messages=messages)
+    return latencies, failures
+
+
+def run(name, client, sessions, calls, same_messages=False):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        results = list(executor.map(lambda s: run_session(client, s, calls, same_messages), range(sessions)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([t for session, _ in results for t in session]) * 1000
+    failures = sum(f for _, f in results)
+    total = len(latencies)
+    backend = client.backend
+    limiter = client.rate_limiter
+    print(f'{name:16}: {total} calls in {elapsed:5.2f} s ({total / elapsed:6.1f} calls/s), '
+          f'p50 {np.percentile(latencies, 50):6.1f} ms, p95 {np.percentile(latencies, 95):7.1f} ms, '
+          f'API calls {backend.calls}, 429 {backend.rate_limited}, retries {client.retries}, '
+          f'coalesced {client.single_flight.coalesced}, '
+          f'throttled {limiter.waits if limiter else 0}, failed {failures}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=8, help='同時に呼び出すセッション数')
+    parser.add_argument('--calls', type=int, default=20, help='セッションごとの呼び出し回数')
+    parser.add_argument('--latency', type=float, default=0.05, help='1回の呼び出しの待ち時間（秒）')
+    parser.add_argument('--rate-limit-every', type=int, default=10, help='retry: n 回に1回 429 にする')
+    parser.add_argument('--quota', type=int, default=40, help='quota: 1秒あたりのリクエスト数の上限')
+    args = parser.parse_args()
+
+    def client(backend, limiter=False):
+        return llm_client.LLMClient(backend, backoff_base=0.05, rate_limiter=limiter)
+
+    run('retry', client(llm_client.FakeBackend(args.latency, rate_limit_every=args.rate_limit_every)),
+        args.sessions, args.calls)
+
+    run('quota (no limit)', client(llm_client.FakeBackend(args.latency, quota_per_second=args.quota)),
+        args.sessions, args.calls)
+    budget = {MODEL: {"requests": args.quota * 60 * 0.9, "tokens": 10 ** 9}}
+    limiter = llm_client.RateLimiter(budget, burst=0.5)
+    run('quota (limited)', client(llm_client.FakeBackend(args.latency, quota_per_second=args.quota), limiter),
+        args.sessions, args.calls)
+
+    run('coalesce', client(llm_client.FakeBackend(args.latency)), args.sessions, args.calls, same_messages=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+チャットの応答をストリーミングで受け取る場合の待ち時間のベンチマーク
+
+ローカルの偽の API サーバー（fake_openai_server）に対して、応答を全部受け取ってから
+表示する場合（chat_completion）と、届いた分から表示する場合（stream_chat_completion）の
+最初の文字が表示できるまでの時間と全体の時間を比べる。キャッシュと計測の記録（llm_metrics）は一時ファイルに作る。
+
+    python benchmarks/bench_streaming.py [--latency 0.3] [--token-delay 0.02] [--tokens 50]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import openai
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import llm_cache  # noqa: E402
+import llm_metrics  # noqa: E402
+from fake_openai_server import FakeOpenAIServer  # noqa: E402
+
+
+def bench_blocking(messages):
+    start = time.perf_counter()
+    response = llm_cache.chat_completion(model="gpt-3.5-turbo", messages=messages, use_cache=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, response["choices"][0]["message"]["content"]
+
+
+def bench_streaming(messages):
+    start = time.perf_counter()
+    first = None
+    reply = ""
+    for piece in llm_cache.stream_chat_completion(model="gpt-3.5-turbo", messages=messages,
+                                                  use_cache=True):
+        if first is None:
+            first = time.perf_counter() - start
+        reply += piece
+    return first, time.perf_counter() - start, reply
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--latency', type=float, default=0.3, help='最初のトークンまでの時間（秒）')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='1トークンごとの時間（秒）')
+    parser.add_argument('--tokens', type=int, default=50, help='応答のトークン数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            FakeOpenAIServer(args.latency, args.token_delay, args.tokens) as server:
+        llm_cache.cache_file = str(Path(tmp_dir) / 'llm_cache.db')
+        llm_metrics.db_file = str(Path(tmp_dir) / 'llm_metrics.db')
+        openai.api_base = server.api_base
+        openai.api_key = 'dummy'
+
+        results = {
+            'blocking': bench_blocking([{"role": "user", "content": "blocking"}]),
+            'streaming': bench_streaming([{"role": "user", "content": "streaming"}]),
+            # 最後まで受け取った応答はキャッシュされ、同じ入力なら API を呼ばない
+            'streaming (cached)': bench_streaming([{"role": "user", "content": "streaming"}]),
+        }
+        assert results['streaming'][2] == results['streaming (cached)'][2]
+        requests = server.requests
+
+    for name, (first, total, reply) in results.items():
+        print(f'{name:18}: first token {first * 1000:7.1f} ms, complete {total * 1000:7.1f} ms, '
+              f'{len(reply)} chars')
+    print(f'API requests      : {requests}')
+
+
+if __name__ == '__main__':
+    main()
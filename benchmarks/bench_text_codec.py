@@ -0,0 +1,120 @@
+"""
+BOT.text_content の圧縮（text_codec）のベンチマーク
+
+整形済みコーパスの全作品を BOT テーブルに登録したデータベースを、圧縮しない場合・
+1つの方式だけで圧縮した場合・作品ごとに方式を選んだ場合（auto）で作り、
+データベースのサイズ（本文の合計も）と、1作品の本文を取り出す時間（p50 / p95）を比べる。
+
+    cold : 展開済みの本文のキャッシュが空の状態（初めて読むとき）
+    warm : キャッシュ済みの状態（画面の再実行で同じ作品を読むとき、ヘッダーだけを読む）
+
+    python benchmarks/bench_text_codec.py [--corpus out_000879/corpus.aozc ...] [--copies 50]
+"""
+import argparse
+import collections
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import aozora_preprocess as ap  # noqa: E402
+import database  # noqa: E402
+import load_bot_table  # noqa: E402
+import text_codec  # noqa: E402
+from aozora_corpus import CorpusReader  # noqa: E402
+
+AUTHOR = "作家"
+
+
+def load_corpus(paths, copies):
+    """コーパスの全作品を (title, text) のリストにする（copies 回複製して作品数を増やす）"""
+    works = []
+    for path in paths:
+        with CorpusReader(path) as corpus:
+            works.extend(corpus.iter_works())
+    return [(f"{title}_{i:04d}", text) for i in range(copies) for title, text in works]
+
+
+def make_db(path, works, codecs):
+    """codecs が None なら圧縮せずに TEXT で登録する。(登録時間, 方式ごとの作品数, 本文の合計バイト数) を返す"""
+    conn = database.connect(path)
+    try:
+        load_bot_table.init_bot_table(conn)
+        start = time.perf_counter()
+        rows = [(AUTHOR, title, text if codecs is None else text_codec.encode(text, codecs))
+                for title, text in works]
+        with conn:
+            conn.executemany(load_bot_table.UPSERT_SQL, rows)
+        elapsed = time.perf_counter() - start
+        conn.execute("VACUUM")
+        counts = collections.Counter(text_codec.codec_name(value) for _, _, value in rows)
+        stored = sum(len(value if codecs is not None else value.encode('utf-8')) for _, _, value in rows)
+    finally:
+        conn.close()
+    return elapsed, counts, stored
+
+
+def fetch_latencies(path, works, compressed, warm):
+    conn = database.connect(path)
+    cache = text_codec.TextCache()
+    latencies = []
+    try:
+        if warm:
+            for title, _ in works:
+                text_codec.fetch_text(conn, title, AUTHOR, cache)
+        for title, text in works:
+            if not warm:
+                cache.clear()
+            start = time.perf_counter()
+            if compressed:
+                fetched = text_codec.fetch_text(conn, title, AUTHOR, cache)
+            else:
+                fetched = conn.execute(
+                    "SELECT text_content FROM BOT WHERE author = ? AND title = ?", (AUTHOR, title)
+                ).fetchone()[0]
+            latencies.append(time.perf_counter() - start)
+            assert fetched == text
+    finally:
+        conn.close()
+    return np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--corpus', nargs='+', default=[str(ap.author_corpus_file(ap.author_id))],
+                        help='整形済みコーパス（複数指定可）')
+    parser.add_argument('--copies', type=int, default=50, help='作品を複製する回数')
+    args = parser.parse_args()
+
+    works = load_corpus(args.corpus, args.copies)
+    raw_bytes = sum(len(text.encode('utf-8')) for _, text in works)
+    print(f'{len(works)} works, {raw_bytes / 1024:.0f} KiB of text')
+
+    settings = [
+        ('text', None),
+        ('zlib', (text_codec.ZLIB,)),
+        ('lzma', (text_codec.LZMA,)),
+        ('bz2', (text_codec.BZ2,)),
+        ('auto', text_codec.candidates),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, codecs in settings:
+            path = str(Path(tmp) / f'{name}.db')
+            elapsed, counts, stored = make_db(path, works, codecs)
+            size = os.path.getsize(path)
+            line = f'{name:5}: db {size / 1024:6.0f} KiB (text_content {stored / 1024:6.0f} KiB), load {elapsed:5.2f} s'
+            for label, warm in (('cold', False), ('warm', True)):
+                if codecs is None and warm:
+                    continue
+                latencies = fetch_latencies(path, works, codecs is not None, warm)
+                line += (f', {label} p50 {np.percentile(latencies, 50):6.3f} ms'
+                         f' p95 {np.percentile(latencies, 95):6.3f} ms')
+            print(line + f'  {dict(counts)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+評価結果の説明の翻訳（translate_explanations）のベンチマーク
+
+ローカルの偽の API サーバー（fake_openai_server）に対して、5項目の説明を1件ずつ順に
+翻訳する場合と、スレッドプールで同時に翻訳する場合の時間を比べる。
+キャッシュと計測の記録（llm_metrics）は一時ファイルに作り、毎回違う説明を使うのでキャッシュには当たらない。
+
+    python benchmarks/bench_translate.py [--latency 0.3] [--workers 1 2 5]
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import openai
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import evaluation  # noqa: E402
+import llm_cache  # noqa: E402
+import llm_metrics  # noqa: E402
+from fake_openai_server import FakeOpenAIServer  # noqa: E402
+
+CRITERIA = ['Relevance', 'Creativity', 'Flexibility', 'Problem_Solving', 'Insight']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--latency', type=float, default=0.3, help='1回の呼び出しの待ち時間（秒）')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 5], help='同時に呼び出す数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            FakeOpenAIServer(latency=args.latency, token_delay=0.005, n_tokens=20) as server:
+        llm_cache.cache_file = str(Path(tmp_dir) / 'llm_cache.db')
+        llm_metrics.db_file = str(Path(tmp_dir) / 'llm_metrics.db')
+        openai.api_base = server.api_base
+        openai.api_key = 'dummy'
+
+        results = {}
+        for workers in args.workers:
+            texts = [f'{name} explanation (workers={workers})' for name in CRITERIA]
+            start = time.perf_counter()
+            translations = evaluation.translate_explanations(texts, max_workers=workers)
+            results[workers] = time.perf_counter() - start
+            assert all(error is None for _, error in translations)
+
+    base = results[args.workers[0]]
+    for workers, elapsed in results.items():
+        print(f'workers={workers}: {elapsed * 1000:7.1f} ms  ({base / elapsed:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
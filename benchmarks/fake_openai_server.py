@@ -0,0 +1,93 @@
+"""
+ベンチマーク用の ChatGPT API の代わりになるローカルサーバー
+
+POST /v1/chat/completions に、最後のメッセージの内容を元にした決まった応答を返す。
+latency 秒待ってから最初のトークンを、その後 token_delay 秒ごとに1トークンずつ作るので、
+stream=True では届いた分から（Server-Sent Events）、そうでなければ全部作り終えてから返す。
+
+    with FakeOpenAIServer(latency=0.3, token_delay=0.02) as server:
+        openai.api_base = server.api_base
+        ...
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_reply(messages, n_tokens):
+    """最後のメッセージから決まる応答のトークン列"""
+    seed = messages[-1]["content"][:8] if messages else ""
+    return [f"{seed}{i}　" if i == 0 else f"トークン{i}　" for i in range(n_tokens)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests += 1
+        tokens = fake_reply(body.get("messages", []), server.n_tokens)
+        time.sleep(server.latency)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            first = {"role": "assistant", "content": ""}
+            for delta in [first] + [{"content": t} for t in tokens]:
+                chunk = {"object": "chat.completion.chunk", "model": body["model"],
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(server.token_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        time.sleep(server.token_delay * len(tokens))
+        data = json.dumps({
+            "object": "chat.completion", "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": "".join(tokens)}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeOpenAIServer:
+    """別スレッドで動かすローカルサーバー（with で起動・停止する）"""
+
+    def __init__(self, latency=0.3, token_delay=0.02, n_tokens=50):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.latency = latency
+        self._httpd.token_delay = token_delay
+        self._httpd.n_tokens = n_tokens
+        self._httpd.requests = 0
+        self._httpd.lock = threading.Lock()
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def api_base(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self):
+        """受け付けたリクエスト数"""
+        return self._httpd.requests
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
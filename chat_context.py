@@ -0,0 +1,96 @@
+"""
+チャットの履歴から API に送るメッセージを作る（トークン数の上限つき）
+
+st.session_state["messages"] には画面表示と保存のために会話をすべて残しておき、
+API にはシステムプロンプト・古い会話の要約・直近の会話だけを送る。
+送る分の見積もりトークン数が上限を超えたら、古い会話を要約に置き換えるので、
+会話が長くなっても1回の呼び出しの大きさはほぼ一定になる。
+要約は自分では作らず、1往復ごとの要約ジョブが保存した会話の途中までの要約
+（RUNNING_SUMMARY）を読んで使う（同じ会話を2回要約しない）。
+"""
+
+history_budget = 2000  # システムプロンプト・要約・直近の会話を合わせた見積もりトークン数の上限
+low_water = 0.5  # 要約するときは上限のこの割合まで減らす（毎ターン要約し直さないため）
+keep_recent = 2  # 要約せずに必ず残す直近のメッセージ数
+
+MESSAGE_OVERHEAD = 4  # 1メッセージごとに role などで増えるトークン数
+
+SUMMARY_LABEL = "これまでの会話の要約:\n"
+
+
+def estimate_tokens(text):
+    """
+    トークン数の見積もり
+    日本語はおおよそ1文字1トークン、ASCII はおおよそ4文字1トークンとして数える
+    """
+    n_ascii = len(text.encode('ascii', 'ignore'))
+    return len(text) - n_ascii + (n_ascii + 3) // 4
+
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+class ConversationContext:
+    """
+    会話の要約と、どこまで要約したかを持つ（st.session_state に1つ置いて使う）
+    履歴のメッセージ自体は持たず、呼び出しごとに st.session_state["messages"] を受け取る
+    """
+
+    def __init__(self, system_prompt, budget=history_budget):
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.summary = ""
+        self.summary_turns = 0  # 要約が何往復分か
+        self.summarized = 0  # 送らずに要約で置き換えた会話のメッセージ数（先頭から）
+        self._tokens = []  # 会話のメッセージごとの見積もりトークン数
+
+    def _turns(self, history):
+        """システムメッセージを除いた会話のメッセージ"""
+        turns = [m for m in history if m["role"] in ("user", "assistant")]
+        if len(turns) < len(self._tokens):
+            # 履歴が作り直された場合は最初から数え直す
+            self.summary, self.summary_turns, self.summarized, self._tokens = "", 0, 0, []
+        self._tokens.extend(message_tokens(m) for m in turns[len(self._tokens):])
+        return turns
+
+    def _fixed_tokens(self):
+        tokens = estimate_tokens(self.system_prompt) + MESSAGE_OVERHEAD
+        if self.summary:
+            tokens += estimate_tokens(SUMMARY_LABEL + self.summary) + MESSAGE_OVERHEAD
+        return tokens
+
+    def total_tokens(self, history):
+        """今のまま送った場合の見積もりトークン数"""
+        self._turns(history)
+        return self._fixed_tokens() + sum(self._tokens[self.summarized:])
+
+    def _cutoff(self, target):
+        """直近の会話が target 以下になるまで古い方から要約する場合の、要約する範囲の終わり"""
+        last = max(self.summarized, len(self._tokens) - keep_recent)
+        cutoff = self.summarized
+        remaining = sum(self._tokens[cutoff:])
+        while cutoff < last and remaining > target:
+            remaining -= self._tokens[cutoff]
+            cutoff += 1
+        return cutoff
+
+    def messages(self, history, running_summary):
+        """
+        API に送るメッセージのリストを返す
+        running_summary() は、会話の途中までの要約と、それが何往復分かを (summary, turns) で
+        返す関数（上限を超えたときだけ呼ぶ）
+        要約が追いついていない分も、上限を超えないように古い方から送らない
+        """
+        turns = self._turns(history)
+        if self._fixed_tokens() + sum(self._tokens[self.summarized:]) > self.budget:
+            summary, summary_turns = running_summary()
+            if summary and summary_turns >= self.summary_turns:
+                self.summary, self.summary_turns = summary, summary_turns
+            cutoff = self._cutoff(self.budget * low_water - self._fixed_tokens())
+            self.summarized = max(self.summarized, cutoff)
+
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": SUMMARY_LABEL + self.summary})
+        return messages + turns[self.summarized:]
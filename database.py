@@ -0,0 +1,101 @@
+"""
+literary_app.db への接続
+
+接続を開くたびに WAL モード・busy_timeout・キャッシュ・mmap の設定を行い、
+開いた接続はプールしておいて、画面の再実行やワーカースレッドの処理で使い回す。
+WAL モードでは読み込みと書き込みが互いに待たないので、同時に使っているセッションが
+データベースファイルの取り合いで1つずつ順番に処理されることがなくなる。
+
+    with database.connection() as conn:
+        row = conn.execute("SELECT ...", (...,)).fetchone()
+
+書き込みは従来通り with conn: か conn.commit() で確定する（確定しないまま返した接続は取り消す）。
+"""
+import contextlib
+import sqlite3
+import threading
+
+db_file = "literary_app.db"
+busy_timeout = 30.0  # 他の接続が書き込み中のときに待つ時間（秒）
+cache_size_kib = 16 * 1024  # 接続ごとのページキャッシュ（KiB）
+mmap_size = 256 * 1024 * 1024  # メモリマップで読む大きさ（バイト）
+max_idle = 8  # プールしておく使っていない接続の数
+
+
+def configure(conn):
+    """接続に WAL モードなどの設定を行う"""
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout * 1000)}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    # WAL モードでは NORMAL でもデータベースは壊れない（電源断で最後のコミットが失われることはある）
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{cache_size_kib}")
+    conn.execute(f"PRAGMA mmap_size = {mmap_size}")
+    return conn
+
+
+def connect(path=None):
+    """設定済みの新しい接続を開く（スクリプトなど、プールを使わない場合）"""
+    return configure(sqlite3.connect(path or db_file, timeout=busy_timeout, check_same_thread=False))
+
+
+class ConnectionPool:
+    """同じデータベースへの接続を使い回す（空いている接続が無ければ新しく開く）"""
+
+    def __init__(self, path, max_idle=max_idle):
+        self.path = path
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        # WAL への切り替えは同時に行うと失敗することがあるので、最初の接続はここで開いておく
+        self._idle = [connect(path)]
+        self.opened = 1
+
+    @contextlib.contextmanager
+    def connection(self, row_factory=None):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = connect(self.path)
+            with self._lock:
+                self.opened += 1
+        conn.row_factory = row_factory
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=None):
+    """プロセスで共有する、データベースファイルごとのプール"""
+    path = path or db_file
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path)
+        return _pools[path]
+
+
+def connection(path=None, row_factory=None):
+    """プールから接続を借りる（with を抜けると返す）"""
+    return get_pool(path).connection(row_factory)
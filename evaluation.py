@@ -0,0 +1,259 @@
+"""
+会話の要約・創造性評価の処理のうち、画面を使わない部分
+
+Streamlit の画面を触らないので、ジョブキューのワーカースレッドやベンチマークからも呼び出せる。
+会話の要約は1往復ごとに前回の要約と新しい1往復から更新し（summarize_turn）、
+対話終了時（summarize）にはその要約をそのまま保存する。これらと創造性評価（evaluate）は
+ジョブとして get_job_queue() に登録し、画面の処理とは別に実行する。
+"""
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import llm_cache
+import llm_metrics
+import user_db
+from job_queue import JobQueue
+
+translate_workers = 5  # 翻訳の API を同時に呼び出す数の上限
+
+
+def summarize_conversation(messages):
+    """会話履歴を400文字にまとめた要約を作成"""
+    summary_prompt = [
+        {"role": "system", "content": "以下の会話履歴を400文字にまとめた要約を作成してください。"},
+        {"role": "user", "content": json.dumps(messages, ensure_ascii=False)}
+    ]
+
+    with llm_metrics.tags(site="summary"):
+        response = llm_cache.chat_completion(
+            model="gpt-3.5-turbo",
+            use_cache=True,
+            messages=summary_prompt
+        )
+    return response["choices"][0]["message"]["content"]
+
+
+def update_summary(summary, messages):
+    """これまでの要約に続きの会話を畳み込んだ要約を作成（会話全体を読み直さない）"""
+    with llm_metrics.tags(site="summary"):
+        response = llm_cache.chat_completion(
+            model="gpt-3.5-turbo",
+            use_cache=True,
+            messages=[
+                {"role": "system", "content": "これまでの会話の要約と、その続きの会話が与えられます。続きの内容も含めて、会話全体を400文字以内の要約にまとめてください。"},
+                {"role": "user", "content": json.dumps({"summary": summary, "messages": messages}, ensure_ascii=False)},
+            ]
+        )
+    return response["choices"][0]["message"]["content"]
+
+
+def fetch_running_summary(record_id):
+    """会話の途中までの要約と、それが何往復分か（無ければ ("", 0)）"""
+    with database.connection() as conn:
+        row = conn.execute(
+            "SELECT summary, turns FROM RUNNING_SUMMARY WHERE conversation_id = ?", (record_id,)
+        ).fetchone()
+    return row if row else ("", 0)
+
+
+def save_running_summary(record_id, summary, turns):
+    with database.connection() as conn, conn:
+        conn.execute(
+            """
+            INSERT INTO RUNNING_SUMMARY (conversation_id, summary, turns) VALUES (?, ?, ?)
+            ON CONFLICT (conversation_id) DO UPDATE SET summary = excluded.summary, turns = excluded.turns
+            """,
+            (record_id, summary, turns),
+        )
+
+
+def save_summary(record_id, summary):
+    """CONVERSATIONテーブルの会話に要約を保存する"""
+    with database.connection() as conn, conn:
+        conn.execute(
+            "UPDATE CONVERSATION SET summary = ?, updated = ? WHERE id = ?",
+            (summary, time.time(), record_id),
+        )
+
+
+def fetch_summary(record_id):
+    return fetch_summary_and_title(record_id)[0]
+
+
+def fetch_summary_and_title(record_id):
+    """CONVERSATIONテーブルの会話の要約と作品名（無ければ (None, None)）"""
+    with database.connection() as conn:
+        row = conn.execute("SELECT summary, title FROM CONVERSATION WHERE id = ?", (record_id,)).fetchone()
+    return row if row else (None, None)
+
+
+def evaluate_creativity(summary):
+    """
+    GPT-APIを使用して創造性評価を行い、スコアと説明を返す
+    （応答を解析できない場合は ValueError を送出する）
+    """
+    prompt = f"""
+    You are an expert evaluator specializing in assessing creativity and cognitive performance.
+    Evaluate the following summary based on the criteria below. Provide a score (0-10) for each, and include a brief explanation for each score to justify your assessment.
+
+    ### Criteria:
+    1. **Relevance**: How well does the summary align with the core idea or purpose it is meant to convey?
+    2. **Creativity**: To what extent does the summary demonstrate original or innovative thinking?
+    3. **Flexibility**: Does the summary show adaptability or the ability to approach the subject matter from multiple perspectives?
+    4. **Problem-Solving**: How effectively does the summary address challenges or provide solutions within the context it describes?
+    5. **Insight**: Does the summary reflect deep understanding, analysis, or unique perspectives about the topic?
+
+    ### Summary to Evaluate:
+    "{summary}"
+
+    ### Instructions:
+    - Assign a score from 0 (poor) to 10 (excellent) for each criterion.
+    - Provide scores in JSON format and include brief explanations for each criterion to clarify the rationale behind your evaluation.
+
+    ### Output Format (return only JSON):
+    {{
+      "Relevance": {{ "score": 0, "explanation": "..." }},
+      "Creativity": {{ "score": 0, "explanation": "..." }},
+      "Flexibility": {{ "score": 0, "explanation": "..." }},
+      "Problem_Solving": {{ "score": 0, "explanation": "..." }},
+      "Insight": {{ "score": 0, "explanation": "..." }}
+    }}
+    """
+
+    try:
+        with llm_metrics.tags(site="evaluate"):
+            response = llm_cache.chat_completion(
+                model="gpt-3.5-turbo",
+                use_cache=True,
+                messages=[
+                    {"role": "system", "content": "You are an evaluation assistant."},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+
+        # GPTのレスポンスをJSONとして解析
+        scores = json.loads(response['choices'][0]['message']['content'])
+
+        # スコアのみを抽出して整数値に変換し、辞書形式で返す
+        for key, value in scores.items():
+            value['score'] = int(value['score'])  # スコアを整数化
+
+        return scores
+    except (json.JSONDecodeError, KeyError, ValueError) as e:
+        raise ValueError(f"Error parsing GPT response: {e}") from e
+
+
+def save_scores(conversation_id, scores):
+    """EVALUATIONテーブルに評価スコアを追加する"""
+    with database.connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO EVALUATION (conversation_id, Relevance, Creativity, Flexibility, Problem_Solving, Insight, created)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (conversation_id, scores["Relevance"], scores["Creativity"], scores["Flexibility"], scores["Problem_Solving"], scores["Insight"], time.time())
+        )
+        conn.commit()
+
+
+def translate_to_japanese(text):
+    """英語の説明を日本語に翻訳（失敗したら例外を送出する）"""
+    with llm_metrics.tags(site="translate"):
+        response = llm_cache.chat_completion(
+            model="gpt-3.5-turbo",
+            use_cache=True,
+            messages=[
+                {"role": "system", "content": "Translate the following text into Japanese."},
+                {"role": "user", "content": text}
+            ]
+        )
+    return response['choices'][0]['message']['content'].strip()
+
+
+def translate_explanations(texts, max_workers=translate_workers):
+    """
+    複数の説明をスレッドプールで同時に翻訳する
+    (翻訳, 例外) のリストを texts の順に返す（失敗したものは翻訳の代わりに元のテキスト）
+    """
+    if not texts:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(texts))) as executor:
+        # 計測用の site / title をワーカースレッドに引き継ぐ
+        futures = [executor.submit(contextvars.copy_context().run, translate_to_japanese, text) for text in texts]
+    results = []
+    for text, future in zip(texts, futures):
+        try:
+            results.append((future.result(), None))
+        except Exception as e:
+            results.append((text, e))
+    return results
+
+
+def run_summarize_turn_job(payload):
+    """
+    1往復ごとの要約ジョブ: 前回までの要約に新しい1往復（payload["messages"]）を畳み込む
+    payload["turn"] はこの往復の番号（0始まり、0なら会話の最初なので前回の要約は使わない）
+    """
+    summary, turns = fetch_running_summary(payload["record_id"]) if payload["turn"] > 0 else ("", 0)
+    if turns != payload["turn"]:
+        # 前の往復の要約に失敗している（対話終了時に会話全体から要約し直す）
+        return {"skipped": True}
+    with llm_metrics.tags(title=payload["title"]):
+        summary = update_summary(summary, payload["messages"])
+    save_running_summary(payload["record_id"], summary, turns + 1)
+    return {"summary": summary, "turns": turns + 1}
+
+
+def run_summarize_job(payload):
+    """
+    要約ジョブ: 会話の要約を CONVERSATION テーブルに保存する
+    1往復ごとの要約が最後の往復まで済んでいればそれを使い、そうでなければ
+    MESSAGE テーブルから会話全体を読み込んで要約する
+    （1往復ごとの要約ジョブより後に登録されるので、それらが終わってから実行される）
+    """
+    summary, turns = fetch_running_summary(payload["record_id"])
+    if not summary or turns != payload["turns"]:
+        messages = user_db.fetch_messages(payload["record_id"])
+        with llm_metrics.tags(title=payload["title"]):
+            summary = summarize_conversation(messages)
+    save_summary(payload["record_id"], summary)
+    return {"summary": summary}
+
+
+def run_evaluate_job(payload):
+    """評価ジョブ: 要約を評価してスコアを保存し、スコアと日本語に翻訳した説明を返す"""
+    summary, title = fetch_summary_and_title(payload["record_id"])
+    if not summary:
+        raise ValueError("要約がまだ保存されていません。")
+    with llm_metrics.tags(title=title):
+        scores = evaluate_creativity(summary)
+        save_scores(payload["record_id"], {key: value['score'] for key, value in scores.items()})
+        translations = translate_explanations([value['explanation'] for value in scores.values()])
+    return {
+        "scores": scores,
+        "translations": [text for text, _ in translations],
+        "translation_errors": [None if error is None else str(error) for _, error in translations],
+    }
+
+
+JOB_HANDLERS = {
+    "summarize_turn": run_summarize_turn_job,
+    "summarize": run_summarize_job,
+    "evaluate": run_evaluate_job,
+}
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """プロセスで共有するジョブキュー（最初に使うときにワーカーを起動する）"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(JOB_HANDLERS, database.db_file).start()
+        return _job_queue
@@ -0,0 +1,212 @@
+"""
+時間のかかる処理（会話の要約・創造性評価）を画面の処理とは別に実行するジョブキュー
+
+ジョブは literary_app.db の JOBS テーブルに保存し、プロセスに1つのワーカースレッドが
+登録順に取り出して実行する。画面側は submit でジョブを登録してすぐに戻り、
+get / latest で状態（queued → running → done / failed）と結果を確認する。
+
+実行中のジョブには、取り出したプロセス（owner）と、実行中に定期的に更新する時刻（heartbeat）を
+記録する。同じデータベースを複数のプロセスが使っていても、heartbeat が stale_after 秒以上
+更新されていない（プロセスが止まった）ジョブだけをやり直す。
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+
+import database
+
+db_file = database.db_file
+poll_interval = 1.0  # 他のプロセスが登録したジョブを確認する間隔（秒）
+heartbeat_interval = 10.0  # 実行中のジョブの heartbeat を更新する間隔（秒）
+stale_after = 60.0  # heartbeat がこれだけ更新されていない実行中のジョブはやり直す（秒）
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def init_jobs_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS JOBS (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            ref TEXT,
+            payload TEXT,
+            status TEXT,
+            result TEXT,
+            error TEXT,
+            created REAL,
+            started REAL,
+            finished REAL,
+            owner TEXT,
+            heartbeat REAL
+        )
+    ''')
+    # owner / heartbeat の無い以前の JOBS テーブルには列を追加する
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(JOBS)")}
+    for column, column_type in (("owner", "TEXT"), ("heartbeat", "REAL")):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE JOBS ADD COLUMN {column} {column_type}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON JOBS (status, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_kind_ref ON JOBS (kind, ref)")
+    conn.commit()
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+class JobQueue:
+    """
+    handlers: ジョブの種類 → payload を受け取って結果（JSONにできるもの）を返す関数
+    ワーカーは1つなので、同じプロセスで登録したジョブは登録順に実行される
+    """
+
+    def __init__(self, handlers, db_path=db_file):
+        self.handlers = handlers
+        self.db_path = db_path
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        with self._connection() as conn:
+            init_jobs_table(conn)
+
+    def _connection(self):
+        return database.connection(self.db_path, row_factory=sqlite3.Row)
+
+    def submit(self, kind, payload, ref=None):
+        """ジョブを登録して、ジョブの id を返す"""
+        if kind not in self.handlers:
+            raise ValueError(f"不明なジョブの種類です: {kind}")
+        with self._connection() as conn:
+            with conn:
+                cur = conn.execute(
+                    "INSERT INTO JOBS (kind, ref, payload, status, created) VALUES (?, ?, ?, ?, ?)",
+                    (kind, None if ref is None else str(ref), json.dumps(payload, ensure_ascii=False),
+                     QUEUED, time.time()),
+                )
+            job_id = cur.lastrowid
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """ジョブの状態と結果（無ければNone）"""
+        with self._connection() as conn:
+            return _row_to_job(conn.execute("SELECT * FROM JOBS WHERE id = ?", (job_id,)).fetchone())
+
+    def latest(self, kind, ref):
+        """種類と ref が一致する最後に登録したジョブ（無ければNone）"""
+        with self._connection() as conn:
+            return _row_to_job(conn.execute(
+                "SELECT * FROM JOBS WHERE kind = ? AND ref = ? ORDER BY id DESC LIMIT 1",
+                (kind, str(ref)),
+            ).fetchone())
+
+    def _claim(self, conn):
+        """待っているジョブを1つ実行中にして返す（無ければNone）"""
+        with conn:
+            row = conn.execute(
+                "SELECT * FROM JOBS WHERE status = ? ORDER BY id LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            cur = conn.execute(
+                "UPDATE JOBS SET status = ?, started = ?, owner = ?, heartbeat = ? WHERE id = ? AND status = ?",
+                (RUNNING, now, self.owner, now, row["id"], QUEUED),
+            )
+        return _row_to_job(row) if cur.rowcount else None
+
+    def _beat(self, job_id, done):
+        """ジョブが終わるまで heartbeat を更新する（別スレッドで実行する）"""
+        while not done.wait(heartbeat_interval):
+            try:
+                with self._connection() as conn, conn:
+                    conn.execute(
+                        "UPDATE JOBS SET heartbeat = ? WHERE id = ? AND owner = ?",
+                        (time.time(), job_id, self.owner),
+                    )
+            except sqlite3.Error:
+                traceback.print_exc()
+
+    def requeue_stale(self):
+        """heartbeat が stale_after 秒以上更新されていない実行中のジョブを待ちに戻し、その数を返す"""
+        with self._connection() as conn, conn:
+            cur = conn.execute(
+                "UPDATE JOBS SET status = ?, owner = NULL WHERE status = ? AND COALESCE(heartbeat, started, 0) < ?",
+                (QUEUED, RUNNING, time.time() - stale_after),
+            )
+        return cur.rowcount
+
+    def run_next(self):
+        """待っているジョブを1つ実行する（実行したら True）"""
+        # ハンドラーの実行中（API の呼び出しで数秒かかる）は接続をプールに返しておく
+        with self._connection() as conn:
+            job = self._claim(conn)
+        if job is None:
+            return False
+        done = threading.Event()
+        beat = threading.Thread(target=self._beat, args=(job["id"], done), name="job-heartbeat", daemon=True)
+        beat.start()
+        try:
+            result = self.handlers[job["kind"]](job["payload"])
+            status, result, error = DONE, json.dumps(result, ensure_ascii=False), None
+        except Exception as e:
+            traceback.print_exc()
+            status, result, error = FAILED, None, f"{type(e).__name__}: {e}"
+        finally:
+            done.set()
+            beat.join()
+        # やり直しのために他のプロセスに渡ったジョブには結果を書き込まない
+        with self._connection() as conn, conn:
+            conn.execute(
+                "UPDATE JOBS SET status = ?, result = ?, error = ?, finished = ? WHERE id = ? AND owner = ?",
+                (status, result, error, time.time(), job["id"], self.owner),
+            )
+        return True
+
+    def _work(self):
+        last_check = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                if self.run_next():
+                    continue
+                # 他のプロセスが実行中のまま止まったジョブも、待ちのジョブが無いときに拾う
+                if time.monotonic() - last_check >= stale_after:
+                    last_check = time.monotonic()
+                    if self.requeue_stale():
+                        continue
+            except sqlite3.Error:
+                traceback.print_exc()
+            self._wakeup.wait(poll_interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """
+        ワーカースレッドを起動する
+        （実行中のまま止まったジョブはやり直す。他のプロセスが実行中のジョブはそのままにする）
+        """
+        if self._thread is not None:
+            return self
+        self.requeue_stale()
+        self._thread = threading.Thread(target=self._work, name="job-queue", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
@@ -0,0 +1,236 @@
+"""
+ChatGPT API の応答キャッシュ
+
+同じモデル・同じメッセージでの呼び出し（変わっていない要約の再評価、同じ説明文の翻訳など）は
+API を呼ばずに前回の応答を返す。キャッシュは SQLite（llm_cache.db）に保存するので
+再起動しても残り、合計サイズが上限を超えたら最後に使われたのが古いものから削除する（LRU）。
+合計サイズは LLM_CACHE_SIZE テーブルにトリガーで数えておき、書き込みのたびに全体を数え直さない。
+
+キャッシュを使うかは呼び出し元ごとに use_cache=True で指定する（要約・評価・翻訳）。
+チャットの応答は同じ質問でも毎回違ってよいので、キャッシュしない。
+"""
+import json
+import sqlite3
+import threading
+import time
+
+import database
+import llm_client
+import llm_metrics
+
+cache_file = "llm_cache.db"
+max_bytes = 64 * 1024 * 1024  # 応答の合計サイズの上限
+evict_to = 0.9  # 上限を超えたら、上限のこの割合まで削除する（毎回の書き込みで削除しないため）
+
+
+# モデル・メッセージ・その他のパラメータから決まるキー（同時に来た同じ呼び出しをまとめるのと同じキー）
+cache_key = llm_client.request_key
+
+
+class ResponseCache:
+    """SQLite に保存する LRU キャッシュ（スレッド間で共有できる）"""
+
+    def __init__(self, path=cache_file, max_bytes=max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = database.connect(path)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS LLM_CACHE (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                size INTEGER,
+                created REAL,
+                last_used REAL
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON LLM_CACHE (last_used)")
+        # 応答の合計サイズ（1行だけのテーブル、LLM_CACHE の変更に合わせてトリガーで更新する）
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS LLM_CACHE_SIZE (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total INTEGER NOT NULL
+            )
+        ''')
+        self._conn.execute(
+            "INSERT OR IGNORE INTO LLM_CACHE_SIZE (id, total) SELECT 0, TOTAL(size) FROM LLM_CACHE"
+        )
+        self._conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS llm_cache_size_insert AFTER INSERT ON LLM_CACHE BEGIN
+                UPDATE LLM_CACHE_SIZE SET total = total + NEW.size WHERE id = 0;
+            END
+        ''')
+        self._conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS llm_cache_size_update AFTER UPDATE OF size ON LLM_CACHE BEGIN
+                UPDATE LLM_CACHE_SIZE SET total = total - OLD.size + NEW.size WHERE id = 0;
+            END
+        ''')
+        self._conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS llm_cache_size_delete AFTER DELETE ON LLM_CACHE BEGIN
+                UPDATE LLM_CACHE_SIZE SET total = total - OLD.size WHERE id = 0;
+            END
+        ''')
+        self._conn.commit()
+
+    def total_bytes(self):
+        """応答の合計サイズ（トリガーで数えている値を読むだけ）"""
+        return self._conn.execute("SELECT total FROM LLM_CACHE_SIZE WHERE id = 0").fetchone()[0]
+
+    def get(self, key):
+        """キャッシュされた応答（無ければNone）"""
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM LLM_CACHE WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute("UPDATE LLM_CACHE SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, model, response):
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self._lock, self._conn:
+            # INSERT OR REPLACE では削除のトリガーが動かないので、既にあれば UPDATE にする
+            self._conn.execute(
+                """
+                INSERT INTO LLM_CACHE (key, model, response, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET model = excluded.model, response = excluded.response,
+                    size = excluded.size, created = excluded.created, last_used = excluded.last_used
+                """,
+                (key, model, data, len(data.encode("utf-8")), now, now),
+            )
+            total = self.total_bytes()
+            if total > self.max_bytes:
+                self._evict(total - int(self.max_bytes * evict_to))
+
+    def _evict(self, excess):
+        """最後に使われたのが古いものから、合計 excess バイト以上を削除する"""
+        keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM LLM_CACHE ORDER BY last_used, key"):
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= size
+        self._conn.executemany("DELETE FROM LLM_CACHE WHERE key = ?", keys)
+
+    def stats(self):
+        """ヒット数・ミス数・件数・合計サイズ"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM LLM_CACHE").fetchone()[0]
+            size = self.total_bytes()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "bytes": int(size),
+        }
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM LLM_CACHE")
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    """プロセスで共有するキャッシュ（最初に使うときに開く）"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(cache_file)
+        return _default_cache
+
+
+def _cache_get(cache, key):
+    try:
+        return cache.get(key)
+    except sqlite3.Error:
+        return None  # キャッシュが使えなくても API の呼び出しは続ける
+
+
+def _cache_put(cache, key, model, response):
+    try:
+        cache.put(key, model, response)
+    except sqlite3.Error:
+        pass
+
+
+def chat_completion(model, messages, use_cache=False, **params):
+    """
+    openai.ChatCompletion.create の代わりに使う
+    use_cache=True なら、キャッシュにあればその応答を、無ければ API を呼んで応答を保存してから返す
+    （stream=True の呼び出しはキャッシュしない、stream_chat_completion を使う）
+    呼び出しごとに待ち時間・トークン数・キャッシュの状況（hit / miss / off）を llm_metrics に記録する
+    """
+    if params.get("stream"):
+        return llm_client.get_client().create(model=model, messages=messages, **params)
+
+    start = time.perf_counter()
+    status = "miss" if use_cache else "off"
+    if use_cache:
+        cache = get_cache()
+        key = cache_key(model, messages, **params)
+        cached = _cache_get(cache, key)
+        if cached is not None:
+            llm_metrics.record_call(model, messages, "hit", start, response=cached)
+            return cached
+
+    try:
+        response = llm_client.get_client().create(model=model, messages=messages, **params)
+    except Exception as e:
+        llm_metrics.record_call(model, messages, status, start, error=e)
+        raise
+    if use_cache:
+        _cache_put(cache, key, model, response)
+    llm_metrics.record_call(model, messages, status, start, response=response)
+    return response
+
+
+def stream_chat_completion(model, messages, use_cache=False, **params):
+    """
+    応答の本文を届いた分から順に返すジェネレータ
+    use_cache=True なら、最後まで受け取れた応答だけを stream=False の場合と同じ形でキャッシュに保存する
+    （キャッシュにあればその本文を一度に返す）
+    """
+    start = time.perf_counter()
+    status = "miss" if use_cache else "off"
+    if use_cache:
+        cache = get_cache()
+        key = cache_key(model, messages, **params)
+        cached = _cache_get(cache, key)
+        if cached is not None:
+            llm_metrics.record_call(model, messages, "hit", start, response=cached, stream=True)
+            yield cached["choices"][0]["message"]["content"]
+            return
+
+    role = "assistant"
+    pieces = []
+    first_token = None
+    try:
+        for chunk in llm_client.get_client().create(model=model, messages=messages, stream=True, **params):
+            delta = chunk["choices"][0]["delta"]
+            role = delta.get("role", role)
+            content = delta.get("content")
+            if content:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                pieces.append(content)
+                yield content
+    except Exception as e:
+        llm_metrics.record_call(model, messages, status, start, content="".join(pieces),
+                                first_token=first_token, error=e, stream=True)
+        raise
+    response = {"choices": [{"message": {"role": role, "content": "".join(pieces)}}]}
+    if use_cache:
+        _cache_put(cache, key, model, response)
+    llm_metrics.record_call(model, messages, status, start, content=response["choices"][0]["message"]["content"],
+                            first_token=first_token, stream=True)
@@ -0,0 +1,338 @@
+"""
+ChatGPT API を呼び出すクライアント
+
+呼び出し先（バックエンド）を差し替えられるようにし、タイムアウトと、混雑時の再試行
+（指数的に延ばした待ち時間にゆらぎを加える）をまとめて扱う。
+プロセスで1つのクライアントを共有し、全セッションの呼び出しを合わせて
+エンドポイント（モデル）ごとの上限（1分あたりのリクエスト数・トークン数）に収まるように
+待たせる。同じ内容の呼び出しが同時に来た場合は1回だけ API を呼び、結果を分け合う。
+
+    OpenAIBackend : openai ライブラリ経由で API を呼ぶ（HTTP の接続はプールして使い回す）
+    FakeBackend   : ネットワークを使わず、メッセージから決まる応答を返す（負荷・待ち時間の確認用）
+
+どちらを使うかは環境変数 LLM_BACKEND（openai / fake）で選ぶ。
+"""
+import collections
+import copy
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+import openai
+import requests
+
+from chat_context import estimate_tokens
+
+connect_timeout = 5.0  # 接続のタイムアウト（秒）
+read_timeout = 60.0  # 応答のタイムアウト（秒）
+pool_size = 10  # プールしておく接続数（同時に呼び出すスレッド数より多めにする）
+max_retries = 4  # 混雑・一時的なエラーのときに再試行する回数
+backoff_base = 0.5  # 再試行の待ち時間の基準（秒、1回ごとに倍にする）
+backoff_max = 8.0  # 再試行の待ち時間の上限（秒）
+
+# エンドポイント（モデル）ごとの1分あたりの上限（契約している上限より少し低めにする）
+rate_limits = {
+    "gpt-3.5-turbo": {"requests": 3000, "tokens": 80000},
+}
+default_rate_limit = {"requests": 500, "tokens": 40000}
+burst_seconds = 5.0  # 何秒分までまとめて使えるか（バケツの容量）
+completion_tokens_estimate = 400  # 応答のトークン数の見積もり（上限の計算に使う）
+
+# 再試行するエラー（混雑・サーバー側の一時的なエラー・接続エラー）
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+)
+
+
+class OpenAIBackend:
+    """openai ライブラリ（0.28）で API を呼ぶ"""
+
+    def __init__(self, connect_timeout=connect_timeout, read_timeout=read_timeout, pool_size=pool_size):
+        self.timeout = (connect_timeout, read_timeout)
+        # openai 0.28 はスレッドごとに Session を作るので、プールした Session を共有させる
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        openai.requestssession = session
+        self.session = session
+
+    def create(self, **params):
+        params.setdefault("request_timeout", self.timeout)
+        return openai.ChatCompletion.create(**params)
+
+
+class FakeBackend:
+    """
+    ネットワークを使わない偽のバックエンド
+    応答はメッセージのハッシュから決まるので、同じ入力には常に同じ応答を返す
+    latency / token_delay で待ち時間を、rate_limit_every で n 回に1回の混雑エラーを、
+    quota_per_second で1秒あたりの上限を超えたときの混雑エラーを再現できる
+    """
+
+    CRITERIA = ["Relevance", "Creativity", "Flexibility", "Problem_Solving", "Insight"]
+
+    def __init__(self, latency=0.0, token_delay=0.0, rate_limit_every=0, quota_per_second=0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.rate_limit_every = rate_limit_every
+        self.quota_per_second = quota_per_second
+        self.calls = 0
+        self.rate_limited = 0  # 混雑エラーにした回数
+        self._recent = collections.deque()  # 直近1秒に受け付けた時刻
+        self._lock = threading.Lock()
+
+    def _over_quota(self, calls):
+        if self.rate_limit_every and calls % self.rate_limit_every == 0:
+            return True
+        if self.quota_per_second:
+            now = time.monotonic()
+            while self._recent and self._recent[0] <= now - 1:
+                self._recent.popleft()
+            if len(self._recent) >= self.quota_per_second:
+                return True
+            self._recent.append(now)
+        return False
+
+    def reply(self, messages):
+        """メッセージに対する決まった応答"""
+        digest = hashlib.sha256(json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8")).digest()
+        first = messages[0]["content"] if messages else ""
+        last = messages[-1]["content"] if messages else ""
+        if first.startswith("Translate"):
+            return f"（訳）{last}"
+        if "return only JSON" in last:
+            return json.dumps({
+                name: {"score": digest[i] % 11, "explanation": f"Fake explanation for {name}."}
+                for i, name in enumerate(self.CRITERIA)
+            })
+        return f"（{digest.hex()[:8]}）「{last[:20]}」についての応答です。"
+
+    def create(self, model, messages, stream=False, **params):
+        with self._lock:
+            self.calls += 1
+            limited = self._over_quota(self.calls)
+            self.rate_limited += limited
+        time.sleep(self.latency)
+        if limited:
+            raise openai.error.RateLimitError("Rate limit reached (fake backend)", http_status=429)
+
+        content = self.reply(messages)
+        if stream:
+            return self._stream(content)
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = estimate_tokens(content)
+        return {
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def _stream(self, content):
+        yield {"choices": [{"index": 0, "delta": {"role": "assistant"}}]}
+        for i in range(0, len(content), 4):
+            time.sleep(self.token_delay)
+            yield {"choices": [{"index": 0, "delta": {"content": content[i:i + 4]}}]}
+
+
+def request_key(model, messages, **params):
+    """モデル・メッセージ・その他のパラメータから決まるキー（同じ呼び出しなら同じ値）"""
+    payload = json.dumps({"model": model, "messages": messages, "params": params},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TokenBucket:
+    """1秒あたり rate ずつ、capacity まで溜まるバケツ"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, amount):
+        """amount を取り出す（足りない分は前借りする）。使えるようになるまでの秒数を返す"""
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+            self._updated = now
+            self._level -= min(amount, self.capacity)
+            return max(0.0, -self._level / self.rate)
+
+    def acquire(self, amount=1):
+        """amount が使えるようになるまで待つ（待った秒数を返す）"""
+        wait = self._reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RateLimiter:
+    """エンドポイントごとのリクエスト数・トークン数のバケツ"""
+
+    def __init__(self, limits=None, default=None, burst=burst_seconds):
+        self.limits = rate_limits if limits is None else limits
+        self.default = default_rate_limit if default is None else default
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.waits = 0  # 待たせた回数
+        self.wait_time = 0.0  # 待たせた時間の合計（秒）
+
+    def _endpoint_buckets(self, endpoint):
+        with self._lock:
+            if endpoint not in self._buckets:
+                limit = self.limits.get(endpoint, self.default)
+                self._buckets[endpoint] = tuple(
+                    TokenBucket(limit[name] / 60, limit[name] / 60 * self.burst)
+                    for name in ("requests", "tokens")
+                )
+            return self._buckets[endpoint]
+
+    def acquire(self, endpoint, tokens):
+        """1リクエスト・tokens トークン分が使えるようになるまで待つ"""
+        requests_bucket, tokens_bucket = self._endpoint_buckets(endpoint)
+        wait = requests_bucket.acquire(1) + tokens_bucket.acquire(tokens)
+        if wait > 0:
+            with self._lock:
+                self.waits += 1
+                self.wait_time += wait
+        return wait
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """同じキーの処理が実行中なら、それが終わるのを待って同じ結果を返す"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0  # 他の呼び出しの結果を使った回数
+
+    def do(self, key, func):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)  # 呼び出し元が書き換えても互いに影響しないように
+
+        try:
+            flight.result = func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+
+def _estimate_request_tokens(messages):
+    return sum(estimate_tokens(m["content"]) for m in messages) + completion_tokens_estimate
+
+
+def _retry_after(error):
+    """エラーの Retry-After ヘッダーの秒数（無ければNone）"""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """
+    バックエンドを呼び出し、一時的なエラーならゆらぎを加えた指数的な待ち時間で再試行する
+    呼び出し（再試行を含む）の前には rate_limiter で上限に収まるまで待ち、
+    同じ内容の呼び出し（stream=True 以外）が実行中ならその結果を使う
+    """
+
+    def __init__(self, backend, max_retries=max_retries, backoff_base=backoff_base, backoff_max=backoff_max,
+                 rate_limiter=None):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = RateLimiter() if rate_limiter is None else rate_limiter
+        self.single_flight = SingleFlight()
+        self.retries = 0  # 再試行した回数の合計
+
+    def backoff(self, attempt, error=None):
+        """attempt 回目の再試行までの待ち時間（0 から上限までの一様乱数、Retry-After があればそれ以上）"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def create(self, **params):
+        """openai.ChatCompletion.create と同じ引数・戻り値（stream=True なら応答のイテレータ）"""
+        if params.get("stream"):
+            return self._create(params)
+        return self.single_flight.do(request_key(**params), lambda: self._create(params))
+
+    def _create(self, params):
+        tokens = _estimate_request_tokens(params["messages"])
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire(params["model"], tokens)
+            try:
+                return self.backend.create(**params)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                time.sleep(self.backoff(attempt, e))
+
+
+def make_backend(name=None):
+    """名前（省略時は環境変数 LLM_BACKEND）からバックエンドを作る"""
+    name = name or os.environ.get("LLM_BACKEND", "openai")
+    if name == "openai":
+        return OpenAIBackend()
+    if name == "fake":
+        return FakeBackend()
+    raise ValueError(f"不明なバックエンドです: {name}")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """プロセスで共有するクライアント"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LLMClient(make_backend())
+        return _client
+
+
+def set_client(client):
+    """共有するクライアントを差し替える（テスト・ベンチマーク用）"""
+    global _client
+    with _client_lock:
+        _client = client
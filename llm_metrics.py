@@ -0,0 +1,181 @@
+"""
+ChatGPT API の呼び出しの計測
+
+呼び出しごとに、どこから呼んだか（site）・作品名（title）・待ち時間・トークン数・
+キャッシュに当たったか・エラーを literary_app.db の LLM_METRICS テーブルに記録する。
+記録はメモリにためておき、別スレッドがまとめて書き込むので、呼び出し側はほとんど待たない。
+
+記録先は環境変数 LLM_METRICS_DB（省略時は literary_app.db）、または db_file で変えられる
+（ベンチマークなどで、アプリのデータベースに記録を残さないため）。
+
+site / title は呼び出し元で tags() を使って設定する（ワーカースレッドに渡すときは
+contextvars.copy_context() で引き継ぐ）。
+
+    with llm_metrics.tags(site="chat", title=selected_title):
+        llm_cache.chat_completion(...)
+"""
+import atexit
+import contextlib
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+import database
+from chat_context import estimate_tokens
+
+db_file = os.environ.get("LLM_METRICS_DB", database.db_file)  # 記録先（最初に記録するときに開く）
+flush_size = 50  # これだけたまったら書き込む
+flush_interval = 2.0  # 少なくともこの間隔（秒）で書き込む
+
+# 1000トークンあたりの料金（USD）
+prices = {
+    "gpt-3.5-turbo": {"prompt": 0.0005, "completion": 0.0015},
+}
+
+# 呼び出し元の情報
+_tags = contextvars.ContextVar("llm_metrics_tags", default={})
+
+
+@contextlib.contextmanager
+def tags(**values):
+    """with の中の呼び出しに site / title などを付ける（外側で付けた値は引き継ぐ）"""
+    token = _tags.set({**_tags.get(), **values})
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def current_tags():
+    return dict(_tags.get())
+
+
+def init_metrics_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS LLM_METRICS (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL,
+            site TEXT,
+            title TEXT,
+            model TEXT,
+            cache TEXT,
+            stream INTEGER,
+            latency_ms REAL,
+            first_token_ms REAL,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            estimated INTEGER,
+            error TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_metrics_ts ON LLM_METRICS (ts)")
+    conn.commit()
+
+
+COLUMNS = ("ts", "site", "title", "model", "cache", "stream", "latency_ms", "first_token_ms",
+           "prompt_tokens", "completion_tokens", "estimated", "error")
+
+
+class MetricsRecorder:
+    """記録をためておき、flush_size 件ごと・flush_interval 秒ごとにまとめて書き込む"""
+
+    def __init__(self, db_path=db_file, flush_size=flush_size, flush_interval=flush_interval):
+        self.db_path = db_path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        with database.connection(db_path) as conn:
+            init_metrics_table(conn)
+        self._thread = threading.Thread(target=self._work, name="llm-metrics", daemon=True)
+        self._thread.start()
+
+    def record(self, **fields):
+        row = tuple(fields.get(name) for name in COLUMNS)
+        with self._lock:
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """ためている記録を書き込む"""
+        with self._write_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            with database.connection(self.db_path) as conn, conn:
+                conn.executemany(
+                    f"INSERT INTO LLM_METRICS ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows,
+                )
+
+    def _work(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                traceback.print_exc()
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """プロセスで共有する記録係（最初に使うときに書き込み用のスレッドを起動する）"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = MetricsRecorder(db_file)
+            atexit.register(_recorder.flush)
+        return _recorder
+
+
+def record_call(model, messages, cache, start, response=None, content=None, first_token=None,
+                error=None, stream=False):
+    """
+    1回の呼び出しを記録する
+    トークン数は応答の usage を使い、無ければ（ストリーミングなど）文字数から見積もる
+    """
+    now = time.perf_counter()
+    usage = response.get("usage") if response else None
+    if usage:
+        prompt_tokens, completion_tokens, estimated = usage["prompt_tokens"], usage["completion_tokens"], 0
+    else:
+        if content is None and response:
+            content = response["choices"][0]["message"]["content"]
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = estimate_tokens(content) if content else 0
+        estimated = 1
+    call_tags = current_tags()
+    get_recorder().record(
+        ts=time.time(),
+        site=call_tags.get("site"),
+        title=call_tags.get("title"),
+        model=model,
+        cache=cache,
+        stream=int(stream),
+        latency_ms=(now - start) * 1000,
+        first_token_ms=None if first_token is None else (first_token - start) * 1000,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        estimated=estimated,
+        error=None if error is None else f"{type(error).__name__}: {error}",
+    )
+
+
+def cost(model, prompt_tokens, completion_tokens):
+    """料金の見積もり（USD、料金が分からないモデルは0）"""
+    price = prices.get(model)
+    if price is None:
+        return 0.0
+    return (prompt_tokens * price["prompt"] + completion_tokens * price["completion"]) / 1000
@@ -0,0 +1,235 @@
+"""
+aozora_preprocess.py の整形結果を BOT テーブルに登録する
+
+整形済みコーパス（out_{author_id}/corpus.aozc）があればそこから、
+無ければ整形済みファイル（*_clns_utf-8.txt）から読み込む。
+
+    python load_bot_table.py [--db literary_app.db] [--batch-size 500] [--codec zlib]
+
+同じ (author, title) の作品は上書きするので、何度実行してもよい。
+本文は text_codec で圧縮して保存する（--codec で圧縮方式を指定する。省略時は zlib、
+auto なら作品ごとにすべての方式を試して選ぶ）。登録済みの本文が同じ方式で保存されていて、
+ヘッダーの raw_size と crc32 が一致する作品は圧縮し直さない。
+--compress を付けると、登録済みの圧縮していない本文を圧縮し直す。
+
+BOT テーブルに手作業で登録した同じ作品の行が重複していると (author, title) を一意にできないので、
+登録の前に次のコマンドで重複を削除する（最初に登録した1件を残し、削除した行数を表示する）。
+
+    python load_bot_table.py --dedupe [--db literary_app.db]
+"""
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+import aozora_preprocess as ap
+import database
+import text_codec
+from aozora_corpus import CorpusReader
+
+db_file = database.db_file
+batch_size = 500  # 1トランザクションで登録する作品数
+
+UPSERT_SQL = """
+    INSERT INTO BOT (author, title, text_content)
+    VALUES (?, ?, ?)
+    ON CONFLICT (author, title) DO UPDATE SET text_content = excluded.text_content
+"""
+CREATE_UNIQUE_INDEX_SQL = "CREATE UNIQUE INDEX IF NOT EXISTS idx_bot_author_title ON BOT (author, title)"
+
+
+def create_bot_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS BOT (
+            author TEXT,
+            title TEXT,
+            text_content TEXT
+        )
+    ''')
+
+
+def init_bot_table(conn):
+    """
+    BOTテーブルを作成し、(author, title) を一意にする
+    同じ (author, title) の行が既にある場合は、どの行を残すか勝手に決めずに ValueError を送出する
+    （python load_bot_table.py --dedupe で重複を削除してから登録する）
+    """
+    create_bot_table(conn)
+    if not has_unique_index(conn):
+        duplicates = find_duplicates(conn)
+        if duplicates:
+            raise ValueError(
+                f'BOT テーブルに同じ作品が重複して登録されています（{len(duplicates)} 作品）。'
+                'python load_bot_table.py --dedupe で重複を削除してください。'
+            )
+        conn.execute(CREATE_UNIQUE_INDEX_SQL)
+    conn.commit()
+
+
+def has_unique_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_bot_author_title'"
+    ).fetchone() is not None
+
+
+def find_duplicates(conn):
+    """重複して登録されている作品の (author, title, 行数) のリスト"""
+    return conn.execute(
+        "SELECT author, title, COUNT(*) FROM BOT GROUP BY author, title HAVING COUNT(*) > 1 ORDER BY author, title"
+    ).fetchall()
+
+
+def dedupe_bot_table(conn):
+    """
+    重複して登録されている作品は最初に登録した1件だけ残して削除し、(author, title) を一意にする
+    削除した (author, title, 削除した行数) のリストを返す（重複が無ければ何もしない）
+    """
+    duplicates = [(author, title, count - 1) for author, title, count in find_duplicates(conn)]
+    with conn:
+        conn.execute('''
+            DELETE FROM BOT
+             WHERE rowid NOT IN (SELECT MIN(rowid) FROM BOT GROUP BY author, title)
+        ''')
+        conn.execute(CREATE_UNIQUE_INDEX_SQL)
+    return duplicates
+
+
+def iter_corpus_works(corpus_path):
+    """整形済みコーパスから (title, text_content) を順に返す"""
+    with CorpusReader(corpus_path) as corpus:
+        yield from corpus.iter_works()
+
+
+def iter_works(edit_dir):
+    """整形済みファイルから (title, text_content) を順に返す"""
+    for path in sorted(Path(edit_dir).glob('*_clns_utf-8.txt')):
+        df = pd.read_csv(path, sep='\t', encoding='utf-8', keep_default_na=False)
+        if df.empty or 'title' not in df.columns:
+            print(f'SKIP: {path}')
+            continue
+        yield df['title'].iloc[0], '\n'.join(df['text'])
+
+
+def stored_header(conn, author, title):
+    """登録済みの本文のヘッダー（未登録・圧縮していない本文・読めない形式ならNone）"""
+    row = conn.execute(
+        "SELECT substr(text_content, 1, ?) FROM BOT WHERE author = ? AND title = ? AND typeof(text_content) = 'blob'",
+        (text_codec.HEADER.size, author, title),
+    ).fetchone()
+    try:
+        return text_codec.read_header(row[0]) if row else None
+    except ValueError:
+        return None
+
+
+def load_works(conn, author, works, batch_size=batch_size, codec=text_codec.default_codec):
+    """
+    作品を batch_size 件ずつまとめて1トランザクションで登録し、(登録件数, 変わっていない件数) を返す
+    登録済みの本文と同じで codec で保存されている作品は、圧縮も書き込みもしない
+    """
+    codecs = text_codec.codecs_for(codec)
+    count = 0
+    unchanged = 0
+    batch = []
+    for title, text_content in works:
+        if text_codec.is_encoded(stored_header(conn, author, title), text_content, codecs):
+            unchanged += 1
+            continue
+        batch.append((author, title, text_codec.encode(text_content, codecs)))
+        if len(batch) >= batch_size:
+            with conn:
+                conn.executemany(UPSERT_SQL, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        with conn:
+            conn.executemany(UPSERT_SQL, batch)
+        count += len(batch)
+    return count, unchanged
+
+
+def compress_table(conn, batch_size=batch_size, codec=text_codec.default_codec):
+    """登録済みの圧縮していない（TEXT のままの）本文を codec で圧縮し、圧縮した作品数を返す"""
+    codecs = text_codec.codecs_for(codec)
+    rowids = [row[0] for row in conn.execute("SELECT rowid FROM BOT WHERE typeof(text_content) = 'text'")]
+    for i in range(0, len(rowids), batch_size):
+        batch = []
+        for rowid in rowids[i:i + batch_size]:
+            text_content = conn.execute("SELECT text_content FROM BOT WHERE rowid = ?", (rowid,)).fetchone()[0]
+            batch.append((text_codec.encode(text_content, codecs), rowid))
+        with conn:
+            conn.executemany("UPDATE BOT SET text_content = ? WHERE rowid = ?", batch)
+    return len(rowids)
+
+
+def main(db_path=db_file, author=ap.author_name, edit_dir=ap.tx_edit_dir, batch_size=batch_size,
+         corpus_path=ap.author_corpus_file(ap.author_id), codec=text_codec.default_codec):
+    if corpus_path is not None and Path(corpus_path).exists():
+        works = iter_corpus_works(corpus_path)
+    else:
+        works = iter_works(edit_dir)
+    conn = database.connect(db_path)
+    try:
+        init_bot_table(conn)
+        count, unchanged = load_works(conn, author, works, batch_size, codec)
+    finally:
+        conn.close()
+    print(f'{count} works loaded into BOT ({author}, {codec}), {unchanged} unchanged')
+
+
+def main_compress(db_path=db_file, batch_size=batch_size, codec=text_codec.default_codec):
+    conn = database.connect(db_path)
+    try:
+        init_bot_table(conn)
+        count = compress_table(conn, batch_size, codec)
+    finally:
+        conn.close()
+    print(f'{count} works compressed in BOT ({codec})')
+
+
+def main_dedupe(db_path=db_file):
+    conn = database.connect(db_path)
+    try:
+        create_bot_table(conn)
+        duplicates = dedupe_bot_table(conn)
+    finally:
+        conn.close()
+    for author, title, count in duplicates:
+        print(f'{author}\t{title}: {count} rows deleted')
+    print(f'{sum(count for _, _, count in duplicates)} duplicate rows deleted from BOT')
+
+
+def main_catalog(catalog, db_path=db_file, batch_size=batch_size, codec=text_codec.default_codec):
+    """作家の一覧（作家番号 → 作家名）に載っている全作家の作品を登録する"""
+    for a_id, a_name in catalog.items():
+        edit_dir = ap.author_out_dir(a_id) / 'edit'
+        corpus_path = ap.author_corpus_file(a_id)
+        if corpus_path.exists() or edit_dir.exists():
+            main(db_path, a_name, edit_dir, batch_size, corpus_path, codec)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='整形済みの作品をBOTテーブルに登録する')
+    parser.add_argument('--db', default=db_file, help='SQLiteのデータベースファイル')
+    parser.add_argument('--author', default=ap.author_name, help='BOTテーブルに登録する作家名')
+    parser.add_argument('--edit-dir', default=str(ap.tx_edit_dir), help='整形済みファイルのディレクトリ')
+    parser.add_argument('--corpus', default=str(ap.author_corpus_file(ap.author_id)),
+                        help='整形済みコーパス（無ければ --edit-dir から読み込む）')
+    parser.add_argument('--batch-size', type=int, default=batch_size, help='1トランザクションで登録する作品数')
+    parser.add_argument('--catalog', nargs='?', const=str(ap.catalog_file), default=None,
+                        help=f'作家の一覧（TSV）に載っている全作家を登録する（省略時は {ap.catalog_file}）')
+    parser.add_argument('--compress', action='store_true',
+                        help='作品を登録せず、登録済みの圧縮していない本文を圧縮する')
+    parser.add_argument('--codec', choices=[*text_codec.CODEC_IDS, 'auto'], default=text_codec.default_codec,
+                        help='本文の圧縮方式（auto なら作品ごとにすべての方式を試して選ぶ）')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='作品を登録せず、重複して登録されている作品を最初の1件だけ残して削除する')
+    args = parser.parse_args()
+    if args.dedupe:
+        main_dedupe(args.db)
+    elif args.compress:
+        main_compress(args.db, args.batch_size, args.codec)
+    elif args.catalog:
+        main_catalog(ap.load_catalog(args.catalog), args.db, args.batch_size, args.codec)
+    else:
+        main(args.db, args.author, args.edit_dir, args.batch_size, args.corpus, args.codec)
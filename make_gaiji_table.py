@@ -0,0 +1,48 @@
+"""
+青空文庫の外字注記（JIS X 0213 の面区点番号）→ Unicode の対応表 gaiji_table.tsv を作る
+
+対応表は Python 標準の euc_jis_2004 コーデック（JIS X 0213:2004）から作り、
+リポジトリに同梱している。aozora_preprocess はこの表を読み込むだけなので、
+コーデックを変えたときなどに作り直す。
+
+    python make_gaiji_table.py [--out gaiji_table.tsv]
+"""
+import argparse
+from pathlib import Path
+
+out_file = Path('./gaiji_table.tsv')
+
+# JIS X 0213 の第2面で使われている区（それ以外の区は JIS X 0212 として読めてしまうので除く）
+PLANE2_ROWS = {1, 3, 4, 5, 8, 12, 13, 14, 15, *range(78, 95)}
+
+
+def iter_jisx0213():
+    """(面, 区, 点, 文字) を面区点の順に返す"""
+    for plane, prefix in ((1, b''), (2, b'\x8f')):
+        for row in range(1, 95):
+            if plane == 2 and row not in PLANE2_ROWS:
+                continue
+            for cell in range(1, 95):
+                try:
+                    char = (prefix + bytes([0xA0 + row, 0xA0 + cell])).decode('euc_jis_2004')
+                except UnicodeDecodeError:
+                    continue  # 未定義の面区点
+                yield plane, row, cell, char
+
+
+def main(path=out_file):
+    count = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write('# 面-区-点\tUnicode（結合文字は空白区切り）\n')
+        for plane, row, cell, char in iter_jisx0213():
+            code = ' '.join(f'U+{ord(ch):04X}' for ch in char)
+            f.write(f'{plane}-{row}-{cell}\t{code}\n')
+            count += 1
+    print(f'{count} entries written to {path}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='外字の対応表を作る')
+    parser.add_argument('--out', default=str(out_file), help='出力先')
+    args = parser.parse_args()
+    main(args.out)
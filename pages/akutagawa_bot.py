@@ -1,13 +1,23 @@
 from pathlib import Path
 import pandas as pd
-import sqlite3  # SQLite3を使用
 import streamlit as st
 import matplotlib.pyplot as plt
 import numpy as np
 import openai
-import json
 import urllib.parse
 
+import aozora_preprocess as ap
+import database
+import evaluation
+import llm_cache
+import llm_metrics
+import passage_index
+import text_codec
+import tfidf_engine
+import user_db
+from chat_context import ConversationContext
+from aozora_corpus import CorpusReader
+
 # ページの基本設定
 st.set_page_config(
     page_title="文学の読書コンパニオン",
@@ -39,21 +49,68 @@ st.markdown(page_bg_img, unsafe_allow_html=True)
 
 # クエリパラメータを取得
 query_params = st.experimental_get_query_params()
-record_id = query_params.get("id", [""])[0]       # id (例: DB上のユーザーID)
+record_id = query_params.get("id", [""])[0]       # id (DB上の会話のID)
 username = query_params.get("username", [""])[0]  # username (ログイン中のユーザー名)
 selected_bot = query_params.get("author", [""])[0]      # author (ボット著者)
 selected_title = query_params.get("title", [""])[0]        # title (作品タイトル)
 
+# 会話の id（数値でなければ None、その場合は会話を保存しない）
+try:
+    conversation_id = int(record_id)
+except ValueError:
+    conversation_id = None
+
+@st.cache_resource
+def open_corpus(author):
+    """作家の整形済みコーパスを開く（無ければNone）"""
+    corpus_path = ap.find_author_corpus(author)
+    return CorpusReader(corpus_path) if corpus_path else None
+
 # データベース接続
+def fetch_work_text(title):
+    """作品の本文（どこにも無ければNone）"""
+    # 整形済みコーパスにあればそこから読む（作品の部分だけを読み込む）
+    corpus = open_corpus(selected_bot)
+    if corpus is not None and title in corpus:
+        return corpus.text(title)
+
+    with database.connection() as conn:
+        # BOT テーブルから作家・タイトルに対応する text_content を取得（圧縮した本文は展開済みのものを使う）
+        return text_codec.fetch_text(conn, title, selected_bot)
+
 def fetch_text_content(title):
-    db_file = "literary_app.db"
-    conn = sqlite3.connect(db_file)
-    cur = conn.cursor()
-    # BOT テーブルからタイトルに対応する text_content を取得
-    cur.execute("SELECT text_content FROM BOT WHERE title = ?", (title,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else "該当する内容が見つかりません。"
+    text_content = fetch_work_text(title)
+    return text_content if text_content is not None else "該当する内容が見つかりません。"
+
+@st.cache_resource
+def load_passage_index(author, title, text_hash, _text_content):
+    """
+    作品の段落検索インデックス（作品ごとに1回だけ作ってDBに保存する）
+    本文そのものはキャッシュのキーにしない（_ で始まる引数は無視される）ので、
+    本文のハッシュ（text_hash）をキーに含めて、本文が変われば作り直す
+    """
+    with database.connection() as conn:
+        return passage_index.load_or_build_index(conn, author, title, _text_content)
+
+def get_passage_index(author, title):
+    """作品の段落検索インデックス（作品が無ければ空のインデックス、保存もキャッシュもしない）"""
+    text_content = fetch_work_text(title)
+    if text_content is None:
+        return passage_index.PassageIndex.empty()
+    return load_passage_index(author, title, passage_index.text_digest(text_content), text_content)
+
+@st.cache_resource
+def load_works_index():
+    """作品単位の TF-IDF 行列（mmap で開く。python tfidf_engine.py build で作っていなければNone）"""
+    return tfidf_engine.load_index('works')
+
+def similar_works(author, title, k=3):
+    """作品に似た作品の (作家, 作品名) のリスト（行列が無い・作品が行列に無ければ空）"""
+    index = load_works_index()
+    doc = index.find(author=author, title=title) if index is not None else None
+    if doc is None:
+        return []
+    return [(label['author'], label['title']) for label, _ in index.similar([doc], k)[0]]
 
 if selected_title:
     text_content = fetch_text_content(selected_title)
@@ -98,6 +155,11 @@ if selected_title:
     """,
     unsafe_allow_html=True,
 )
+
+    # 似た作品（TF-IDF の類似度の高い順）
+    similar = similar_works(selected_bot, selected_title)
+    if similar:
+        st.markdown("この作品に似た作品: " + "、".join(f"『{title}』（{author}）" for author, title in similar))
 else:
     st.write("作品が選択されていません。URLのクエリパラメータを確認してください。")
 
@@ -107,44 +169,115 @@ else:
 openai.api_key = st.secrets.OpenAIAPI.openai_api_key
 
 # st.session_stateを使いメッセージのやりとりを保存
+# （メッセージは発言のたびにMESSAGEテーブルに追加しているので、セッションの開始時にそこから復元する）
 if "messages" not in st.session_state:
+    # 作品が選ばれていて、ログイン中のユーザーの会話の場合だけ、履歴を復元して発言を保存する
+    # （id が無い・数値でない場合や他のユーザーの会話の場合は、保存せずに新しい会話にする）
+    if conversation_id is not None and selected_title and not user_db.owns_conversation(conversation_id, username):
+        st.session_state["conversation_error"] = True
+        conversation_id = None
+    elif not selected_title:
+        conversation_id = None
+    st.session_state["conversation_id"] = conversation_id
     st.session_state["messages"] = [
-        {"role": "system", "content": st.secrets.AppSettings.chatbot_setting} 
+        {"role": "system", "content": st.secrets.AppSettings.chatbot_setting}
     ]
+    if conversation_id is not None:
+        # 対話終了済みの会話は履歴を表示するだけにする（続けて書き込むと要約・評価と食い違う）
+        st.session_state["conversation_open"] = user_db.is_open(conversation_id)
+        st.session_state["messages"] += user_db.fetch_messages(conversation_id)
+conversation_id = st.session_state["conversation_id"]
+if st.session_state.get("conversation_error"):
+    st.error("この会話は見つかりません。トップページから「会話を始める」で会話を始めてください（この会話は保存されません）。")
 if "total_characters" not in st.session_state:
-    st.session_state["total_characters"] = 0  # 合計文字数を初期化
+    # 合計文字数を初期化（復元した会話の分も数える）
+    st.session_state["total_characters"] = sum(
+        len(m["content"]) for m in st.session_state["messages"] if m["role"] == "user"
+    )
+if "context" not in st.session_state:
+    # API に送る履歴（システムプロンプト・古い会話の要約・直近の会話）を管理する
+    st.session_state["context"] = ConversationContext(st.secrets.AppSettings.chatbot_setting)
 
 # チャットボットとやりとりする関数
+# （入力時のコールバックではユーザーの入力を履歴に追加するだけで、応答は画面の描画中に
+#   stream_reply で受け取りながら表示する）
 def communicate():
-    # 参考となるテキスト内容
-    text_content = fetch_text_content(selected_title)
-
     # メッセージ履歴を取得
     messages = st.session_state["messages"]
 
     # ユーザーの入力を追加
     user_message = {"role": "user", "content": st.session_state["user_input"]}
     messages.append(user_message)
+    if conversation_id is not None:
+        user_db.append_message(conversation_id, "user", user_message["content"])
 
     # 入力文字数をカウント
     st.session_state["total_characters"] += len(user_message["content"])
 
-    # ChatGPT API 呼び出し
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "system", "content": "あなたは熟練した文学解説者です。以下の文章を理解し、質問に答えてください。"},
-            {"role": "user", "content": f"参考文章:\n\n{text_content}"},
-        ] + messages  # ユーザーのメッセージ履歴を追加
-    )
-
-    # ボットの応答を追加
-    bot_message = response["choices"][0]["message"]
-    messages.append(bot_message)
+    # 応答待ちにする
+    st.session_state["awaiting_reply"] = True
 
     # 入力欄をクリア
     st.session_state["user_input"] = ""
 
+def running_summary():
+    """会話の途中までの要約と、それが何往復分か（保存していない会話には無い）"""
+    if conversation_id is None:
+        return "", 0
+    return evaluation.fetch_running_summary(conversation_id)
+
+def stream_reply():
+    """最後のユーザー入力への応答を届いた分から表示し、最後まで受け取ってから履歴に追加する"""
+    messages = st.session_state["messages"]
+
+    # 参考となるテキスト内容（作品全体ではなく、ユーザーの入力に関連する段落だけを送る）
+    index = get_passage_index(selected_bot, selected_title)
+    reference = "\n\n……\n\n".join(index.top_passages(messages[-1]["content"]))
+
+    # 計測用に呼び出し元と作品名を付ける（応答は受け取りながら呼び出すので with の中で読む）
+    with llm_metrics.tags(site="chat", title=selected_title):
+        # ChatGPT API 呼び出し（履歴は古い会話を1往復ごとの要約ジョブの要約に置き換えて上限内に収めたものを送る）
+        pieces = llm_cache.stream_chat_completion(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "あなたは熟練した文学解説者です。以下の文章を理解し、質問に答えてください。"},
+                {"role": "user", "content": f"参考文章（『{selected_title}』から質問に関連する箇所を抜粋）:\n\n{reference}"},
+            ] + st.session_state["context"].messages(
+                messages, running_summary
+            )
+        )
+
+        placeholder = st.empty()
+        reply = ""
+        for piece in pieces:
+            reply += piece
+            placeholder.markdown(
+                f"""
+                <div class="bot-message">
+                    <div class="bot-content">{reply}▌</div>
+                    <span class="icon">🤖</span>
+                </div>
+                """,
+                unsafe_allow_html=True,
+            )
+    placeholder.empty()
+
+    # ボットの応答を追加（下の対話履歴の表示で表示する）
+    bot_message = {"role": "assistant", "content": reply}
+    messages.append(bot_message)
+    if conversation_id is None:
+        return
+    user_db.append_message(conversation_id, "assistant", reply)
+
+    # 会話の要約をこの1往復の分だけ更新するジョブを登録（対話終了時にはすぐに要約を保存できる）
+    turn = sum(1 for m in messages if m["role"] == "assistant") - 1
+    evaluation.get_job_queue().submit(
+        "summarize_turn",
+        {"record_id": conversation_id, "username": username, "title": selected_title,
+         "turn": turn, "messages": [messages[-2], bot_message]},
+        ref=conversation_id,
+    )
+
 # もしmessagesやtotal_charactersが未初期化なら初期化
 if "messages" not in st.session_state:
     st.session_state["messages"] = []
@@ -176,75 +309,38 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-def summarize_conversation(messages):
-    """会話履歴を400文字にまとめた要約を作成"""
-    # ここでは既に filtered_messages を受け取る前提でもよい
-    summary_prompt = [
-        {"role": "system", "content": "以下の会話履歴を400文字にまとめた要約を作成してください。"},
-        {"role": "user", "content": json.dumps(messages, ensure_ascii=False)}
-    ]
-
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=summary_prompt
-    )
-    return response["choices"][0]["message"]["content"]
-
-def save_conversation_and_summary_to_db(messages):
+def submit_summary_job(messages):
     """
-    USERテーブルに会話履歴（JSON）とサマリーをINSERTし、AUTO INCREMENTで生成されたidを返す
+    要約の保存をジョブとして登録する（会話履歴は発言のたびにMESSAGEテーブルに追加済み）
+    （サマリーは1往復ごとに更新しているので、ジョブはそれを保存するだけで済む）
     """
-    db_file = "literary_app.db"
-    conn = sqlite3.connect(db_file)
-    cur = conn.cursor()
-    
-    # システムメッセージを除外したリストを作成
-    filtered_messages = [m for m in messages if m["role"] in ("user", "assistant")]
-
-    # JSON文字列に変換
-    conversation_json = json.dumps(filtered_messages, ensure_ascii=False)
-
-    # 要約を生成
-    summary_text = summarize_conversation(filtered_messages)
-
-    # 既存レコードの確認
-    cur.execute('''
-        SELECT * FROM USER
-         WHERE id = ?
-           AND username = ?
-           AND title = ?
-    ''', (record_id, username, selected_title))
-    existing = cur.fetchone()
-
-    if existing:
-        # 既に存在 → UPDATE
-        cur.execute('''
-            UPDATE USER
-               SET conversation = ?, summary = ?
-             WHERE id = ?
-               AND username = ?
-               AND title = ?
-        ''', (conversation_json, summary_text, record_id, username, selected_title))
-    else:
-        # 該当なし → INSERT
-        cur.execute('''
-            INSERT INTO USER (id, username, title, conversation, summary)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (record_id, username, selected_title, conversation_json, summary_text))
-    conn.commit()
-    conn.close()
-
-# --- 対話終了ボタン ---
-if st.session_state["total_characters"] >= 10:
+    # 対話終了を記録（この会話には続けて書き込まず、次に会話を始めるときは新しい会話にする）
+    user_db.end_conversation(conversation_id)
+
+    # 要約ジョブを登録（評価ページはこのジョブの完了を待って要約を表示する）
+    # （1往復ごとの要約が使えない場合、ジョブは会話全体をMESSAGEテーブルから読み込んで要約する）
+    evaluation.get_job_queue().submit(
+        "summarize",
+        {"record_id": conversation_id, "username": username, "title": selected_title,
+         "turns": sum(1 for m in messages if m["role"] == "assistant")},
+        ref=conversation_id,
+    )
+
+conversation_open = st.session_state.get("conversation_open", True)
+if not conversation_open:
+    st.info("この会話は終了しています。トップページから「会話を始める」で新しい会話を始めてください。")
+
+# --- 対話終了ボタン（保存していない会話は要約・評価できないので表示しない） ---
+if conversation_id is not None and conversation_open and st.session_state["total_characters"] >= 10:
     if st.button("対話終了"):
-        # DBに保存 → レコードID取得
-        save_conversation_and_summary_to_db(st.session_state["messages"])
+        # 要約ジョブを登録（会話履歴は保存済み）
+        submit_summary_job(st.session_state["messages"])
 
         # デバッグ用表示（必要なら残す）
-        st.write(f"DEBUG: record_id = {record_id}")
+        st.write(f"DEBUG: record_id = {conversation_id}")
 
-        # evaluate.py へ遷移（ここでは id=record_id だけクエリパラメータに含める）
-        evaluate_url = f"https://literaryaicompanion-prg5zuxubou7vm6rxpqujs.streamlit.app/evaluate?id={record_id}"
+        # evaluate.py へ遷移（ここでは id=conversation_id だけクエリパラメータに含める）
+        evaluate_url = f"https://literaryaicompanion-prg5zuxubou7vm6rxpqujs.streamlit.app/evaluate?id={conversation_id}"
         st.markdown(f'<meta http-equiv="refresh" content="0; url={evaluate_url}">', unsafe_allow_html=True)
 
 
@@ -270,7 +366,8 @@ user_input = st.text_area(
     "",
     key="user_input",
     height=100,
-    on_change=communicate
+    on_change=communicate,
+    disabled=not conversation_open,
 )
 
 
@@ -331,6 +428,10 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+# 入力があれば応答を受け取りながら表示する
+if st.session_state.pop("awaiting_reply", False):
+    stream_reply()
+
 # 対話履歴を表示（最新のメッセージを上に）
 if st.session_state.get("messages"):
     messages = st.session_state["messages"]
@@ -1,5 +1,4 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import openai
 import matplotlib.pyplot as plt
@@ -7,6 +6,11 @@ import numpy as np
 import json
 import os
 
+import database
+import evaluation
+import job_queue
+import llm_cache
+
 
 # ページの基本設定
 st.set_page_config(
@@ -38,101 +42,22 @@ st.markdown(page_bg_img, unsafe_allow_html=True)
 # GPT-APIキーを設定
 openai.api_key = st.secrets.OpenAIAPI.openai_api_key
 
-def evaluate_creativity(summary):
-    """GPT-APIを使用して創造性評価を行い、スコアと説明を返す"""
-    prompt = f"""
-    You are an expert evaluator specializing in assessing creativity and cognitive performance.
-    Evaluate the following summary based on the criteria below. Provide a score (0-10) for each, and include a brief explanation for each score to justify your assessment.
-
-    ### Criteria:
-    1. **Relevance**: How well does the summary align with the core idea or purpose it is meant to convey?
-    2. **Creativity**: To what extent does the summary demonstrate original or innovative thinking?
-    3. **Flexibility**: Does the summary show adaptability or the ability to approach the subject matter from multiple perspectives?
-    4. **Problem-Solving**: How effectively does the summary address challenges or provide solutions within the context it describes?
-    5. **Insight**: Does the summary reflect deep understanding, analysis, or unique perspectives about the topic?
-
-    ### Summary to Evaluate:
-    "{summary}"
-
-    ### Instructions:
-    - Assign a score from 0 (poor) to 10 (excellent) for each criterion.
-    - Provide scores in JSON format and include brief explanations for each criterion to clarify the rationale behind your evaluation.
-
-    ### Output Format (return only JSON):
-    {{
-      "Relevance": {{ "score": 0, "explanation": "..." }},
-      "Creativity": {{ "score": 0, "explanation": "..." }},
-      "Flexibility": {{ "score": 0, "explanation": "..." }},
-      "Problem_Solving": {{ "score": 0, "explanation": "..." }},
-      "Insight": {{ "score": 0, "explanation": "..." }}
-    }}
-    """
-
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an evaluation assistant."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-
-        # GPTのレスポンスをJSONとして解析
-        scores = json.loads(response['choices'][0]['message']['content'])
-
-        # スコアのみを抽出して整数値に変換し、辞書形式で返す
-        for key, value in scores.items():
-            value['score'] = int(value['score'])  # スコアを整数化
-
-        return scores
-    except (json.JSONDecodeError, KeyError, ValueError) as e:
-        st.error(f"Error parsing GPT response: {e}")
-        return None
-
-
-def update_user_scores(conversation_id, scores):
-    """USERテーブルに評価スコアを更新する"""
-    db_file = "literary_app.db"
-    conn = sqlite3.connect(db_file)
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        UPDATE USER
-        SET Relevance = ?, Creativity = ?, Flexibility = ?, Problem_Solving = ?, Insight = ?
-        WHERE id = ?
-        """,
-        (scores["Relevance"], scores["Creativity"], scores["Flexibility"], scores["Problem_Solving"], scores["Insight"], conversation_id)
-    )
-
-    conn.commit()
-    conn.close()
-
-def translate_to_japanese(text):
-    """英語の説明を日本語に翻訳"""
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Translate the following text into Japanese."},
-                {"role": "user", "content": text}
-            ]
-        )
-        translation = response['choices'][0]['message']['content'].strip()
-        return translation
-    except Exception as e:
-        st.error(f"Translation error: {e}")
-        return text  # 翻訳が失敗した場合は元のテキストを返す
-
-def display_scores_and_explanations(scores):
-    """スコアと説明をStreamlit画面に表示（説明は日本語翻訳）"""
+@st.fragment(run_every=job_queue.poll_interval)
+def wait_for_job(job_id, message):
+    """ジョブが終わるまでこの部分だけを定期的に再実行し、終わったら画面全体を描画し直す"""
+    job = evaluation.get_job_queue().get(job_id)
+    if job is None or job["status"] in (job_queue.DONE, job_queue.FAILED):
+        st.rerun()
+    with st.spinner(message):
+        st.write("処理が終わると自動的に表示されます。")
+
+def display_scores_and_explanations(scores, translations, errors):
+    """スコアと説明をStreamlit画面に表示（説明は評価ジョブで日本語に翻訳済み）"""
     st.subheader("【評価結果】")
-    for key, value in scores.items():
+    for (key, value), translated_explanation, error in zip(scores.items(), translations, errors):
         score = value['score']
-        explanation = value['explanation']
-
-        # 説明を日本語に翻訳
-        translated_explanation = translate_to_japanese(explanation)
+        if error is not None:
+            st.error(f"Translation error: {error}")  # 翻訳が失敗した場合は元のテキストを表示
 
         # スコアと説明を表示
         st.markdown(f"### {key} (スコア: {score}/10)")
@@ -194,17 +119,24 @@ def plot_radar_chart(scores):
 
 
 def show_db_contents():
-    """USERテーブルの全レコードをSELECTして表示"""
-    db_file = "literary_app.db"
-    conn = sqlite3.connect(db_file)
-    cur = conn.cursor()
-
-    cur.execute("SELECT * FROM USER")
-    rows = cur.fetchall()
-    column_names = [description[0] for description in cur.description]
-    conn.close()
+    """会話の一覧（ユーザー名・メッセージ数・最新の評価スコアつき）をSELECTして表示"""
+    with database.connection() as conn:
+        cur = conn.execute(
+            """
+            SELECT c.id, u.username, c.author, c.title, c.summary,
+                   (SELECT COUNT(*) FROM MESSAGE m WHERE m.conversation_id = c.id) AS messages,
+                   e.Relevance, e.Creativity, e.Flexibility, e.Problem_Solving, e.Insight
+              FROM CONVERSATION c
+              LEFT JOIN USER u ON u.id = c.user_id
+              LEFT JOIN EVALUATION e
+                ON e.id = (SELECT MAX(id) FROM EVALUATION WHERE conversation_id = c.id)
+             ORDER BY c.id
+            """
+        )
+        rows = cur.fetchall()
+        column_names = [description[0] for description in cur.description]
 
-    st.write("### USERテーブル内容（全カラム表示）")
+    st.write("### 会話の一覧（ユーザー・最新の評価つき）")
     df = pd.DataFrame(rows, columns=column_names)
     st.dataframe(df)
 
@@ -237,36 +169,51 @@ def main():
     conversation_id = query_params.get("id", [None])[0]
 
     if conversation_id:
-        db_file = "literary_app.db"
-        conn = sqlite3.connect(db_file)
-        cur = conn.cursor()
-        cur.execute("SELECT summary, Relevance, Creativity, Flexibility, Problem_Solving, Insight FROM USER WHERE id = ?", (conversation_id,))
-        row = cur.fetchone()
-        conn.close()
+        with database.connection() as conn:
+            row = conn.execute("SELECT summary FROM CONVERSATION WHERE id = ?", (conversation_id,)).fetchone()
 
         if row:
+            queue = evaluation.get_job_queue()
             summary_text = row[0]
             st.write(f"**対象レコードID**: {conversation_id}")
             st.subheader("【サマリー】")
-            st.markdown(
-                f"""<div class="text-box">{summary_text}</div>""",
-                unsafe_allow_html=True
-            )
+            if summary_text is None:
+                # 対話終了時に登録した要約ジョブの完了を待つ
+                summarize_job = queue.latest("summarize", conversation_id)
+                if summarize_job is None:
+                    st.error("要約がありません。")
+                elif summarize_job["status"] == job_queue.FAILED:
+                    st.error(f"要約の作成に失敗しました: {summarize_job['error']}")
+                else:
+                    wait_for_job(summarize_job["id"], "会話の要約を作成しています…")
+            else:
+                st.markdown(
+                    f"""<div class="text-box">{summary_text}</div>""",
+                    unsafe_allow_html=True
+                )
 
+            # 評価はジョブとして登録する（要約ジョブより後に登録されるので、要約ができてから実行される）
             if st.button("創造性評価を実行"):
-                scores = evaluate_creativity(summary_text)
-                if scores:
-                    update_user_scores(conversation_id, {key: value['score'] for key, value in scores.items()})
+                queue.submit("evaluate", {"record_id": conversation_id}, ref=conversation_id)
 
-                    st.success("創造性評価が完了し、スコアと説明がデータベースに保存されました！")
+            evaluate_job = queue.latest("evaluate", conversation_id)
+            if evaluate_job is None:
+                st.write("評価を実行してください。")
+            elif evaluate_job["status"] == job_queue.FAILED:
+                st.error(f"創造性評価に失敗しました: {evaluate_job['error']}")
+            elif evaluate_job["status"] != job_queue.DONE:
+                wait_for_job(evaluate_job["id"], "創造性評価を実行しています…")
+            else:
+                result = evaluate_job["result"]
+                scores = result["scores"]
 
-                    # スコアと説明を表示（日本語翻訳含む）
-                    display_scores_and_explanations(scores)
+                st.success("創造性評価が完了し、スコアと説明がデータベースに保存されました！")
 
-                    st.subheader("【レーダーチャート】")
-                    plot_radar_chart(scores)
-            else:
-                st.write("評価を実行してください。")
+                # スコアと説明を表示（日本語翻訳含む）
+                display_scores_and_explanations(scores, result["translations"], result["translation_errors"])
+
+                st.subheader("【レーダーチャート】")
+                plot_radar_chart(scores)
         else:
             st.error("該当するレコードが見つかりません。")
     else:
@@ -278,5 +225,12 @@ def main():
     if st.button("DBの内容を表示"):
         show_db_contents()
 
+    # API 応答キャッシュの状況（ヒット数・ミス数はこのプロセスが起動してからの値）
+    stats = llm_cache.get_cache().stats()
+    st.caption(
+        f"API応答キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']}"
+        f"（ヒット率 {stats['hit_rate']:.0%}）、{stats['entries']} 件・{stats['bytes'] / 1024:.0f} KB"
+    )
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,107 @@
+import streamlit as st
+import time
+import pandas as pd
+
+import database
+import llm_metrics
+
+
+# ページの基本設定
+st.set_page_config(
+    page_title="文学の読書コンパニオン",
+    page_icon="📚", layout="centered",
+    initial_sidebar_state="collapsed",  # サイドバーを非表示
+    menu_items={
+        "Get Help": None,
+        "Report a bug": None,
+        "About": None
+    }
+)
+# GitHubのリポジトリにある背景画像のURL
+img_url = "https://raw.githubusercontent.com/tatsuya797/literary_ai_companion/main/image4.jpg"
+
+# 背景画像の設定（日本の古風な雰囲気の画像に設定）
+page_bg_img = f"""
+<style>
+    .stApp {{
+        background-image: url("{img_url}");  /* 和風な背景画像 */
+        background-size: cover;
+        background-position: center;
+        color: #f4f4f4;
+    }}
+</style>
+"""
+st.markdown(page_bg_img, unsafe_allow_html=True)
+
+# 集計する期間（秒、None は全期間）
+WINDOWS = {
+    "直近1時間": 60 * 60,
+    "直近24時間": 24 * 60 * 60,
+    "直近7日間": 7 * 24 * 60 * 60,
+    "全期間": None,
+}
+
+
+def load_metrics(seconds):
+    """LLM_METRICS テーブルから期間内の記録を読み込む"""
+    # ためている記録を先に書き込んでおく
+    llm_metrics.get_recorder().flush()
+    since = 0 if seconds is None else time.time() - seconds
+    with database.connection(llm_metrics.db_file) as conn:
+        return pd.read_sql_query("SELECT * FROM LLM_METRICS WHERE ts >= ?", conn, params=(since,))
+
+
+def summarize_metrics(df, key):
+    """key（site / title）ごとの呼び出し回数・待ち時間（p50 / p95）・トークン数・料金"""
+    df = df.assign(
+        hit=df["cache"] == "hit",
+        # キャッシュを使わない呼び出し（cache = "off"、チャットなど）はキャッシュ率に含めない
+        cacheable=df["cache"].isin(["hit", "miss"]),
+        failed=df["error"].notna(),
+        # API を呼んだ分だけ数える（キャッシュに当たった呼び出しは料金がかからない）
+        api_prompt_tokens=df["prompt_tokens"].where(df["cache"] != "hit", 0),
+        api_completion_tokens=df["completion_tokens"].where(df["cache"] != "hit", 0),
+    )
+    df["cost_usd"] = [
+        llm_metrics.cost(model, prompt, completion)
+        for model, prompt, completion in zip(df["model"], df["api_prompt_tokens"], df["api_completion_tokens"])
+    ]
+    grouped = df.groupby(key)
+    table = pd.DataFrame({
+        "呼び出し": grouped.size(),
+        "キャッシュ率": grouped["hit"].sum() / grouped["cacheable"].sum(),
+        "エラー": grouped["failed"].sum(),
+        "p50 (ms)": grouped["latency_ms"].quantile(0.5),
+        "p95 (ms)": grouped["latency_ms"].quantile(0.95),
+        "最初の応答 p50 (ms)": grouped["first_token_ms"].quantile(0.5),
+        "入力トークン": grouped["api_prompt_tokens"].sum(),
+        "出力トークン": grouped["api_completion_tokens"].sum(),
+        "料金 (USD)": grouped["cost_usd"].sum(),
+    })
+    return table.sort_values("呼び出し", ascending=False)
+
+
+st.title("📈 API の呼び出し状況")
+
+window = st.selectbox("期間", list(WINDOWS))
+metrics = load_metrics(WINDOWS[window])
+
+if metrics.empty:
+    st.info("この期間の記録はまだありません。")
+else:
+    metrics["site"] = metrics["site"].fillna("(不明)")
+    metrics["title"] = metrics["title"].fillna("(なし)")
+    st.caption(
+        f"{len(metrics)} 回の呼び出し（トークン数は応答に含まれない場合は文字数からの見積もり、"
+        f"キャッシュに当たった呼び出しは数えない）"
+    )
+
+    st.subheader("呼び出し元ごと")
+    by_site = summarize_metrics(metrics, "site")
+    st.dataframe(by_site.style.format({"キャッシュ率": "{:.0%}", "料金 (USD)": "{:.4f}"}, precision=0, na_rep="-"))
+    st.bar_chart(by_site[["入力トークン", "出力トークン"]])
+
+    st.subheader("作品ごと")
+    by_title = summarize_metrics(metrics, "title")
+    st.dataframe(by_title.style.format({"キャッシュ率": "{:.0%}", "料金 (USD)": "{:.4f}"}, precision=0, na_rep="-"))
+    st.bar_chart(by_title[["入力トークン", "出力トークン"]])
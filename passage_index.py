@@ -0,0 +1,201 @@
+"""
+作品本文（BOT.text_content）の段落検索
+
+本文を数百文字ずつの段落に分け、文字bigramの転置インデックスを作って
+BM25でユーザーの発言に近い段落を探す。インデックスは作品ごとに1回だけ作り、
+literary_app.db の PASSAGE_INDEX テーブルに保存しておく（本文が変われば作り直す）。
+"""
+import hashlib
+import io
+
+import numpy as np
+
+chunk_size = 400  # 段落の目安の文字数
+chunk_overlap = 1  # 前の段落と重ねる行数
+top_k = 4  # 1回の質問で送る段落数
+
+# BM25 のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+INDEX_VERSION = 1
+
+
+def chunk_text(text, size=chunk_size, overlap=chunk_overlap):
+    """本文を行単位でまとめて size 文字前後の段落に分ける（長すぎる行は途中で切る）"""
+    lines = []
+    for line in text.split('\n'):
+        line = line.strip()
+        while len(line) > size:
+            lines.append(line[:size])
+            line = line[size:]
+        if line:
+            lines.append(line)
+
+    passages = []
+    current = []
+    length = 0
+    for line in lines:
+        if current and length + len(line) > size:
+            passages.append('\n'.join(current))
+            current = current[-overlap:] if overlap else []
+            length = sum(len(t) for t in current)
+        current.append(line)
+        length += len(line)
+    if current:
+        passages.append('\n'.join(current))
+    return passages
+
+
+def char_bigrams(text):
+    """改行・空白を除いた文字bigram（1文字だけの場合はその文字）"""
+    chars = ''.join(text.split())
+    if len(chars) == 1:
+        return [chars]
+    return [chars[i:i + 2] for i in range(len(chars) - 1)]
+
+
+def text_digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class PassageIndex:
+    """段落のリストと、文字bigramの転置インデックス（CSR形式の配列）"""
+
+    def __init__(self, passages, terms, term_ptr, post_doc, post_tf, doc_len):
+        self.passages = passages
+        self.terms = terms
+        self._term_ids = {term: i for i, term in enumerate(terms)}
+        self.term_ptr = term_ptr
+        self.post_doc = post_doc
+        self.post_tf = post_tf
+        self.doc_len = doc_len
+        n_docs = len(passages)
+        df = np.diff(term_ptr)
+        self._idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        self._norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / max(doc_len.mean(), 1)) \
+            if n_docs else doc_len.astype(np.float64)
+
+    @classmethod
+    def build(cls, text):
+        passages = chunk_text(text)
+        postings = {}
+        doc_len = np.zeros(len(passages), dtype=np.int32)
+        for doc, passage in enumerate(passages):
+            grams = char_bigrams(passage)
+            doc_len[doc] = len(grams)
+            counts = {}
+            for gram in grams:
+                counts[gram] = counts.get(gram, 0) + 1
+            for gram, tf in counts.items():
+                postings.setdefault(gram, []).append((doc, tf))
+
+        terms = sorted(postings)
+        term_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        term_ptr[1:] = np.cumsum([len(postings[t]) for t in terms])
+        post_doc = np.empty(term_ptr[-1], dtype=np.int32)
+        post_tf = np.empty(term_ptr[-1], dtype=np.int32)
+        for i, term in enumerate(terms):
+            docs, tfs = zip(*postings[term])
+            post_doc[term_ptr[i]:term_ptr[i + 1]] = docs
+            post_tf[term_ptr[i]:term_ptr[i + 1]] = tfs
+        return cls(passages, terms, term_ptr, post_doc, post_tf, doc_len)
+
+    @classmethod
+    def empty(cls):
+        """段落の無いインデックス（どの質問にも何も返さない）"""
+        return cls.build('')
+
+    def scores(self, query):
+        """全段落の BM25 スコア"""
+        scores = np.zeros(len(self.passages), dtype=np.float64)
+        for gram in set(char_bigrams(query)):
+            i = self._term_ids.get(gram)
+            if i is None:
+                continue
+            lo, hi = self.term_ptr[i], self.term_ptr[i + 1]
+            docs = self.post_doc[lo:hi]
+            tf = self.post_tf[lo:hi]
+            scores[docs] += self._idf[i] * tf * (BM25_K1 + 1) / (tf + self._norm[docs])
+        return scores
+
+    def search(self, query, k=top_k):
+        """クエリに近い段落を (段落番号, スコア) のリストでスコアの高い順に返す"""
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def top_passages(self, query, k=top_k):
+        """クエリに近い k 個の段落を本文の順に並べて返す（何も当たらなければ冒頭の段落）"""
+        hits = sorted(i for i, _ in self.search(query, k)) or list(range(min(k, len(self.passages))))
+        return [self.passages[i] for i in hits]
+
+    def to_bytes(self):
+        buf = io.BytesIO()
+        np.savez_compressed(
+            buf,
+            version=np.array(INDEX_VERSION),
+            passages=np.array(self.passages, dtype=str),
+            terms=np.array(self.terms, dtype=str),
+            term_ptr=self.term_ptr, post_doc=self.post_doc, post_tf=self.post_tf,
+            doc_len=self.doc_len,
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            if int(arrays['version']) != INDEX_VERSION:
+                raise ValueError('インデックスの形式が古いため作り直します')
+            return cls(arrays['passages'].tolist(), arrays['terms'].tolist(),
+                       arrays['term_ptr'], arrays['post_doc'], arrays['post_tf'],
+                       arrays['doc_len'])
+
+
+def init_index_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS PASSAGE_INDEX (
+            author TEXT,
+            title TEXT,
+            text_hash TEXT,
+            data BLOB,
+            PRIMARY KEY (author, title)
+        )
+    ''')
+    conn.commit()
+
+
+def load_or_build_index(conn, author, title, text_content):
+    """
+    保存済みのインデックスを読み込む
+    無い場合や本文が変わっている場合は作り直して保存する
+    （作品の本文が無い場合（text_content が None）は空のインデックスを返し、何も保存しない）
+    """
+    if text_content is None:
+        return PassageIndex.empty()
+    init_index_table(conn)
+    digest = text_digest(text_content)
+    row = conn.execute(
+        "SELECT text_hash, data FROM PASSAGE_INDEX WHERE author = ? AND title = ?",
+        (author, title),
+    ).fetchone()
+    if row and row[0] == digest:
+        try:
+            return PassageIndex.from_bytes(row[1])
+        except (ValueError, KeyError, OSError):
+            pass
+
+    index = PassageIndex.build(text_content)
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO PASSAGE_INDEX (author, title, text_hash, data) VALUES (?, ?, ?, ?)
+            ON CONFLICT (author, title) DO UPDATE SET text_hash = excluded.text_hash, data = excluded.data
+            """,
+            (author, title, digest, index.to_bytes()),
+        )
+    return index
@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# リポジトリ直下のモジュール（aozora_preprocess など）を import できるようにする
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
@@ -0,0 +1,104 @@
+import pytest
+
+from aozora_corpus import ANNOTATION, RUBY, CorpusReader, markup_index_file, write_corpus, write_markup_index
+from aozora_preprocess import cleanse_line_with_markup
+
+WORKS = [
+    ('羅生門', 'rashomon.txt', ['ある日の暮方の事である。', '一人の下人が、羅生門の下で雨やみを待っていた。']),
+    ('鼻', 'hana.txt', ['禅智内供の鼻と云えば、池の尾で知らない者はない。']),
+    # 同じ作品名の別の作品（別の版など）
+    ('羅生門', 'rashomon_2.txt', ['別の版の本文。', '二行目。', '三行目。']),
+]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / 'corpus.aozc'
+    assert write_corpus(path, '000879', '芥川 竜之介', iter(WORKS)) == len(WORKS)
+    with CorpusReader(path) as reader:
+        yield reader
+
+
+def test_header(corpus):
+    assert corpus.author_id == '000879'
+    assert corpus.author_name == '芥川 竜之介'
+    assert len(corpus) == 3
+    assert corpus.n_lines == 6
+    assert corpus.titles() == ['羅生門', '鼻', '羅生門']
+    assert '鼻' in corpus and '蜘蛛の糸' not in corpus
+
+
+def test_text_and_lines(corpus):
+    assert corpus.text('鼻') == WORKS[1][2][0]
+    # 同じ作品名が複数あれば最初の作品
+    assert corpus.text('羅生門') == '\n'.join(WORKS[0][2])
+    assert corpus.text('羅生門', sep='') == ''.join(WORKS[0][2])
+    assert corpus.lines('羅生門') == WORKS[0][2]
+    assert corpus.lines('羅生門', 1) == WORKS[0][2][1:]
+    assert corpus.lines('羅生門', 0, -1) == WORKS[0][2][:-1]
+    assert corpus.lines('鼻', 5) == []
+
+
+def test_iter_works_reads_each_work(corpus):
+    assert list(corpus.iter_works()) == [(title, '\n'.join(lines)) for title, _, lines in WORKS]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.aozc'
+    path.write_bytes(b'NOPE' + b'\0' * 32)
+    with pytest.raises(ValueError):
+        CorpusReader(path)
+
+
+def cleansed_work(raw_lines):
+    """整形後の行と、作品の本文での位置に直したルビ・入力者注"""
+    lines, entries = [], []
+    offset = 0
+    for raw in raw_lines:
+        text, marks = cleanse_line_with_markup(raw)
+        lines.append(text)
+        entries.extend((offset + start, offset + end, kind, value) for start, end, kind, value in marks)
+        offset += len(text) + 1
+    return lines, entries
+
+
+@pytest.fixture
+def marked_corpus(tmp_path):
+    works = [
+        ('鼻', 'hana.txt', ['禅智内供《ぜんちないぐ》の鼻と云えば。']),
+        ('羅生門', 'rashomon.txt', ['ある日の暮方の事である。',
+                                   'ＡＢＣ《えーびーしー》と羅生門《らしょうもん》で雨やみを待っていた［＃「待っていた」に傍点］。']),
+    ]
+    path = tmp_path / 'corpus.aozc'
+    cleansed = [(title, file_name, cleansed_work(raw)) for title, file_name, raw in works]
+    write_corpus(path, '000879', '芥川 竜之介', ((t, f, lines) for t, f, (lines, _) in cleansed))
+    write_markup_index(markup_index_file(path), [entries for _, _, (_, entries) in cleansed])
+    with CorpusReader(path) as reader:
+        yield reader
+
+
+def test_reading_at(marked_corpus):
+    text = marked_corpus.text('羅生門')
+    line_start = text.index('\n') + 1
+    assert text[line_start:] == 'ＡＢＣと羅生門で雨やみを待っていた。'
+    # 全角英数字の連続も1つの親文字になる
+    for offset in range(line_start, line_start + 3):
+        assert marked_corpus.reading_at('羅生門', offset) == (line_start, line_start + 3, 'えーびーしー')
+    assert marked_corpus.reading_at('羅生門', line_start + 3) is None
+    start = line_start + 4
+    assert marked_corpus.reading_at('羅生門', start + 2) == (start, start + 3, 'らしょうもん')
+    assert marked_corpus.reading_at('羅生門', start + 3) is None
+    assert marked_corpus.reading_at('羅生門', 0) is None
+    assert marked_corpus.reading_at('鼻', 0) == (0, 4, 'ぜんちないぐ')
+
+
+def test_annotations_between(marked_corpus):
+    markup = marked_corpus.markup
+    work = marked_corpus.work_number('羅生門')
+    text = marked_corpus.text('羅生門')
+    start = text.index('待っていた')
+    assert markup.annotations_between(work, 0, len(text)) == [(start, start + 5, '「待っていた」に傍点')]
+    assert markup.annotations_between(work, 0, start) == []
+    assert markup.annotations_between(marked_corpus.work_number('鼻'), 0, 100) == []
+    assert markup.count(work, RUBY) == 2
+    assert markup.count(work, ANNOTATION) == 1
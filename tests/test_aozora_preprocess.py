@@ -0,0 +1,78 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import aozora_preprocess as ap
+from benchmarks.bench_cleanse import load_corpus, text_cleanse_df_pandas
+
+FILES_DIR = Path(__file__).resolve().parent.parent / ap.author_id / 'files'
+
+
+@pytest.fixture(autouse=True)
+def no_gaiji(monkeypatch):
+    # 従来の処理には外字の置き換えが無いので、同じ条件で比べる
+    monkeypatch.setattr(ap, 'resolve_gaiji', False)
+
+
+def legacy_lines(lines):
+    """従来の pandas の置換を1行ずつ適用した結果（残らない行は None）"""
+    df = pd.DataFrame({'text': lines})
+    df = df.replace({'text': {'《.*?》': ''}}, regex=True)
+    df = df.replace({'text': {'［.*?］': ''}}, regex=True)
+    for pattern in ('｜', '　', '^.$', '^―――.*$', '^＊＊＊.*$', '^×××.*$', '―', '…', '※', '「」'):
+        df = df.replace({'text': {pattern: ''}}, regex=True)
+    return [text if len(text) > 1 else None for text in df['text']]
+
+
+@pytest.mark.parametrize('line', [
+    '　羅生門《らしょうもん》の下で雨やみを待っていた。',
+    '｜下人《げにん》は［＃「下人」に傍点］考えた。',
+    '―――',
+    '＊＊＊　二　＊＊＊',
+    '×××',
+    '「……」',
+    '※［＃「てへん＋劣」、第3水準1-84-77］',
+    '一',
+    '　',
+    '',
+    '「」と言った――それだけだ。',
+    'ルビ《るび》が《ふたつ》ある行',
+])
+def test_cleanse_line_matches_legacy(line):
+    assert ap.cleanse_line(line) == legacy_lines([line])[0]
+
+
+@pytest.mark.parametrize('line, text, base', [
+    ('羅生門《らしょうもん》の下で', '羅生門の下で', '羅生門'),
+    ('あのカタカナ《かたかな》を', 'あのカタカナを', 'カタカナ'),
+    ('このＡＢＣ《えーびーしー》は', 'このＡＢＣは', 'ＡＢＣ'),
+    ('第１２３《いちにさん》号', '第１２３号', '１２３'),
+    ('大きな｜下人《げにん》', '大きな下人', '下人'),
+])
+def test_ruby_base_is_run_of_same_script(line, text, base):
+    cleansed, entries = ap.cleanse_line_with_markup(line)
+    assert cleansed == text
+    [(start, end, kind, _)] = entries
+    assert kind == ap.RUBY
+    assert cleansed[start:end] == base
+
+
+def test_text_cleanse_df_matches_legacy():
+    dfs = load_corpus(FILES_DIR)
+    assert dfs
+    for df in dfs:
+        pd.testing.assert_frame_equal(ap.text_cleanse_df(df), text_cleanse_df_pandas(df))
+
+
+@pytest.mark.parametrize('option', ['resolve_gaiji', 'save_markup', 'write_title'])
+def test_manifest_entry_is_stale_when_options_change(option, tmp_path, monkeypatch):
+    zip_file = tmp_path / 'work.zip'
+    zip_file.write_bytes(b'zip')
+    output = tmp_path / 'work_clns_utf-8.txt'
+    output.write_text('text', encoding='utf-8')
+    entry = ap.manifest_entry(zip_file, [{'zip': 'work.zip', 'file': 'work.txt', 'lines': 1, 'error': '',
+                                          'outputs': [str(output)]}])
+    assert ap.is_up_to_date(entry, zip_file)
+    monkeypatch.setattr(ap, option, not getattr(ap, option))
+    assert not ap.is_up_to_date(entry, zip_file)
@@ -0,0 +1,108 @@
+import pytest
+
+import chat_context
+from chat_context import ConversationContext, estimate_tokens
+
+SYSTEM_PROMPT = 'あなたは芥川龍之介です。'
+
+
+def make_history(n_turns, length=50):
+    history = [{"role": "system", "content": SYSTEM_PROMPT}]
+    for i in range(n_turns):
+        history.append({"role": "user", "content": f'質問{i}' + 'あ' * length})
+        history.append({"role": "assistant", "content": f'回答{i}' + 'い' * length})
+    return history
+
+
+class RunningSummary:
+    """running_summary の代わり（呼ばれた回数を数える）"""
+
+    def __init__(self, summary='', turns=0):
+        self.summary = summary
+        self.turns = turns
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.summary, self.turns
+
+
+def sent_tokens(messages):
+    return sum(estimate_tokens(m["content"]) + chat_context.MESSAGE_OVERHEAD for m in messages)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('羅生門') == 3
+    assert estimate_tokens('abcd') == 1
+    assert estimate_tokens('abcde') == 2
+
+
+def test_under_budget_sends_everything():
+    context = ConversationContext(SYSTEM_PROMPT, budget=2000)
+    running_summary = RunningSummary('要約', 1)
+    history = make_history(3)
+    assert context.messages(history, running_summary) == history
+    assert running_summary.calls == 0
+
+
+def test_over_budget_replaces_old_turns_with_summary():
+    budget = 500
+    context = ConversationContext(SYSTEM_PROMPT, budget=budget)
+    running_summary = RunningSummary('これまでの要約', 5)
+    history = make_history(10)
+    messages = context.messages(history, running_summary)
+
+    assert running_summary.calls == 1
+    assert messages[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    assert messages[1] == {"role": "system", "content": chat_context.SUMMARY_LABEL + 'これまでの要約'}
+    # 直近の会話は古い方から切り詰めて、上限の low_water まで減らす
+    assert messages[2:] == history[1 + context.summarized:]
+    assert sent_tokens(messages) <= budget * chat_context.low_water
+    assert messages[-chat_context.keep_recent:] == history[-chat_context.keep_recent:]
+
+
+def test_trimmed_context_is_reused_until_budget_is_exceeded_again():
+    context = ConversationContext(SYSTEM_PROMPT, budget=500)
+    running_summary = RunningSummary('要約', 5)
+    history = make_history(10)
+    context.messages(history, running_summary)
+    summarized = context.summarized
+
+    history += make_history(1)[1:]
+    messages = context.messages(history, running_summary)
+    assert running_summary.calls == 1
+    assert context.summarized == summarized
+    assert messages[-2:] == history[-2:]
+
+
+def test_keeps_recent_messages_even_if_over_budget():
+    context = ConversationContext(SYSTEM_PROMPT, budget=100)
+    history = make_history(2, length=200)
+    messages = context.messages(history, RunningSummary())
+    assert messages[1:] == history[-chat_context.keep_recent:]
+
+
+def test_older_summary_is_not_adopted():
+    context = ConversationContext(SYSTEM_PROMPT, budget=500)
+    history = make_history(10)
+    context.messages(history, RunningSummary('新しい要約', 6))
+    history += make_history(10)[1:]
+    context.messages(history, RunningSummary('古い要約', 4))
+    assert (context.summary, context.summary_turns) == ('新しい要約', 6)
+
+
+@pytest.mark.parametrize('summary', ['', '要約'])
+def test_trims_without_waiting_for_summary(summary):
+    context = ConversationContext(SYSTEM_PROMPT, budget=500)
+    messages = context.messages(make_history(10), RunningSummary(summary, 0 if not summary else 2))
+    assert context.summarized > 0
+    assert sent_tokens(messages) <= 500
+
+
+def test_rebuilt_history_resets_context():
+    context = ConversationContext(SYSTEM_PROMPT, budget=500)
+    context.messages(make_history(10), RunningSummary('要約', 5))
+    history = make_history(1)
+    assert context.messages(history, RunningSummary()) == history
+    assert (context.summary, context.summarized) == ('', 0)
@@ -0,0 +1,101 @@
+import sqlite3
+import threading
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = database.ConnectionPool(str(tmp_path / 'literary_app.db'), max_idle=2)
+    yield pool
+    pool.close()
+
+
+def pragma(conn, name):
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def test_connections_are_configured(pool):
+    with pool.connection() as conn:
+        assert pragma(conn, 'journal_mode') == 'wal'
+        assert pragma(conn, 'busy_timeout') == int(database.busy_timeout * 1000)
+        assert pragma(conn, 'synchronous') == 1  # NORMAL
+        assert pragma(conn, 'cache_size') == -database.cache_size_kib
+        assert pragma(conn, 'mmap_size') == database.mmap_size
+
+
+def test_connection_is_reused(pool):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert pool.opened == 1
+
+
+def test_concurrent_connections_are_separate(pool):
+    with pool.connection() as first, pool.connection() as second:
+        assert second is not first
+        # 2つ目に開いた接続にも設定を行う
+        assert pragma(second, 'journal_mode') == 'wal'
+    assert pool.opened == 2
+
+
+def test_uncommitted_transaction_is_rolled_back(pool):
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE T (x INTEGER)")
+        conn.commit()
+        conn.execute("INSERT INTO T VALUES (1)")
+        assert conn.in_transaction
+    with pool.connection() as conn:
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM T").fetchone()[0] == 0
+
+
+def test_committed_writes_are_kept(pool):
+    with pool.connection() as conn, conn:
+        conn.execute("CREATE TABLE T (x INTEGER)")
+        conn.execute("INSERT INTO T VALUES (1)")
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM T").fetchone()[0] == 1
+
+
+def test_row_factory_is_reset(pool):
+    with pool.connection(row_factory=sqlite3.Row) as conn:
+        assert isinstance(conn.execute("SELECT 1 AS one").fetchone(), sqlite3.Row)
+    with pool.connection() as conn:
+        assert conn.execute("SELECT 1 AS one").fetchone() == (1,)
+
+
+def test_keeps_at_most_max_idle(pool):
+    conns = [pool.connection() for _ in range(4)]
+    opened = [cm.__enter__() for cm in conns]
+    for cm in conns:
+        cm.__exit__(None, None, None)
+    assert len(set(map(id, opened))) == 4
+    assert len(pool._idle) == pool.max_idle
+
+
+def test_shared_pool_per_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'other.db')
+    assert database.get_pool(path) is database.get_pool(path)
+    monkeypatch.setattr(database, 'db_file', path)
+    assert database.get_pool() is database.get_pool(path)
+
+
+def test_threads_can_share_the_pool(pool):
+    with pool.connection() as conn, conn:
+        conn.execute("CREATE TABLE T (x INTEGER)")
+
+    def write(i):
+        with pool.connection() as conn, conn:
+            conn.execute("INSERT INTO T VALUES (?)", (i,))
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM T").fetchone()[0] == 8
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+import database
+import job_queue
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'jobs.db')
+
+
+def test_run_next_runs_job_and_stores_result(db_path):
+    queue = JobQueue({"echo": lambda payload: {"echo": payload}}, db_path)
+    job_id = queue.submit("echo", {"text": "羅生門"}, ref=7)
+    assert queue.run_next()
+    job = queue.get(job_id)
+    assert (job["status"], job["result"]) == (job_queue.DONE, {"echo": {"text": "羅生門"}})
+    assert queue.latest("echo", 7)["id"] == job_id
+    assert not queue.run_next()
+
+
+def test_failed_job_records_error(db_path):
+    def fail(payload):
+        raise ValueError("boom")
+
+    queue = JobQueue({"fail": fail}, db_path)
+    job_id = queue.submit("fail", {})
+    queue.run_next()
+    job = queue.get(job_id)
+    assert job["status"] == job_queue.FAILED
+    assert job["error"] == "ValueError: boom"
+
+
+def test_connection_is_returned_while_handler_runs(db_path):
+    pool = database.get_pool(db_path)
+
+    def handler(payload):
+        # ハンドラーが接続を借りても、ジョブを取り出した接続を使い回せる（新しく開かない）
+        with database.connection(db_path) as conn:
+            conn.execute("SELECT 1")
+        return pool.opened
+
+    queue = JobQueue({"check": handler}, db_path)
+    job_id = queue.submit("check", {})
+    opened = pool.opened
+    queue.run_next()
+    assert queue.get(job_id)["result"] == opened
+
+
+def test_requeue_stale_only_requeues_stale_jobs(db_path, monkeypatch):
+    queue = JobQueue({"noop": lambda payload: None}, db_path)
+    stale_id = queue.submit("noop", {})
+    fresh_id = queue.submit("noop", {})
+    now = time.time()
+    with database.connection(db_path) as conn, conn:
+        conn.execute("UPDATE JOBS SET status = ?, owner = 'other', heartbeat = ? WHERE id = ?",
+                     (job_queue.RUNNING, now - job_queue.stale_after - 1, stale_id))
+        conn.execute("UPDATE JOBS SET status = ?, owner = 'other', heartbeat = ? WHERE id = ?",
+                     (job_queue.RUNNING, now, fresh_id))
+    assert queue.requeue_stale() == 1
+    assert queue.get(stale_id)["status"] == job_queue.QUEUED
+    assert queue.get(fresh_id)["status"] == job_queue.RUNNING
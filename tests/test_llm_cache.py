@@ -0,0 +1,171 @@
+import sys
+from pathlib import Path
+
+import openai
+import pytest
+
+import llm_cache
+import llm_client
+import llm_metrics
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+from fake_openai_server import FakeOpenAIServer, fake_reply  # noqa: E402
+
+MODEL = 'gpt-3.5-turbo'
+
+
+def chunks(content):
+    """FakeBackend が stream=True で返す本文の区切り"""
+    return [content[i:i + 4] for i in range(0, len(content), 4)]
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """キャッシュ・計測の記録を一時ファイルに作り、FakeBackend を呼ぶクライアントに差し替える"""
+    monkeypatch.setattr(llm_cache, 'cache_file', str(tmp_path / 'llm_cache.db'))
+    monkeypatch.setattr(llm_cache, '_default_cache', None)
+    monkeypatch.setattr(llm_metrics, 'db_file', str(tmp_path / 'llm_metrics.db'))
+    monkeypatch.setattr(llm_metrics, '_recorder', None)
+    backend = llm_client.FakeBackend()
+    llm_client.set_client(llm_client.LLMClient(backend))
+    yield backend
+    llm_client.set_client(None)
+
+
+def test_stream_yields_deltas_in_order(backend):
+    messages = [{"role": "user", "content": '羅生門の下人はどこへ行ったのでしょうか。'}]
+    expected = backend.reply(messages)
+    pieces = list(llm_cache.stream_chat_completion(MODEL, messages))
+    assert pieces == chunks(expected)
+    assert ''.join(pieces) == expected
+    # use_cache=False ではキャッシュに保存しない
+    assert llm_cache.get_cache().stats()["entries"] == 0
+
+
+def test_stream_stores_joined_reply(backend):
+    messages = [{"role": "user", "content": '鼻の内供は何に悩んでいましたか。'}]
+    expected = backend.reply(messages)
+    reply = ''
+    for piece in llm_cache.stream_chat_completion(MODEL, messages, use_cache=True):
+        reply += piece  # 画面と同じように届いた分を足していく
+    assert reply == expected
+
+    cached = llm_cache.get_cache().get(llm_cache.cache_key(MODEL, messages))
+    assert cached == {"choices": [{"message": {"role": "assistant", "content": expected}}]}
+
+    # 2回目は API を呼ばずに、保存した本文を一度に返す
+    calls = backend.calls
+    assert list(llm_cache.stream_chat_completion(MODEL, messages, use_cache=True)) == [expected]
+    assert backend.calls == calls
+
+
+def test_interrupted_stream_is_not_cached(backend, monkeypatch):
+    def broken(content):
+        yield {"choices": [{"index": 0, "delta": {"role": "assistant"}}]}
+        yield {"choices": [{"index": 0, "delta": {"content": content[:4]}}]}
+        raise openai.error.APIConnectionError('connection reset')
+
+    monkeypatch.setattr(backend, '_stream', broken)
+    messages = [{"role": "user", "content": '蜘蛛の糸'}]
+    pieces = []
+    with pytest.raises(openai.error.APIConnectionError):
+        for piece in llm_cache.stream_chat_completion(MODEL, messages, use_cache=True):
+            pieces.append(piece)
+    assert pieces == [backend.reply(messages)[:4]]
+    assert llm_cache.get_cache().get(llm_cache.cache_key(MODEL, messages)) is None
+
+
+def test_stream_over_http(backend, monkeypatch):
+    """fake_openai_server の Server-Sent Events を openai ライブラリ経由で受け取る"""
+    monkeypatch.setattr(openai, 'requestssession', None, raising=False)
+    with FakeOpenAIServer(latency=0, token_delay=0, n_tokens=5) as server:
+        monkeypatch.setattr(openai, 'api_base', server.api_base)
+        monkeypatch.setattr(openai, 'api_key', 'dummy')
+        llm_client.set_client(llm_client.LLMClient(llm_client.OpenAIBackend()))
+        messages = [{"role": "user", "content": '杜子春'}]
+        pieces = list(llm_cache.stream_chat_completion(MODEL, messages, use_cache=True))
+    assert pieces == fake_reply(messages, 5)
+    cached = llm_cache.get_cache().get(llm_cache.cache_key(MODEL, messages))
+    assert cached["choices"][0]["message"]["content"] == ''.join(pieces)
+
+
+def response(content):
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+
+def stored_size(content):
+    return len(llm_cache.json.dumps(response(content), ensure_ascii=False).encode('utf-8'))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = llm_cache.ResponseCache(str(tmp_path / 'llm_cache.db'))
+    yield cache
+    cache._conn.close()
+
+
+def last_used(cache, key):
+    return cache._conn.execute("SELECT last_used FROM LLM_CACHE WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_get_hit_updates_last_used(cache, monkeypatch):
+    monkeypatch.setattr(llm_cache.time, 'time', lambda: 1000.0)
+    cache.put('a', MODEL, response('羅生門'))
+    assert cache.get('missing') is None
+    monkeypatch.setattr(llm_cache.time, 'time', lambda: 2000.0)
+    assert cache.get('a') == response('羅生門')
+    assert last_used(cache, 'a') == 2000.0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_total_bytes_after_upsert(cache):
+    cache.put('a', MODEL, response('短い'))
+    cache.put('b', MODEL, response('鼻'))
+    cache.put('a', MODEL, response('ずっと長い応答に置き換える'))
+    expected = stored_size('ずっと長い応答に置き換える') + stored_size('鼻')
+    assert cache.total_bytes() == expected
+    assert cache._conn.execute("SELECT SUM(size) FROM LLM_CACHE").fetchone()[0] == expected
+    assert cache.stats()["entries"] == 2
+    cache.clear()
+    assert cache.total_bytes() == 0
+
+
+def test_total_bytes_counts_existing_rows_on_open(tmp_path):
+    path = str(tmp_path / 'llm_cache.db')
+    cache = llm_cache.ResponseCache(path)
+    cache.put('a', MODEL, response('羅生門'))
+    cache._conn.close()
+    reopened = llm_cache.ResponseCache(path)
+    assert reopened.total_bytes() == stored_size('羅生門')
+    reopened._conn.close()
+
+
+def test_evicts_least_recently_used_down_to_evict_to(cache, monkeypatch):
+    size = stored_size('応答0')
+    cache.max_bytes = size * 10
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(llm_cache.time, 'time', lambda: float(next(clock)))
+    for i in range(10):
+        cache.put(f'k{i}', MODEL, response(f'応答{i}'))
+    assert cache.stats()["entries"] == 10
+    cache.get('k0')  # 最近使ったものは残る
+
+    cache.put('k10', MODEL, response('応答a'))
+    keys = {row[0] for row in cache._conn.execute("SELECT key FROM LLM_CACHE")}
+    assert cache.total_bytes() <= cache.max_bytes * llm_cache.evict_to
+    assert {'k0', 'k10'} <= keys
+    assert 'k1' not in keys and 'k2' not in keys
+    assert cache.total_bytes() == sum(row[0] for row in cache._conn.execute("SELECT size FROM LLM_CACHE"))
+
+
+def test_uncached_calls_do_not_write(backend):
+    messages = [{"role": "user", "content": '杜子春'}]
+    assert llm_cache.chat_completion(MODEL, messages)["choices"][0]["message"]["content"] == backend.reply(messages)
+    llm_cache.chat_completion(MODEL, messages)
+    assert backend.calls == 2
+    assert llm_cache.get_cache().stats() == {"hits": 0, "misses": 0, "hit_rate": 0.0, "entries": 0, "bytes": 0}
+
+    llm_cache.chat_completion(MODEL, messages, use_cache=True)
+    llm_cache.chat_completion(MODEL, messages, use_cache=True)
+    assert backend.calls == 3
+    assert llm_cache.get_cache().stats()["entries"] == 1
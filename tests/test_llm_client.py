@@ -0,0 +1,155 @@
+import threading
+import time
+
+import pytest
+
+import llm_client
+from llm_client import SingleFlight, TokenBucket
+
+
+class FakeClock:
+    """time.monotonic / time.sleep の代わり（sleep すると時計が進む）"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_client, 'time', clock)
+    return clock
+
+
+def test_token_bucket_allows_burst_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=5)
+    assert [bucket.acquire() for _ in range(5)] == [0] * 5
+    assert clock.slept == []
+
+
+def test_token_bucket_waits_when_empty(clock):
+    bucket = TokenBucket(rate=2, capacity=5)
+    bucket.acquire(5)
+    assert bucket.acquire() == pytest.approx(0.5)
+    # 待った分は前借りしているので、次の1つはさらに 0.5 秒後
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.slept == pytest.approx([0.5, 0.5])
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = TokenBucket(rate=2, capacity=5)
+    bucket.acquire(5)
+    clock.now += 1.0
+    assert bucket.acquire(2) == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+    # 溜まるのは capacity まで
+    clock.now += 60
+    assert bucket.acquire(5) == 0
+    assert bucket.acquire() > 0
+
+
+def test_token_bucket_amount_larger_than_capacity(clock):
+    bucket = TokenBucket(rate=1, capacity=3)
+    # capacity を超える分は一度に取り出せないので、capacity 分だけ待てばよい
+    assert bucket.acquire(10) == 0
+    assert bucket.acquire(10) == pytest.approx(3)
+
+
+def run_concurrently(flight, key, func, n):
+    """n 個のスレッドから同時に flight.do(key, func) を呼び、(結果, 例外) のリストを返す"""
+    results = [None] * n
+
+    def call(i):
+        try:
+            results[i] = (flight.do(key, func), None)
+        except Exception as e:
+            results[i] = (None, e)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        release.wait(5)
+        return {"choices": [{"message": {"content": "reply"}}]}
+
+    threads, results = run_concurrently(flight, 'key', func, 4)
+    wait_for(lambda: flight.coalesced == 3)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(error is None for _, error in results)
+    assert all(result == {"choices": [{"message": {"content": "reply"}}]} for result, _ in results)
+    # 結果は呼び出し元ごとに別のオブジェクト
+    assert len({id(result) for result, _ in results}) == 4
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def func():
+        release.wait(5)
+        raise RuntimeError('boom')
+
+    threads, results = run_concurrently(flight, 'key', func, 3)
+    wait_for(lambda: flight.coalesced == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert all(isinstance(error, RuntimeError) for _, error in results)
+
+
+def test_single_flight_runs_again_after_completion():
+    flight = SingleFlight()
+    calls = []
+    for _ in range(3):
+        flight.do('key', lambda: calls.append(1))
+    assert len(calls) == 3
+    assert flight.coalesced == 0
+
+
+def test_single_flight_different_keys_are_independent():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        release.wait(5)
+        return len(calls)
+
+    threads = [threading.Thread(target=flight.do, args=(key, func)) for key in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: len(calls) == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert flight.coalesced == 0
@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+import load_bot_table
+import text_codec
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    yield conn
+    conn.close()
+
+
+def insert_rows(conn, rows):
+    load_bot_table.create_bot_table(conn)
+    conn.executemany("INSERT INTO BOT (author, title, text_content) VALUES (?, ?, ?)", rows)
+    conn.commit()
+
+
+def test_init_bot_table_refuses_duplicates(conn):
+    insert_rows(conn, [('芥川龍之介', '羅生門', '一'), ('芥川龍之介', '羅生門', '二'), ('芥川龍之介', '鼻', '三')])
+    with pytest.raises(ValueError, match='--dedupe'):
+        load_bot_table.init_bot_table(conn)
+    # 何も削除しない
+    assert conn.execute("SELECT COUNT(*) FROM BOT").fetchone()[0] == 3
+
+
+def test_dedupe_keeps_first_row_and_reports_deleted(conn):
+    insert_rows(conn, [
+        ('芥川龍之介', '羅生門', '一'), ('芥川龍之介', '羅生門', '二'), ('芥川龍之介', '羅生門', '三'),
+        ('芥川龍之介', '鼻', '四'),
+    ])
+    assert load_bot_table.dedupe_bot_table(conn) == [('芥川龍之介', '羅生門', 2)]
+    assert conn.execute("SELECT title, text_content FROM BOT ORDER BY rowid").fetchall() == [
+        ('羅生門', '一'), ('鼻', '四'),
+    ]
+    assert load_bot_table.has_unique_index(conn)
+    assert load_bot_table.dedupe_bot_table(conn) == []
+    load_bot_table.init_bot_table(conn)
+
+
+def test_load_works_upserts(conn):
+    load_bot_table.init_bot_table(conn)
+    assert load_bot_table.load_works(conn, '芥川龍之介', [('羅生門', '一'), ('鼻', '二')], batch_size=1) == (2, 0)
+    load_bot_table.load_works(conn, '芥川龍之介', [('羅生門', '三')])
+    rows = conn.execute("SELECT title, text_content FROM BOT ORDER BY rowid").fetchall()
+    assert [(title, text_codec.decode(value)) for title, value in rows] == [('羅生門', '三'), ('鼻', '二')]
+
+
+TEXT = '或日の暮方の事である。一人の下人が、羅生門の下で雨やみを待っていた。\n' * 200
+
+
+def test_load_works_skips_unchanged_text(conn, monkeypatch):
+    load_bot_table.init_bot_table(conn)
+    load_bot_table.load_works(conn, '芥川龍之介', [('羅生門', TEXT), ('鼻', TEXT)])
+
+    encoded = []
+    encode = text_codec.encode
+    monkeypatch.setattr(text_codec, 'encode', lambda text, codecs=None: encoded.append(text) or encode(text, codecs))
+    changed = TEXT + '下人の行方は、誰も知らない。'
+    assert load_bot_table.load_works(conn, '芥川龍之介', [('羅生門', TEXT), ('鼻', changed)]) == (1, 1)
+    assert encoded == [changed]
+    assert text_codec.fetch_text(conn, '鼻', '芥川龍之介') == changed
+
+
+def test_load_works_reencodes_with_another_codec(conn):
+    load_bot_table.init_bot_table(conn)
+    load_bot_table.load_works(conn, '芥川龍之介', [('羅生門', TEXT)], codec='zlib')
+    assert load_bot_table.load_works(conn, '芥川龍之介', [('羅生門', TEXT)], codec='zlib') == (0, 1)
+    assert load_bot_table.load_works(conn, '芥川龍之介', [('羅生門', TEXT)], codec='lzma') == (1, 0)
+    assert text_codec.codec_name(conn.execute("SELECT text_content FROM BOT").fetchone()[0]) == 'lzma'
+    assert load_bot_table.load_works(conn, '芥川龍之介', [('羅生門', TEXT)], codec='auto') == (0, 1)
+
+
+def test_compress_table_uses_one_codec(conn):
+    insert_rows(conn, [('芥川龍之介', '羅生門', TEXT), ('芥川龍之介', '鼻', TEXT)])
+    load_bot_table.init_bot_table(conn)
+    assert load_bot_table.compress_table(conn, codec='bz2') == 2
+    assert load_bot_table.compress_table(conn, codec='bz2') == 0
+    values = [row[0] for row in conn.execute("SELECT text_content FROM BOT")]
+    assert [text_codec.codec_name(value) for value in values] == ['bz2', 'bz2']
@@ -0,0 +1,29 @@
+import sqlite3
+
+import passage_index
+
+TEXT = '\n'.join(f'第{i}段。下人は羅生門の下で雨やみを待っていた。' * 5 for i in range(20))
+
+
+def test_search_finds_passage():
+    index = passage_index.PassageIndex.build(TEXT + '\n老婆は死人の髪の毛を抜いていた。')
+    hits = index.top_passages('老婆の髪の毛', k=1)
+    assert len(hits) == 1 and '老婆' in hits[0]
+
+
+def test_load_or_build_index_rebuilds_changed_text():
+    conn = sqlite3.connect(':memory:')
+    first = passage_index.load_or_build_index(conn, '芥川龍之介', '羅生門', TEXT)
+    again = passage_index.load_or_build_index(conn, '芥川龍之介', '羅生門', TEXT)
+    assert again.passages == first.passages
+
+    changed = TEXT + '\n下人の行方は、誰も知らない。'
+    rebuilt = passage_index.load_or_build_index(conn, '芥川龍之介', '羅生門', changed)
+    assert rebuilt.passages == passage_index.chunk_text(changed)
+    assert conn.execute("SELECT text_hash FROM PASSAGE_INDEX").fetchone()[0] == passage_index.text_digest(changed)
+
+
+def test_missing_text_is_not_stored():
+    conn = sqlite3.connect(':memory:')
+    assert passage_index.load_or_build_index(conn, '芥川龍之介', '無い作品', None).passages == []
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'PASSAGE_INDEX'").fetchone() is None
@@ -0,0 +1,124 @@
+import sqlite3
+
+import pytest
+
+import text_codec
+
+TEXT = '或日の暮方の事である。一人の下人が、羅生門の下で雨やみを待っていた。\n' * 200
+
+
+@pytest.mark.parametrize('codec', list(text_codec.CODECS))
+def test_round_trip(codec):
+    value = text_codec.encode(TEXT, codecs=(codec,))
+    header = text_codec.read_header(value)
+    assert header.raw_size == len(TEXT.encode('utf-8'))
+    assert text_codec.decode(value) == TEXT
+
+
+def test_encode_compresses():
+    value = text_codec.encode(TEXT)
+    assert text_codec.codec_name(value) != 'raw'
+    assert len(value) < len(TEXT.encode('utf-8'))
+
+
+def test_encode_uses_default_codec(monkeypatch):
+    assert text_codec.codec_name(text_codec.encode(TEXT)) == text_codec.default_codec
+    monkeypatch.setattr(text_codec, 'default_codec', 'lzma')
+    assert text_codec.codec_name(text_codec.encode(TEXT)) == 'lzma'
+
+
+def test_codecs_for():
+    assert text_codec.codecs_for('zlib') == (text_codec.ZLIB,)
+    assert text_codec.codecs_for('auto') == text_codec.candidates
+    with pytest.raises(ValueError):
+        text_codec.codecs_for('zstd')
+
+
+def test_is_encoded():
+    header = text_codec.read_header(text_codec.encode(TEXT, codecs=(text_codec.ZLIB,)))
+    assert text_codec.is_encoded(header, TEXT, (text_codec.ZLIB,))
+    assert text_codec.is_encoded(header, TEXT)
+    assert not text_codec.is_encoded(header, TEXT, (text_codec.BZ2,))
+    assert not text_codec.is_encoded(header, TEXT + '。', (text_codec.ZLIB,))
+    assert not text_codec.is_encoded(None, TEXT)
+
+
+def test_short_text_is_not_compressed():
+    value = text_codec.encode('芥川')
+    assert text_codec.codec_name(value) == 'raw'
+    assert text_codec.decode(value) == '芥川'
+
+
+def test_empty_text():
+    assert text_codec.decode(text_codec.encode('')) == ''
+
+
+def test_plain_values_are_passed_through():
+    assert text_codec.decode(None) is None
+    assert text_codec.decode(TEXT) == TEXT
+    assert text_codec.decode(TEXT.encode('utf-8')) == TEXT
+    assert text_codec.codec_name(TEXT) == 'text'
+
+
+def test_crc_mismatch_is_detected():
+    value = bytearray(text_codec.encode(TEXT, codecs=(text_codec.RAW,)))
+    value[-1] ^= 0xff
+    with pytest.raises(ValueError):
+        text_codec.decode(bytes(value))
+
+
+def test_raw_size_mismatch_is_detected():
+    value = text_codec.encode(TEXT, codecs=(text_codec.ZLIB,))
+    magic, version, codec, raw_size, crc = text_codec.HEADER.unpack_from(value)
+    value = text_codec.HEADER.pack(magic, version, codec, raw_size + 1, crc) + value[text_codec.HEADER.size:]
+    with pytest.raises(ValueError):
+        text_codec.decode(value)
+
+
+def test_unknown_version_is_rejected():
+    value = text_codec.encode(TEXT)
+    value = value[:4] + bytes([text_codec.FORMAT_VERSION + 1]) + value[5:]
+    with pytest.raises(ValueError):
+        text_codec.decode(value)
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE BOT (author TEXT, title TEXT, text_content BLOB)')
+    conn.executemany('INSERT INTO BOT VALUES (?, ?, ?)', [
+        ('芥川龍之介', '羅生門', text_codec.encode(TEXT)),
+        ('芥川龍之介', '鼻', '禅智内供の鼻と云えば'),
+    ])
+    yield conn
+    conn.close()
+
+
+def test_fetch_text_uses_cache(conn):
+    cache = text_codec.TextCache()
+    assert text_codec.fetch_text(conn, '羅生門', cache=cache) == TEXT
+    assert text_codec.fetch_text(conn, '羅生門', '芥川龍之介', cache=cache) == TEXT
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_fetch_text_reads_changed_text(conn):
+    cache = text_codec.TextCache()
+    text_codec.fetch_text(conn, '羅生門', cache=cache)
+    conn.execute("UPDATE BOT SET text_content = ? WHERE title = '羅生門'", (text_codec.encode('下人の行方は'),))
+    assert text_codec.fetch_text(conn, '羅生門', cache=cache) == '下人の行方は'
+
+
+def test_fetch_text_plain_and_missing(conn):
+    assert text_codec.fetch_text(conn, '鼻') == '禅智内供の鼻と云えば'
+    assert text_codec.fetch_text(conn, '蜘蛛の糸') is None
+
+
+def test_text_cache_evicts_least_recently_used():
+    cache = text_codec.TextCache(max_bytes=10)
+    cache.put('a', 'A', 4)
+    cache.put('b', 'B', 4)
+    cache.get('a')
+    cache.put('c', 'C', 4)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
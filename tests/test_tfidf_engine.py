@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import tfidf_engine
+from tfidf_engine import TfidfIndex
+
+WORKS = [
+    ({'author': '芥川龍之介', 'title': '羅生門'}, '下人は羅生門の下で雨やみを待っていた。老婆は死人の髪の毛を抜いていた。'),
+    ({'author': '芥川龍之介', 'title': '鼻'}, '禅智内供の鼻は長い。内供は鼻を短くしようとした。'),
+    ({'author': '芥川龍之介', 'title': '蜘蛛の糸'}, 'お釈迦様は蜘蛛の糸を地獄に下ろした。犍陀多は糸を登った。'),
+    ({'author': '芥川龍之介', 'title': '羅生門（異稿）'}, '下人は羅生門の下で雨やみを待っていた。老婆が髪を抜いていた。針。'),
+]
+
+
+@pytest.fixture
+def saved_index(tmp_path):
+    index = TfidfIndex.build([text for _, text in WORKS], [doc for doc, _ in WORKS])
+    index.save(tmp_path / 'works')
+    return tmp_path
+
+
+def test_load_uses_mmap(saved_index):
+    index = tfidf_engine.load_index('works', saved_index)
+    assert isinstance(index.data, np.memmap)
+    assert index.n_docs == len(WORKS)
+    assert tfidf_engine.load_index('passages', saved_index) is None
+
+
+def test_search_matches_built_index(saved_index):
+    built = TfidfIndex.build([text for _, text in WORKS], [doc for doc, _ in WORKS])
+    loaded = tfidf_engine.load_index('works', saved_index)
+    queries = ['羅生門の老婆', '長い鼻']
+    assert loaded.search(queries, k=2) == built.search(queries, k=2)
+    assert loaded.search(['長い鼻'], k=1)[0][0][0]['title'] == '鼻'
+
+
+def test_similar_excludes_itself(saved_index):
+    index = tfidf_engine.load_index('works', saved_index)
+    doc = index.find(title='羅生門')
+    hits = index.similar([doc], k=2)[0]
+    assert hits[0][0]['title'] == '羅生門（異稿）'
+    assert all(label['title'] != '羅生門' for label, _ in hits)
+
+
+@pytest.mark.parametrize('query, title', [('鼻', '鼻'), ('針', '羅生門（異稿）'), ('釈', '蜘蛛の糸')])
+def test_single_character_query(saved_index, query, title):
+    index = tfidf_engine.load_index('works', saved_index)
+    hits = index.search([query], k=1)[0]
+    assert hits and hits[0][0]['title'] == title
+
+
+def test_unknown_query_has_no_hits(saved_index):
+    index = tfidf_engine.load_index('works', saved_index)
+    assert index.search(['ＸＹＺ'], k=3) == [[]]
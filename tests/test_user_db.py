@@ -0,0 +1,134 @@
+import json
+import sqlite3
+
+import pytest
+
+import user_db
+
+LEGACY_SCHEMA = '''
+    CREATE TABLE USER (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT,
+        password TEXT,
+        author TEXT,
+        title TEXT,
+        conversation TEXT,
+        summary TEXT,
+        Relevance INTEGER,
+        Creativity INTEGER,
+        Flexibility INTEGER,
+        Problem_Solving INTEGER,
+        Insight INTEGER
+    )
+'''
+
+MESSAGES = [
+    {"role": "system", "content": "あなたは芥川龍之介です。"},
+    {"role": "user", "content": "羅生門について教えてください。"},
+    {"role": "assistant", "content": "下人の話です。"},
+]
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """以前の形式（USER テーブルの1行に会話の JSON などを持つ）のデータベース"""
+    path = tmp_path / 'literary_app.db'
+    conn = sqlite3.connect(path)
+    conn.execute(LEGACY_SCHEMA)
+    conn.executemany(
+        "INSERT INTO USER (id, username, password, author, title, conversation, summary, "
+        "Relevance, Creativity, Flexibility, Problem_Solving, Insight) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            # 登録しただけのアカウント
+            (1, 'alice', 'pw-a', None, None, None, None, None, None, None, None, None),
+            # 会話・要約・評価のある行
+            (2, 'alice', None, '芥川龍之介', '羅生門', json.dumps(MESSAGES, ensure_ascii=False), '要約',
+             7, 8, 6, 5, 9),
+            # 読めない JSON の会話
+            (3, 'bob', 'pw-b', '芥川龍之介', '鼻', '{not json', None, None, None, None, None, None),
+            # 作品を選んだだけの行
+            (4, 'alice', 'pw-other', '芥川龍之介', '蜘蛛の糸', None, None, None, None, None, None, None),
+        ],
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_migrate_converts_legacy_rows(legacy_db):
+    assert user_db.needs_migration(legacy_db)
+    counts = user_db.migrate(legacy_db)
+    assert counts == {"users": 2, "conversations": 3, "messages": 3, "evaluations": 1}
+    assert not user_db.needs_migration(legacy_db)
+
+    assert legacy_db.execute("SELECT id, username, password FROM USER ORDER BY id").fetchall() == [
+        (1, 'alice', 'pw-a'), (3, 'bob', 'pw-b'),
+    ]
+    # 以前の行の id をそのまま会話の id にする
+    assert legacy_db.execute("SELECT id, user_id, title, summary FROM CONVERSATION ORDER BY id").fetchall() == [
+        (2, 1, '羅生門', '要約'), (3, 3, '鼻', None), (4, 1, '蜘蛛の糸', None),
+    ]
+    assert legacy_db.execute(
+        "SELECT role, content FROM MESSAGE WHERE conversation_id = 2 ORDER BY id"
+    ).fetchall() == [(m["role"], m["content"]) for m in MESSAGES]
+    assert legacy_db.execute(
+        f"SELECT conversation_id, {', '.join(user_db.SCORE_COLUMNS)} FROM EVALUATION"
+    ).fetchall() == [(2, 7, 8, 6, 5, 9)]
+    tables = {row[0] for row in legacy_db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'USER_LEGACY' not in tables
+    assert legacy_db.execute("PRAGMA user_version").fetchone()[0] == user_db.SCHEMA_VERSION
+
+
+def test_migrate_is_idempotent(legacy_db):
+    user_db.migrate(legacy_db)
+    assert user_db.migrate(legacy_db) == {"users": 0, "conversations": 0, "messages": 0, "evaluations": 0}
+    assert legacy_db.execute("SELECT COUNT(*) FROM CONVERSATION").fetchone()[0] == 3
+
+
+def test_migrate_rolls_back_on_error(legacy_db, monkeypatch):
+    def broken(messages):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(user_db, '_parse_messages', broken)
+    with pytest.raises(RuntimeError):
+        user_db.migrate(legacy_db)
+    assert user_db.needs_migration(legacy_db)
+    assert legacy_db.execute("SELECT COUNT(*) FROM USER").fetchone()[0] == 4
+
+
+def test_init_db_backs_up_before_migrating(legacy_db, tmp_path):
+    user_db.init_db(legacy_db)
+    backups = list(tmp_path.glob('literary_app.db.*.bak'))
+    assert len(backups) == 1
+    backup = sqlite3.connect(backups[0])
+    try:
+        assert user_db.needs_migration(backup)
+    finally:
+        backup.close()
+    assert not user_db.needs_migration(legacy_db)
+
+
+def test_running_summary_is_rekeyed_on_conversation_id(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'literary_app.db')
+    conn.execute("CREATE TABLE RUNNING_SUMMARY (id TEXT PRIMARY KEY, username TEXT, title TEXT, summary TEXT, turns INTEGER)")
+    conn.executemany("INSERT INTO RUNNING_SUMMARY VALUES (?, ?, ?, ?, ?)",
+                     [('7', 'alice', '羅生門', '途中までの要約', 3), ('guest', 'bob', '鼻', '捨てる', 1)])
+    conn.commit()
+    user_db.init_user_tables(conn)
+    assert conn.execute("SELECT conversation_id, summary, turns FROM RUNNING_SUMMARY").fetchall() == [
+        (7, '途中までの要約', 3),
+    ]
+    conn.close()
+
+
+def test_owns_conversation(tmp_path, monkeypatch):
+    monkeypatch.setattr(user_db.database, 'db_file', str(tmp_path / 'literary_app.db'))
+    with user_db.database.connection() as conn:
+        user_db.init_user_tables(conn)
+        conn.executemany("INSERT INTO USER (username) VALUES (?)", [('alice',), ('bob',)])
+        conn.commit()
+    conversation_id = user_db.open_conversation('alice', '芥川龍之介', '羅生門')
+    assert user_db.owns_conversation(conversation_id, 'alice')
+    assert not user_db.owns_conversation(conversation_id, 'bob')
+    assert not user_db.owns_conversation(conversation_id + 1, 'alice')
+    assert not user_db.owns_conversation(conversation_id, '')
@@ -0,0 +1,186 @@
+"""
+作品本文（BOT.text_content）の圧縮
+
+本文は先頭に形式を表すヘッダーを付けた BLOB として保存する。圧縮方式は標準ライブラリの
+zlib / bz2 / lzma から1つを指定する（通常は展開の速い zlib）。'auto' を指定すると作品ごとに
+すべての方式で圧縮してみて選ぶ（最も小さくなる方式とほとんど変わらなければ展開の速い方式）。
+読むときはヘッダーの codec で展開する。ヘッダーの無い値（以前の TEXT のままの本文）は
+そのまま本文として扱うので、圧縮前のデータベースもそのまま読める。
+
+形式（リトルエンディアン）:
+    magic b'AOZT' | version (uint8) | codec (uint8) | raw_size (uint64) | crc32 (uint32)
+    data : codec で圧縮した UTF-8 の本文（raw_size は圧縮前のバイト数、crc32 は圧縮前の値）
+
+fetch_text は BLOB のヘッダーだけを読み、同じ本文を展開済みならそれを返す
+（展開した本文は cache_bytes まで、最後に使われたのが古いものから捨てる）。
+"""
+import bz2
+import collections
+import lzma
+import struct
+import threading
+import zlib
+
+MAGIC = b'AOZT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBBQI')
+
+RAW = 0
+ZLIB = 1
+BZ2 = 2
+LZMA = 3
+CODECS = {
+    RAW: ('raw', bytes, bytes),
+    ZLIB: ('zlib', lambda data: zlib.compress(data, 9), zlib.decompress),
+    BZ2: ('bz2', lambda data: bz2.compress(data, 9), bz2.decompress),
+    LZMA: ('lzma', lzma.compress, lzma.decompress),
+}
+CODEC_IDS = {name: codec for codec, (name, _, _) in CODECS.items()}
+candidates = (ZLIB, LZMA, BZ2)  # 'auto' で試す圧縮方式（展開の速い順）
+default_codec = 'zlib'  # 登録するときの圧縮方式（CODEC_IDS の名前か 'auto'）
+size_tolerance = 1.05  # 最も小さい方式よりこの倍率までの大きさなら、展開の速い方式を選ぶ
+cache_bytes = 64 * 1024 * 1024  # 展開した本文をメモリに置いておく上限（UTF-8 のバイト数）
+
+Header = collections.namedtuple('Header', ['codec', 'raw_size', 'crc'])
+
+
+def encode(text, codecs=None):
+    """
+    本文をヘッダー付きの BLOB にする（どの方式でも小さくならなければ圧縮しない）
+    codecs を省略すると default_codec で圧縮する
+    """
+    if codecs is None:
+        codecs = codecs_for(default_codec)
+    raw = text.encode('utf-8')
+    results = [(RAW, raw)] + [(codec, CODECS[codec][1](raw)) for codec in codecs]
+    smallest = min(len(data) for _, data in results)
+    # 展開の速い順（圧縮しない → codecs の順）に、最も小さいものとほとんど変わらない方式を選ぶ
+    codec, data = next((codec, data) for codec, data in results if len(data) <= smallest * size_tolerance)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, codec, len(raw), zlib.crc32(raw)) + data
+
+
+def codecs_for(name):
+    """圧縮方式の名前から encode に渡す codecs（'auto' なら candidates）"""
+    if name == 'auto':
+        return candidates
+    if name not in CODEC_IDS:
+        raise ValueError(f'不明な圧縮方式です: {name}')
+    return (CODEC_IDS[name],)
+
+
+def is_encoded(header, text, codecs=candidates):
+    """
+    保存されている値のヘッダーが、本文 text を codecs のどれか（または圧縮なし）で保存したものなら True
+    （本文が変わっていなければ圧縮し直さないために使う。crc32 を計算するだけで圧縮はしない）
+    """
+    if header is None or header.codec not in (RAW, *codecs):
+        return False
+    raw = text.encode('utf-8')
+    return header.raw_size == len(raw) and header.crc == zlib.crc32(raw)
+
+
+def read_header(value):
+    """ヘッダーの内容（この形式でなければNone）"""
+    if not isinstance(value, (bytes, bytearray, memoryview)) or len(value) < HEADER.size:
+        return None
+    magic, version, codec, raw_size, crc = HEADER.unpack_from(value)
+    if magic != MAGIC:
+        return None
+    if version != FORMAT_VERSION or codec not in CODECS:
+        raise ValueError(f'未対応の本文の形式です（version {version}, codec {codec}）')
+    return Header(codec, raw_size, crc)
+
+
+def codec_name(value):
+    """保存されている本文の圧縮方式の名前（ヘッダーが無ければ 'text'）"""
+    header = read_header(value)
+    return 'text' if header is None else CODECS[header.codec][0]
+
+
+def decode(value):
+    """保存されている値から本文を取り出す（TEXT のままの値はそのまま返す）"""
+    if value is None or isinstance(value, str):
+        return value
+    header = read_header(value)
+    if header is None:
+        return bytes(value).decode('utf-8')
+    raw = CODECS[header.codec][2](bytes(value[HEADER.size:]))
+    if len(raw) != header.raw_size or zlib.crc32(raw) != header.crc:
+        raise ValueError('本文の展開結果がヘッダーと一致しません')
+    return raw.decode('utf-8')
+
+
+class TextCache:
+    """展開した本文の LRU キャッシュ（キーは作品とヘッダー、本文が変われば別のキーになる）"""
+
+    def __init__(self, max_bytes=cache_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # キー → (本文, バイト数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, text, size):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (text, size)
+            self._bytes += size
+            # 上限を超えたら最後に使われたのが古いものから捨てる（入れたばかりの1件は残す）
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+_cache = TextCache()
+
+
+def fetch_text(conn, title, author=None, cache=None):
+    """
+    BOT テーブルの作品の本文（無ければNone）
+    BLOB はヘッダーだけを読み、展開済みならキャッシュの本文を返す（展開は初めて読むときだけ）
+    """
+    cache = _cache if cache is None else cache
+    if author is None:
+        row = conn.execute(
+            "SELECT rowid, typeof(text_content) FROM BOT WHERE title = ? LIMIT 1", (title,)
+        ).fetchone()
+    else:
+        row = conn.execute(
+            "SELECT rowid, typeof(text_content) FROM BOT WHERE author = ? AND title = ?", (author, title)
+        ).fetchone()
+    if row is None:
+        return None
+    rowid, value_type = row
+    if value_type != 'blob':
+        value = conn.execute("SELECT text_content FROM BOT WHERE rowid = ?", (rowid,)).fetchone()[0]
+        return decode(value)
+
+    with conn.blobopen('BOT', 'text_content', rowid, readonly=True) as blob:
+        header = read_header(blob.read(HEADER.size))
+        if header is None:
+            blob.seek(0)
+            return decode(blob.read())
+        key = (rowid, title, *header)
+        text = cache.get(key)
+        if text is None:
+            blob.seek(0)
+            text = decode(blob.read())
+            cache.put(key, text, header.raw_size)
+    return text
@@ -0,0 +1,269 @@
+"""
+整形済みコーパスの TF-IDF 類似検索
+
+文字n-gramの TF-IDF 行列（疎行列を CSR の配列で持つ）を NumPy で作り、
+複数のクエリをまとめてコサイン類似度の上位 k 件を返す。
+「この作品に似た作品」（作品単位）や「この感想に近い段落」（段落単位）に使う。
+
+行列はディレクトリに .npy で保存し、読み込むときは mmap するので起動時に
+ファイル全体を読まない。チャット画面は load_index('works') を起動時に1回だけ開き、
+選んだ作品に似た作品を表示する。
+
+    python tfidf_engine.py build [--catalog authors.tsv] [--out out_tfidf]
+    python tfidf_engine.py query "感想の文章" [--unit passages] [-k 5]
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+ngram = 2  # 文字n-gramの長さ
+index_dir = Path('./out_tfidf/')  # 保存先（単位ごとのサブディレクトリを作る）
+UNITS = ('works', 'passages')
+
+ARRAY_NAMES = ('vocab', 'idf', 'indptr', 'indices', 'data', 't_indptr', 't_indices', 't_data')
+
+
+def char_ngrams(text, n=ngram):
+    """改行・空白を除いた文字n-gram（n文字に満たない場合はその文字列）"""
+    chars = ''.join(text.split())
+    if len(chars) < n:
+        return [chars] if chars else []
+    return [chars[i:i + n] for i in range(len(chars) - n + 1)]
+
+
+def _count(grams):
+    counts = {}
+    for gram in grams:
+        counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+def _transpose(indptr, indices, data, n_cols):
+    """CSR（文書×語）を語×文書の CSR（転置インデックス）にする"""
+    order = np.argsort(indices, kind='stable')
+    rows = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+    t_indptr = np.zeros(n_cols + 1, dtype=np.int64)
+    t_indptr[1:] = np.cumsum(np.bincount(indices, minlength=n_cols))
+    return t_indptr, rows[order], data[order]
+
+
+class TfidfIndex:
+    """文書×語の TF-IDF 行列（行はL2正規化済み）と、その転置"""
+
+    def __init__(self, arrays, docs):
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.docs = docs  # 文書ごとのラベル（author, title, passage など）
+
+    @property
+    def n_docs(self):
+        return len(self.indptr) - 1
+
+    @property
+    def ngram_len(self):
+        # 語彙は n 文字の固定長文字列の配列として保存している
+        return self.vocab.dtype.itemsize // 4
+
+    @classmethod
+    def build(cls, texts, docs, n=ngram):
+        """texts: 文書の本文のリスト、docs: 文書ごとのラベル（JSONにできるもの）のリスト"""
+        doc_counts = [_count(char_ngrams(text, n)) for text in texts]
+        vocab = sorted(set().union(*doc_counts)) if doc_counts else []
+        term_ids = {term: i for i, term in enumerate(vocab)}
+        n_docs = len(texts)
+
+        indptr = np.zeros(n_docs + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(c) for c in doc_counts])
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        tf = np.empty(indptr[-1], dtype=np.float32)
+        for i, counts in enumerate(doc_counts):
+            lo, hi = indptr[i], indptr[i + 1]
+            ids = np.fromiter((term_ids[t] for t in counts), dtype=np.int32, count=hi - lo)
+            order = np.argsort(ids)
+            indices[lo:hi] = ids[order]
+            tf[lo:hi] = np.fromiter(counts.values(), dtype=np.float32, count=hi - lo)[order]
+
+        df = np.bincount(indices, minlength=len(vocab))
+        idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+        data = (1 + np.log(tf)) * idf[indices]
+        rows = np.repeat(np.arange(n_docs), np.diff(indptr))
+        norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=n_docs))
+        data /= np.where(norms > 0, norms, 1)[rows].astype(np.float32)
+
+        t_indptr, t_indices, t_data = _transpose(indptr, indices, data, len(vocab))
+        arrays = {
+            'vocab': np.array(vocab, dtype=f'<U{n}'),
+            'idf': idf, 'indptr': indptr, 'indices': indices, 'data': data,
+            't_indptr': t_indptr, 't_indices': t_indices, 't_data': t_data,
+        }
+        return cls(arrays, docs)
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(path / f'{name}.npy', getattr(self, name))
+        tmp_path = path / 'docs.json.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.docs, f, ensure_ascii=False)
+        os.replace(tmp_path, path / 'docs.json')
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """保存した行列を mmap で開く（mmap_mode=None ならメモリに読み込む）"""
+        path = Path(path)
+        arrays = {name: np.load(path / f'{name}.npy', mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        with open(path / 'docs.json', encoding='utf-8') as f:
+            docs = json.load(f)
+        return cls(arrays, docs)
+
+    def containing_ids(self, part):
+        """part を含む語のid（語彙を文字コードの2次元配列として見て、位置ごとに比べる）"""
+        n = self.ngram_len
+        codes = np.asarray(self.vocab).view(np.uint32).reshape(len(self.vocab), n)
+        query = np.frombuffer(part.encode('utf-32-le'), dtype=np.uint32)
+        mask = np.zeros(len(self.vocab), dtype=bool)
+        for pos in range(n - len(query) + 1):
+            mask |= (codes[:, pos:pos + len(query)] == query).all(axis=1)
+        return np.flatnonzero(mask).astype(np.int32)
+
+    def vectorize(self, text):
+        """
+        クエリの文字列を (語のid, 重み) の疎ベクトルにする（L2正規化済み）
+        n 文字に満たないクエリ（「針」など）は語彙に無いので、その文字列を含む語をすべて使う
+        """
+        counts = _count(char_ngrams(text, self.ngram_len))
+        if not counts or not len(self.vocab):
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        (gram, *rest) = counts
+        if not rest and len(gram) < self.ngram_len:
+            ids = self.containing_ids(gram)
+            weights = self.idf[ids]
+            norm = np.sqrt((weights ** 2).sum())
+            return ids, (weights / norm if norm > 0 else weights)
+        grams = np.array(list(counts), dtype=self.vocab.dtype)
+        pos = np.searchsorted(self.vocab, grams)
+        pos = np.minimum(pos, len(self.vocab) - 1)
+        known = self.vocab[pos] == grams
+        ids = pos[known].astype(np.int32)
+        tf = np.array(list(counts.values()), dtype=np.float32)[known]
+        weights = (1 + np.log(tf)) * self.idf[ids]
+        norm = np.sqrt((weights ** 2).sum())
+        return ids, (weights / norm if norm > 0 else weights)
+
+    def doc_vector(self, doc):
+        """文書 doc の行ベクトル（語のid, 重み）"""
+        lo, hi = self.indptr[doc], self.indptr[doc + 1]
+        return np.asarray(self.indices[lo:hi]), np.asarray(self.data[lo:hi])
+
+    def cosine(self, vectors):
+        """疎ベクトルのリストと全文書のコサイン類似度（クエリ数×文書数の行列）"""
+        scores = np.zeros((len(vectors), self.n_docs), dtype=np.float32)
+        # 同じ語を含むクエリをまとめ、語ごとに転置インデックスの列を1回だけ読む
+        query_terms = {}
+        for q, (ids, weights) in enumerate(vectors):
+            for term, weight in zip(ids.tolist(), weights.tolist()):
+                query_terms.setdefault(term, ([], []))
+                query_terms[term][0].append(q)
+                query_terms[term][1].append(weight)
+        for term, (qs, weights) in query_terms.items():
+            lo, hi = self.t_indptr[term], self.t_indptr[term + 1]
+            docs = np.asarray(self.t_indices[lo:hi])
+            values = np.asarray(self.t_data[lo:hi])
+            scores[np.ix_(qs, docs)] += np.outer(np.asarray(weights, dtype=np.float32), values)
+        return scores
+
+    def _top_k(self, scores, k, exclude=None):
+        results = []
+        for q, row in enumerate(scores):
+            if exclude is not None:
+                row[exclude[q]] = -np.inf
+            kk = min(k, len(row))
+            if kk == 0:
+                results.append([])
+                continue
+            top = np.argpartition(-row, kk - 1)[:kk]
+            top = top[np.argsort(-row[top], kind='stable')]
+            results.append([(self.docs[i], float(row[i])) for i in top if row[i] > 0])
+        return results
+
+    def search(self, queries, k=5):
+        """クエリの文字列のリストそれぞれについて、(ラベル, 類似度) の上位 k 件を返す"""
+        return self._top_k(self.cosine([self.vectorize(q) for q in queries]), k)
+
+    def similar(self, doc_ids, k=5):
+        """文書番号のリストそれぞれについて、似た文書（自分自身は除く）の上位 k 件を返す"""
+        return self._top_k(self.cosine([self.doc_vector(d) for d in doc_ids]), k, exclude=doc_ids)
+
+    def find(self, **label):
+        """ラベルが一致する最初の文書番号（無ければNone）"""
+        for i, doc in enumerate(self.docs):
+            if all(doc.get(key) == value for key, value in label.items()):
+                return i
+        return None
+
+
+def load_index(unit='works', out_dir=index_dir):
+    """保存した行列を mmap で開く（まだ build していなければNone）"""
+    path = Path(out_dir) / unit
+    if not (path / 'docs.json').exists():
+        return None
+    return TfidfIndex.load(path)
+
+
+def iter_corpus_docs(catalog, unit='works'):
+    """作家の整形済みコーパスから (本文, ラベル) を順に返す"""
+    import aozora_preprocess as ap
+    from aozora_corpus import CorpusReader
+    from passage_index import chunk_text
+
+    for a_id, a_name in catalog.items():
+        corpus_path = ap.author_corpus_file(a_id)
+        if not corpus_path.exists():
+            continue
+        with CorpusReader(corpus_path) as corpus:
+            for title, text in corpus.iter_works():
+                if unit == 'works':
+                    yield text, {'author': a_name, 'title': title}
+                else:
+                    for i, passage in enumerate(chunk_text(text)):
+                        yield passage, {'author': a_name, 'title': title, 'passage': i}
+
+
+def build(catalog, out_dir=index_dir):
+    for unit in UNITS:
+        texts, docs = [], []
+        for text, doc in iter_corpus_docs(catalog, unit):
+            texts.append(text)
+            docs.append(doc)
+        index = TfidfIndex.build(texts, docs)
+        index.save(Path(out_dir) / unit)
+        print(f'{unit}: {index.n_docs} docs, {len(index.vocab)} terms, {len(index.data)} nonzeros')
+
+
+if __name__ == '__main__':
+    import aozora_preprocess as ap
+
+    parser = argparse.ArgumentParser(description='整形済みコーパスの TF-IDF 類似検索')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_build = sub.add_parser('build', help='TF-IDF 行列を作って保存する')
+    p_build.add_argument('--catalog', default=str(ap.catalog_file), help='作家の一覧（TSV）')
+    p_build.add_argument('--out', default=str(index_dir), help='保存先')
+    p_query = sub.add_parser('query', help='文章に近い作品・段落を探す')
+    p_query.add_argument('text', nargs='+', help='クエリ（複数指定するとまとめて検索する）')
+    p_query.add_argument('--unit', choices=UNITS, default='works')
+    p_query.add_argument('-k', type=int, default=5)
+    p_query.add_argument('--out', default=str(index_dir), help='保存先')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(ap.load_catalog(args.catalog), args.out)
+    else:
+        index = TfidfIndex.load(Path(args.out) / args.unit)
+        for text, hits in zip(args.text, index.search(args.text, args.k)):
+            print(f'# {text}')
+            for doc, score in hits:
+                print(f'{score:.3f}\t' + '\t'.join(str(v) for v in doc.values()))
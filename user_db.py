@@ -0,0 +1,327 @@
+"""
+ユーザー・会話・メッセージ・評価のテーブル
+
+    USER         : アカウント（username は一意）
+    CONVERSATION : ユーザーと作品の会話（要約を持つ、id は画面のクエリパラメータ id）
+                   対話終了で ended を記録し、終了した会話には続けて書き込まない
+                   会話は open_conversation で作成し、チャット画面は owns_conversation で確かめてから使う
+    MESSAGE      : 会話のメッセージ（1件1行、id の順に並べる）
+                   発言のたびに append_message で1行追加し、画面は fetch_messages で履歴を復元する
+    EVALUATION   : 会話の創造性評価のスコア（評価するたびに1行追加する）
+    RUNNING_SUMMARY : 会話の途中までの要約と、それが何往復分か（1往復ごとの要約ジョブが更新する）
+
+以前は USER テーブルの1行にアカウント・選択中の作品・会話の JSON・要約・スコアを
+まとめて持っていた。その形式のデータベースは次のコマンドでこの形式に変換する
+（変換前にバックアップを作る。何度実行してもよい）。アプリの起動時（init_db）にも、
+以前の形式ならバックアップを作ってから変換する。
+
+    python user_db.py [--db literary_app.db] [--no-backup]
+
+以前の USER テーブルの各行の id は、そのまま会話の id として引き継ぐ
+（ジョブや要約の記録、評価ページの URL がそのまま使える）。
+"""
+import argparse
+import json
+import sqlite3
+import time
+
+import database
+
+SCHEMA_VERSION = 4  # PRAGMA user_version に記録する
+SCORE_COLUMNS = ["Relevance", "Creativity", "Flexibility", "Problem_Solving", "Insight"]
+
+
+def init_user_tables(conn):
+    _create_user_tables(conn)
+    conn.commit()
+
+
+def _create_user_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS USER (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS CONVERSATION (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER REFERENCES USER (id),
+            author TEXT,
+            title TEXT,
+            summary TEXT,
+            created REAL,
+            updated REAL,
+            ended REAL
+        )
+    ''')
+    # バージョン 2 の CONVERSATION には ended が無い
+    if "ended" not in {row[1] for row in conn.execute("PRAGMA table_info(CONVERSATION)")}:
+        conn.execute("ALTER TABLE CONVERSATION ADD COLUMN ended REAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_conversation_user ON CONVERSATION (user_id, author, title)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS MESSAGE (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER NOT NULL REFERENCES CONVERSATION (id),
+            role TEXT,
+            content TEXT,
+            created REAL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_message_conversation ON MESSAGE (conversation_id, id)")
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS EVALUATION (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER NOT NULL REFERENCES CONVERSATION (id),
+            {", ".join(f"{name} INTEGER" for name in SCORE_COLUMNS)},
+            created REAL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_evaluation_conversation ON EVALUATION (conversation_id, id)")
+    # バージョン 3 までの RUNNING_SUMMARY は (id TEXT, username, title) をキーにしていた
+    old_summary = "username" in {row[1] for row in conn.execute("PRAGMA table_info(RUNNING_SUMMARY)")}
+    if old_summary:
+        conn.execute("ALTER TABLE RUNNING_SUMMARY RENAME TO RUNNING_SUMMARY_OLD")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS RUNNING_SUMMARY (
+            conversation_id INTEGER PRIMARY KEY REFERENCES CONVERSATION (id),
+            summary TEXT,
+            turns INTEGER
+        )
+    ''')
+    if old_summary:
+        conn.execute(
+            "INSERT OR REPLACE INTO RUNNING_SUMMARY (conversation_id, summary, turns) "
+            "SELECT CAST(id AS INTEGER), summary, turns FROM RUNNING_SUMMARY_OLD WHERE id GLOB '[0-9]*'"
+        )
+        conn.execute("DROP TABLE RUNNING_SUMMARY_OLD")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def drop_user_tables(conn):
+    """ユーザー・会話・メッセージ・評価のテーブルを削除する"""
+    with conn:
+        for table in ("MESSAGE", "EVALUATION", "RUNNING_SUMMARY", "CONVERSATION", "USER"):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def needs_migration(conn):
+    """USER テーブルが以前の形式（会話の JSON などを持つ）なら True"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(USER)")}
+    return "conversation" in columns
+
+
+def _parse_messages(conversation):
+    """以前の conversation 列の JSON をメッセージのリストにする（読めなければ空）"""
+    if not conversation:
+        return []
+    try:
+        messages = json.loads(conversation)
+    except json.JSONDecodeError:
+        return []
+    return [m for m in messages if isinstance(m, dict) and "role" in m and "content" in m]
+
+
+def migrate(conn):
+    """
+    以前の形式の USER テーブルを、USER / CONVERSATION / MESSAGE / EVALUATION に変換する
+    全体を1つのトランザクションで行い、変換した件数を返す（以前の形式でなければ何もしない）
+    """
+    counts = {"users": 0, "conversations": 0, "messages": 0, "evaluations": 0}
+    if not needs_migration(conn):
+        return counts
+
+    now = time.time()
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # テーブルの作り直しも含めて自分でトランザクションを管理する
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if not needs_migration(conn):
+            # 同時に起動した別のプロセスが先に変換した
+            conn.execute("ROLLBACK")
+            return counts
+        conn.execute("ALTER TABLE USER RENAME TO USER_LEGACY")
+        _create_user_tables(conn)
+        rows = conn.execute(
+            f"SELECT id, username, password, author, title, conversation, summary, {', '.join(SCORE_COLUMNS)} "
+            "FROM USER_LEGACY ORDER BY id"
+        ).fetchall()
+
+        # 同じ username の行は最初の行をアカウントにする（パスワードは最初に登録されたもの）
+        user_ids = {}
+        for row_id, username, password, *_ in rows:
+            if username is None:
+                continue
+            if username not in user_ids:
+                user_ids[username] = row_id
+                conn.execute("INSERT INTO USER (id, username, password) VALUES (?, ?, ?)",
+                             (row_id, username, password))
+                counts["users"] += 1
+            elif password is not None:
+                conn.execute("UPDATE USER SET password = COALESCE(password, ?) WHERE id = ?",
+                             (password, user_ids[username]))
+
+        # 作品を選んだ行・会話や評価がある行は会話にする
+        for row_id, username, _, author, title, conversation, summary, *scores in rows:
+            if title is None and conversation is None and summary is None and all(s is None for s in scores):
+                continue
+            conn.execute(
+                "INSERT INTO CONVERSATION (id, user_id, author, title, summary, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row_id, user_ids.get(username), author, title, summary, now, now),
+            )
+            counts["conversations"] += 1
+            messages = _parse_messages(conversation)
+            conn.executemany(
+                "INSERT INTO MESSAGE (conversation_id, role, content, created) VALUES (?, ?, ?, ?)",
+                [(row_id, m["role"], m["content"], now) for m in messages],
+            )
+            counts["messages"] += len(messages)
+            if any(s is not None for s in scores):
+                conn.execute(
+                    f"INSERT INTO EVALUATION (conversation_id, {', '.join(SCORE_COLUMNS)}, created) "
+                    f"VALUES (?, {', '.join('?' * len(SCORE_COLUMNS))}, ?)",
+                    (row_id, *scores, now),
+                )
+                counts["evaluations"] += 1
+
+        conn.execute("DROP TABLE USER_LEGACY")
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+    return counts
+
+
+# 対話終了・要約・評価のどれもまだ無い会話
+OPEN_CONVERSATION = """
+    ended IS NULL AND summary IS NULL
+    AND NOT EXISTS (SELECT 1 FROM EVALUATION e WHERE e.conversation_id = CONVERSATION.id)
+"""
+
+
+def open_conversation(username, author, title):
+    """
+    ユーザーと作品の会話の id を返す
+    続きの会話（終了していない最後の会話）があればそれを、無ければ新しく作成する
+    """
+    now = time.time()
+    with database.connection() as conn, conn:
+        user_id = conn.execute("SELECT id FROM USER WHERE username = ?", (username,)).fetchone()
+        user_id = user_id[0] if user_id else None
+        row = conn.execute(
+            f"""
+            SELECT id FROM CONVERSATION
+             WHERE user_id IS ? AND author = ? AND title = ? AND {OPEN_CONVERSATION}
+             ORDER BY id DESC
+             LIMIT 1
+            """,
+            (user_id, author, title),
+        ).fetchone()
+        if row:
+            return row[0]
+        cur = conn.execute(
+            "INSERT INTO CONVERSATION (user_id, author, title, created, updated) VALUES (?, ?, ?, ?, ?)",
+            (user_id, author, title, now, now),
+        )
+        return cur.lastrowid
+
+
+def is_open(conversation_id):
+    """会話がまだ終了していなければ True（無い会話も、これから作成するので True）"""
+    with database.connection() as conn:
+        row = conn.execute(
+            f"SELECT {OPEN_CONVERSATION} FROM CONVERSATION WHERE id = ?", (conversation_id,)
+        ).fetchone()
+    return row is None or bool(row[0])
+
+
+def end_conversation(conversation_id):
+    """対話終了を記録する（要約はジョブで作成するので、作成し終わるまでは空にしておく）"""
+    now = time.time()
+    with database.connection() as conn, conn:
+        conn.execute(
+            "UPDATE CONVERSATION SET summary = NULL, ended = COALESCE(ended, ?), updated = ? WHERE id = ?",
+            (now, now, conversation_id),
+        )
+
+
+def owns_conversation(conversation_id, username):
+    """会話がユーザーのものなら True（無い会話・他のユーザーの会話なら False）"""
+    with database.connection() as conn:
+        row = conn.execute(
+            """
+            SELECT 1 FROM CONVERSATION c JOIN USER u ON u.id = c.user_id
+             WHERE c.id = ? AND u.username = ?
+            """,
+            (conversation_id, username),
+        ).fetchone()
+    return row is not None
+
+
+def append_message(conversation_id, role, content):
+    """会話にメッセージを1件追加する（会話の長さによらず1行書き込むだけ）"""
+    with database.connection() as conn, conn:
+        conn.execute(
+            "INSERT INTO MESSAGE (conversation_id, role, content, created) VALUES (?, ?, ?, ?)",
+            (conversation_id, role, content, time.time()),
+        )
+
+
+def fetch_messages(conversation_id):
+    """会話のメッセージを追加した順に {"role", "content"} のリストで返す"""
+    with database.connection() as conn:
+        rows = conn.execute(
+            "SELECT role, content FROM MESSAGE WHERE conversation_id = ? ORDER BY id", (conversation_id,)
+        ).fetchall()
+    return [{"role": role, "content": content} for role, content in rows]
+
+
+def backup(conn):
+    """データベースファイルの隣にバックアップを作り、そのパスを返す"""
+    db_path = conn.execute("PRAGMA database_list").fetchone()[2]
+    backup_path = f'{db_path}.{time.strftime("%Y%m%d%H%M%S")}.bak'
+    dst = sqlite3.connect(backup_path)
+    try:
+        conn.backup(dst)
+    finally:
+        dst.close()
+    return backup_path
+
+
+def init_db(conn):
+    """
+    アプリのテーブルを用意する
+    以前の形式の USER テーブルなら、バックアップを作ってから変換する（python user_db.py と同じ）
+    """
+    if needs_migration(conn):
+        print(f'backup: {backup(conn)}')
+        migrate(conn)
+    init_user_tables(conn)
+
+
+def main(db_path=database.db_file, backup_first=True):
+    conn = database.connect(db_path)
+    try:
+        if not needs_migration(conn):
+            init_user_tables(conn)
+            print(f'{db_path}: already migrated')
+            return
+        if backup_first:
+            print(f'backup: {backup(conn)}')
+        counts = migrate(conn)
+    finally:
+        conn.close()
+    print(f'{db_path}: ' + ', '.join(f'{count} {name}' for name, count in counts.items()) + ' migrated')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='以前の形式の USER テーブルを正規化したテーブルに変換する')
+    parser.add_argument('--db', default=database.db_file, help='SQLiteのデータベースファイル')
+    parser.add_argument('--no-backup', action='store_true', help='変換前にバックアップを作らない')
+    args = parser.parse_args()
+    main(args.db, backup_first=not args.no_backup)